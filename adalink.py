@@ -12,5 +12,12 @@
 import adalink.main
 
 
+def _core_imports():
+    # Never called.  The cores are imported by name only when they're used,
+    # so import each of them here for PyInstaller to find and package.
+    from adalink.cores import atsamd21g18, lpc824, lpc1343, nrf51822, \
+        nrf52832, nrf52840, stm32f2
+
+
 if __name__ == '__main__':
     adalink.main.main()
@@ -1,7 +1,37 @@
 # Core base class
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import click
 
+from . import history
+from . import timing
 from .errors import AdaLinkError
+from .flash import FlashGeometry
+from .image import Image, bin_to_hex
+from .programmers import Sim
+from .programmers.base import mismatched_ranges, segment_ranges
+from .registers import block_values, echo_fields, field_reads, plan_reads, read_values
+
+
+# Flash page size used to simulate cores with no uniform flash page size, like
+# the STM32F2's mix of 16, 64 and 128KB sectors.
+SIM_PAGE_SIZE = 16*1024
+
+# Most mismatched address ranges listed when verifying fails.
+VERIFY_LISTED_RANGES = 8
+
+# Options which read memory, and the bit width each reads (None for a range).
+READ_OPTIONS = (('read_mem_8', 8), ('read_mem_16', 16), ('read_mem_32', 32),
+                ('read_mem_range', None))
+
+# Number of unchanged flash pages checked after delta programming, to catch
+# boards which were changed since the history's last run on them.
+SPOT_CHECK_PAGES = 4
 
 
 class HexInt(click.ParamType):
@@ -22,11 +52,42 @@ class HexInt(click.ParamType):
 
 class Core(click.Command):
 
+    # List of registers.Field instances displayed by the default info
+    # implementation.  Cores should fill this in to describe their info.
+    info_fields = []
+
+    # Size in bytes of a flash page, the smallest unit the core's flash can be
+    # erased in.  Programmed data in the same page is merged into a single
+    # write, and differential programming compares flash page by page.  Cores
+    # with uniform pages should set this, None disables both.
+    flash_page_size = None
+
+    # (start address, size in bytes) of the core's flash and RAM, used to model
+    # the target for the simulated programmer.
+    flash_region = None
+    ram_region = None
+
+    # flash.FlashGeometry with the sectors of the core's flash, used to erase
+    # only the sectors an image is written to.  Cores with uniform pages get
+    # one built from flash_region and flash_page_size, cores with a mix of
+    # sector sizes should set this.
+    flash_geometry = None
+
+    # Fields (see registers.py) which read the device's unique ID and its
+    # address, like a BLE address, recorded in the history for each run.
+    device_id_field = None
+    device_addr_field = None
+
     def __init__(self, name=None):
         # Default to the name of the class if one isn't specified.
         if name is None:
             name = self.__class__.__name__.lower()
         self.name = name
+        if self.flash_geometry is None and self.flash_region is not None and \
+           self.flash_page_size is not None:
+            self.flash_geometry = FlashGeometry.uniform(self.flash_region[0],
+                                                        self.flash_region[1],
+                                                        self.flash_page_size)
         # Build the standard list of parameters that a core can take.
         params = []
         params.append(click.Option(param_decls=['-p', '--programmer'],
@@ -49,57 +110,447 @@ class Core(click.Command):
                                    type=(click.Path(exists=True), HexInt()),
                                    metavar='PATH ADDRESS',
                                    help='Program the specified .bin file at the provided address. Address can be specified in hex, like 0x00FF.  Can be specified multiple times.'))
+        params.append(click.Option(param_decls=['--erase-sectors'],
+                                   is_flag=True,
+                                   help='Erase only the flash sectors the provided hex/bin files are written to, instead of the whole chip, keeping the rest of flash intact.'))
+        params.append(click.Option(param_decls=['--diff'],
+                                   is_flag=True,
+                                   help='Only erase and program the flash pages that differ from the provided hex/bin files.'))
+        params.append(click.Option(param_decls=['--delta'],
+                                   is_flag=True,
+                                   help='Only erase and program the flash pages that changed since the image the history says the board last received, without reading flash back.  Boards which aren\'t in the history are programmed like --diff.'))
+        params.append(click.Option(param_decls=['--skip-identical'],
+                                   is_flag=True,
+                                   help='Skip wiping and programming if the target already holds the provided hex/bin files.'))
+        params.append(click.Option(param_decls=['--verify'],
+                                   is_flag=True,
+                                   help='Check the target holds the provided hex/bin files after programming, and list any address ranges which don\'t match.'))
+        params.append(click.Option(param_decls=['-g', '--gang'],
+                                   multiple=True,
+                                   metavar='SERIAL',
+                                   help='Wipe and program the boards attached to each probe with the specified serial number at the same time.  Can be specified multiple times.'))
+        params.append(click.Option(param_decls=['--progress'],
+                                   is_flag=True,
+                                   help='Display the progress reported by the programmer while it runs.'))
         params.append(click.Option(param_decls=['-r8', '--read-mem-8'],
-                                   multiple=False,
+                                   multiple=True,
                                    nargs=1,
                                    type=HexInt(),
                                    metavar='ADDRESS',
-                                   help='Read 1 byte of memory from the specified address (can be hex, like 0x1234ABCD).'))
+                                   help='Read 1 byte of memory from the specified address (can be hex, like 0x1234ABCD).  Can be specified multiple times.'))
         params.append(click.Option(param_decls=['-r16', '--read-mem-16'],
-                                   multiple=False,
+                                   multiple=True,
                                    nargs=1,
                                    type=HexInt(),
                                    metavar='ADDRESS',
-                                   help='Read 2 bytes of memory from the specified address (can be hex, like 0x1234ABCD).'))
+                                   help='Read 2 bytes of memory from the specified address (can be hex, like 0x1234ABCD).  Can be specified multiple times.'))
         params.append(click.Option(param_decls=['-r32', '--read-mem-32'],
-                                   multiple=False,
+                                   multiple=True,
                                    nargs=1,
                                    type=HexInt(),
                                    metavar='ADDRESS',
-                                   help='Read 4 bytes of memory from the specified address (can be hex, like 0x1234ABCD).'))
+                                   help='Read 4 bytes of memory from the specified address (can be hex, like 0x1234ABCD).  Can be specified multiple times.'))
+        params.append(click.Option(param_decls=['-rr', '--read-mem-range'],
+                                   multiple=True,
+                                   nargs=2,
+                                   type=(HexInt(), HexInt()),
+                                   metavar='ADDRESS LENGTH',
+                                   help='Read LENGTH bytes of memory starting at the specified address.  Read as 32-bit words when the address and length are multiples of 4.  Can be specified multiple times.'))
+        params.append(click.Option(param_decls=['--dump'],
+                                   multiple=True,
+                                   nargs=3,
+                                   type=(HexInt(), HexInt(), click.Path(dir_okay=False, writable=True)),
+                                   metavar='START LENGTH FILE',
+                                   help='Save LENGTH bytes of memory starting at the START address to FILE, as Intel HEX if FILE ends in .hex and raw binary otherwise.  Can be specified multiple times.'))
         super(Core, self).__init__(self.name, params=params, callback=self._callback,
                                    short_help=self.__doc__, help=self.__doc__)
 
-    def _callback(self, programmer, wipe, info, program_hex, program_bin, read_mem_8, read_mem_16, read_mem_32):
-        # Create the programmer that was specified.
-        programmer = self.create_programmer(programmer)
-        # Check that programmer is connected to device.
-        if not programmer.is_connected():
-            raise AdaLinkError('Could not find {0}, is it connected?'.format(self.name))
-        # Wipe flash memory if requested.
-        if wipe:
-            programmer.wipe()
-        # Program any specified hex/bin files.
+    def _callback(self, programmer, wipe, info, program_hex, program_bin,
+                  erase_sectors, diff, delta, skip_identical, verify, gang, progress,
+                  read_mem_8, read_mem_16, read_mem_32, read_mem_range, dump):
+        self.check_options(wipe, len(program_hex) + len(program_bin) > 0,
+                           erase_sectors, diff, verify, delta)
+        # Describe the run in the timing profile, if one is being recorded.
+        files = list(program_hex) + [f for f, address in program_bin]
+        timing.tag(core=self.name, programmer=programmer,
+                   files=[{'path': f, 'bytes': os.path.getsize(f)} for f in files])
+        # Merge any specified hex/bin files into one image so each contiguous
+        # range is written just once.
+        image = None
         if len(program_hex) > 0 or len(program_bin) > 0:
-            programmer.program(program_hex, program_bin)
+            with timing.span('load'):
+                image = Image.from_files(program_hex, program_bin)
+            timing.tag(image_bytes=len(image))
+        if len(gang) > 0:
+            if info or read_mem_8 or read_mem_16 or read_mem_32 or read_mem_range or dump:
+                raise AdaLinkError('The --gang option can only be used to wipe and program.')
+            self._gang(programmer, gang, wipe, image, erase_sectors, diff,
+                       skip_identical, verify, progress, delta)
+            return
+        # Create the programmer that was specified.  This finds the
+        # programmer's tool and checks its version.
+        with timing.span('discovery'):
+            programmer = self.create_programmer(programmer)
+        if progress:
+            programmer.progress_callback = self._echo_progress
+        # Read and print out memory if requested.  All the reads are done
+        # together in one batch and printed in the order of the options, which
+        # click processes (and adds to the context's params) in the order they
+        # are first given.  Each option's reads stay in their own order.
+        values = {'read_mem_8': read_mem_8, 'read_mem_16': read_mem_16,
+                  'read_mem_32': read_mem_32, 'read_mem_range': read_mem_range}
+        widths = dict(READ_OPTIONS)
+        names = [n for n in click.get_current_context().params if n in widths]
+        names.extend(n for n, width in READ_OPTIONS if n not in names)
+        order = []
+        blocks = []
+        for name in names:
+            for value in values[name]:
+                order.append(name)
+                if widths[name] is not None:
+                    blocks.append((value, 1, widths[name]))
+                    continue
+                address, length = value
+                if address % 4 == 0 and length % 4 == 0:
+                    blocks.append((address, length // 4, 32))
+                else:
+                    blocks.append((address, length, 8))
+        # The default info display reads the info fields along with the other
+        # reads, cores with their own info display it after.
+        info_reads = []
+        if info and type(self).info == Core.info:
+            info_reads = field_reads(programmer, self.info_fields)
+        info_blocks = plan_reads(info_reads)
+        result, (info_results, results) = self._run(
+            programmer, wipe, image, erase_sectors, diff, skip_identical, verify,
+            [info_blocks, blocks], delta=delta)
+        if result is not None:
+            click.echo(result)
         # Display information if requested.
         if info:
-            self.info(programmer)
-        # Read and print out memory if requested.
-        # First make sure only one read memory command was requested (otherwise
-        # it's ambiguous which one to use or the order to return results).
-        f = [x for x in [read_mem_8, read_mem_16, read_mem_32] if x != None]
-        if len(f) > 1:
-            raise AdaLinkError('Only one read memory command can be specified at a time.')
-        if read_mem_8 is not None:
-            value = programmer.readmem8(read_mem_8)
-            click.echo('0x{0:0X}'.format(value))
-        if read_mem_16 is not None:
-            value = programmer.readmem16(read_mem_16)
-            click.echo('0x{0:0X}'.format(value))
-        if read_mem_32 is not None:
-            value = programmer.readmem32(read_mem_32)
-            click.echo('0x{0:0X}'.format(value))
+            if len(info_reads) > 0:
+                echo_fields(programmer, self.info_fields,
+                            block_values(info_reads, info_blocks, info_results))
+            elif type(self).info != Core.info:
+                with timing.span('info'):
+                    self.info(programmer)
+        for name, (address, count, width), values in zip(order, blocks, results):
+            if name == 'read_mem_range':
+                self._echo_block(address, width, values)
+            else:
+                click.echo('0x{0:0X}'.format(values[0]))
+        # Save memory to files if requested.
+        for address, length, path in dump:
+            self._dump(programmer, address, length, path)
+
+    def check_options(self, wipe, program, erase_sectors, diff, verify, delta=False):
+        """Raise an error if the provided wipe and programming options can't
+        be used together or with this core.  Program is true if there are any
+        hex/bin files to program.
+        """
+        if diff and wipe:
+            raise AdaLinkError('The --diff and --wipe options can\'t be used together.')
+        if diff and self.flash_page_size is None:
+            raise AdaLinkError('The --diff option isn\'t supported by {0}.'.format(self.name))
+        if erase_sectors and (wipe or diff):
+            raise AdaLinkError('The --erase-sectors option can\'t be used with --wipe or --diff.')
+        if erase_sectors and self.flash_geometry is None:
+            raise AdaLinkError('The --erase-sectors option isn\'t supported by {0}.'.format(self.name))
+        if delta and (wipe or diff or erase_sectors):
+            raise AdaLinkError('The --delta option can\'t be used with --wipe, --diff or --erase-sectors.')
+        if delta and (self.flash_page_size is None or self.device_id_field is None):
+            raise AdaLinkError('The --delta option isn\'t supported by {0}.'.format(self.name))
+        if delta and history.active() is None:
+            raise AdaLinkError('The --delta option needs the --history option.')
+        if (verify or erase_sectors or delta) and not program:
+            raise AdaLinkError('The --{0} option needs hex/bin files to program.'.format(
+                'verify' if verify else 'erase-sectors' if erase_sectors else 'delta'))
+
+    def _run(self, programmer, wipe, image, erase_sectors, diff, skip_identical,
+             verify=False, reads=[], writes=[], delta=False):
+        """Check the device is connected, wipe it and program (and verify) the
+        image (if not None) as requested, erasing just the sectors it's
+        written to if erase_sectors is true or the pages which changed since
+        the history's last run on the device if delta is true, then write the provided list of
+        (address, value, width) words and read each of the provided list of
+        lists of (address, count, width) blocks.  Returns a message describing
+        the result (or None), and a list with the results of each list of
+        reads.  When the history is on, runs which wipe or program are
+        recorded to it along with the device's ID and address.
+        """
+        if history.active() is None or (not wipe and image is None):
+            return self._run_steps(programmer, wipe, image, erase_sectors, diff,
+                                   skip_identical, verify, reads, writes, delta)
+        # The device's ID and address are read along with the other reads.
+        fields = [f for f in (self.device_id_field, self.device_addr_field)
+                  if f is not None and f.applies_to(programmer)]
+        id_reads = field_reads(programmer, fields)
+        id_blocks = plan_reads(id_reads)
+        run = {
+            'core': self.name,
+            'programmer': programmer.name,
+            'probe': programmer.probe,
+            'image_hash': None if image is None else image.digest(),
+            'image_bytes': None if image is None else len(image)
+        }
+        start = time.time()
+        with timing.collect() as phases:
+            try:
+                result, results = self._run_steps(programmer, wipe, image, erase_sectors,
+                                                  diff, skip_identical, verify,
+                                                  list(reads) + [id_blocks], writes, delta)
+            except Exception as ex:
+                history.record(ok=False, error=str(ex), seconds=time.time() - start,
+                               phases=phases, **run)
+                raise
+        if len(id_blocks) > 0:
+            values = block_values(id_reads, id_blocks, results[-1])
+            for key, field in (('device_id', self.device_id_field),
+                               ('device_addr', self.device_addr_field)):
+                if field in fields:
+                    run[key] = field.decode(*[values[r] for r in field.reads])
+        history.record(ok=True, result=result, seconds=time.time() - start,
+                       phases=phases, **run)
+        # Remember the image's pages so later runs know what's on the device.
+        if image is not None and self.flash_page_size is not None:
+            history.add_image(image, self.flash_page_size, run['image_hash'])
+        return result, results[:-1]
+
+    def _run_steps(self, programmer, wipe, image, erase_sectors, diff, skip_identical,
+                   verify, reads, writes, delta=False):
+        # Run the steps of _run.
+        transaction = programmer.transaction()
+        if image is not None and (diff or skip_identical or delta):
+            # Comparing the image with the target decides what to program, so
+            # the connection is kept open over a session between the steps.
+            with programmer.session():
+                with timing.span('connect'):
+                    connected = programmer.is_connected()
+                if not connected:
+                    raise AdaLinkError('Could not find {0}, is it connected?'.format(self.name))
+                result = self._flash(programmer, wipe, image, erase_sectors, diff,
+                                     skip_identical, verify, delta)
+                if len(writes) > 0:
+                    transaction.writemem_words(writes)
+                steps = [transaction.readmem_blocks(b) if len(b) > 0 else None for b in reads]
+                transaction.run()
+        else:
+            # Otherwise every step, from checking the connection to the reads,
+            # runs together as one transaction with a single run of the tool.
+            result = None
+            connected = transaction.is_connected()
+            if wipe:
+                transaction.wipe()
+            if image is not None and erase_sectors:
+                ranges, result = self._erase_ranges(image)
+                transaction.program_sectors(image.coalesced(self.flash_page_size), ranges)
+            elif image is not None:
+                transaction.program_image(image.coalesced(self.flash_page_size))
+            if len(writes) > 0:
+                transaction.writemem_words(writes)
+            steps = [transaction.readmem_blocks(b) if len(b) > 0 else None for b in reads]
+            transaction.run()
+            if not connected.result:
+                raise AdaLinkError('Could not find {0}, is it connected?'.format(self.name))
+            if image is not None and verify:
+                verified = self._verify(programmer, image)
+                result = verified if result is None else '{0}  {1}'.format(result, verified)
+        return result, [[] if s is None else s.result for s in steps]
+
+    def _flash(self, programmer, wipe, image, erase_sectors, diff, skip_identical,
+               verify=False, delta=False):
+        """Wipe the target and program (and verify) the image (if not None) as
+        requested, and return a message describing the result or None if
+        there's nothing to report.
+        """
+        # Skip wiping and programming entirely if the target already holds
+        # the image.
+        if image is not None and skip_identical:
+            with timing.span('verify', bytes=len(image)):
+                mismatched = programmer.verify_image(image)
+            if len(mismatched) == 0:
+                return 'Already up to date.'
+        # Wipe flash memory if requested.
+        if wipe:
+            with timing.span('erase'):
+                programmer.wipe()
+        if image is None:
+            return None
+        if erase_sectors:
+            ranges, result = self._erase_ranges(image)
+            with timing.span('write', bytes=len(image)):
+                programmer.program_sectors(image.coalesced(self.flash_page_size), ranges)
+            if verify:
+                result = '{0}  {1}'.format(result, self._verify(programmer, image))
+            return result
+        if delta:
+            result = self._flash_delta(programmer, image, verify)
+            if result is not None:
+                return result
+            # The history doesn't know what's on the device, so compare the
+            # image with its flash instead.
+            diff = True
+        if not diff:
+            with timing.span('write', bytes=len(image)):
+                programmer.program_image(image.coalesced(self.flash_page_size))
+            return self._verify(programmer, image) if verify else None
+        # Program only the flash pages whose contents on the target differ
+        # from the image.
+        with timing.span('verify', bytes=len(image)):
+            changed = programmer.changed_pages(image, self.flash_page_size)
+        pages = len(changed.page_digests(self.flash_page_size))
+        total = len(image.page_digests(self.flash_page_size))
+        if pages > 0:
+            with timing.span('write', bytes=len(changed)):
+                programmer.program_pages(changed.coalesced(self.flash_page_size))
+        result = 'Programmed {0} of {1} flash pages which changed.'.format(pages, total)
+        if verify:
+            result = '{0}  {1}'.format(result, self._verify(programmer, image))
+        return result
+
+    def _flash_delta(self, programmer, image, verify):
+        # Program only the flash pages which changed since the image the
+        # history says the device last received, without reading flash back,
+        # then spot check them.  Returns a message describing the result, or
+        # None if the device's last image isn't known.
+        page_size = self.flash_page_size
+        field = self.device_id_field
+        with timing.span('read'):
+            values = read_values(programmer, field.reads)
+        store = history.active()
+        last = store.last_run(field.decode(*[values[r] for r in field.reads]), self.name)
+        if last is None or not last['ok'] or last['image_hash'] is None:
+            return None
+        known = store.image_pages(last['image_hash'], page_size)
+        if known is None:
+            return None
+        pages = image.page_hashes(page_size)
+        changed = sorted(p for p, h in pages.items() if known.get(p) != h)
+        if len(changed) > 0:
+            delta = image.select_pages(changed, page_size)
+            with timing.span('write', bytes=len(delta)):
+                programmer.program_pages(delta.coalesced(page_size))
+        # Check the pages written and a few unchanged ones.  If any don't
+        # match the device was changed since the history's last run on it, so
+        # fall back to comparing all of its flash.
+        unchanged = sorted(set(pages) - set(changed))
+        checked = image.select_pages(
+            changed + random.sample(unchanged, min(SPOT_CHECK_PAGES, len(unchanged))), page_size)
+        with timing.span('verify', bytes=len(checked)):
+            mismatched = programmer.verify_image(checked)
+        if len(mismatched) > 0:
+            result = self._flash(programmer, False, image, False, True, False, verify)
+            return 'Spot check failed, the board changed since it was last programmed.  {0}'.format(result)
+        result = 'Programmed {0} of {1} flash pages which changed since image {2}.'.format(
+            len(changed), len(pages), last['image_hash'][:12])
+        if verify:
+            result = '{0}  {1}'.format(result, self._verify(programmer, image))
+        return result
+
+    def _erase_ranges(self, image):
+        # Return the (start, size) ranges of flash to erase for the image and
+        # a message saying how many sectors that is.
+        ranges = [(start, start + len(data)) for start, data in image.segments]
+        sectors = self.flash_geometry.covering(ranges)
+        result = 'Erased {0} of {1} flash sectors.'.format(len(sectors),
+                                                           len(self.flash_geometry.sectors))
+        return self.flash_geometry.erase_ranges(ranges), result
+
+    def _verify(self, programmer, image):
+        """Check the target holds the image and return a message saying so, or
+        raise an error listing the address ranges which don't match.
+        """
+        with timing.span('verify', bytes=len(image)):
+            mismatched = programmer.verify_image(image)
+            if len(mismatched) > 0:
+                # Programmers which verify on the target only know which
+                # segments differ, read just those back to find which bytes.
+                failed = image.select_ranges(mismatched)
+                target = programmer.readmem_ranges(segment_ranges(failed))
+                mismatched = mismatched_ranges(failed, target)
+        if len(mismatched) == 0:
+            return 'Verified {0} bytes.'.format(len(image))
+        ranges = ['0x{0:08X}-0x{1:08X}'.format(start, end - 1)
+                  for start, end in mismatched[:VERIFY_LISTED_RANGES]]
+        if len(mismatched) > VERIFY_LISTED_RANGES:
+            ranges.append('and {0} more'.format(len(mismatched) - VERIFY_LISTED_RANGES))
+        raise AdaLinkError('Verify failed, {0} bytes in {1} ranges don\'t match: {2}'.format(
+            sum(end - start for start, end in mismatched), len(mismatched), ', '.join(ranges)))
+
+    def _gang(self, programmer, serials, wipe, image, erase_sectors, diff,
+              skip_identical, verify, progress, delta=False):
+        # Wipe and program the boards on every probe at the same time, each
+        # from its own worker thread and programmer so a slow or
+        # failing board doesn't hold up the others.
+        def run(serial):
+            start = time.time()
+            try:
+                with timing.context(probe=serial):
+                    with timing.span('discovery'):
+                        p = self.create_programmer(programmer)
+                    p.select_probe(serial)
+                    if progress:
+                        p.progress_callback = lambda event: self._echo_progress(event, serial)
+                    result, reads = self._run(p, wipe, image, erase_sectors, diff,
+                                              skip_identical, verify, delta=delta)
+                return (serial, 'OK', time.time() - start, result or 'Done.')
+            except Exception as ex:
+                return (serial, 'FAILED', time.time() - start, str(ex))
+        with ThreadPoolExecutor(max_workers=len(serials)) as pool:
+            results = list(pool.map(run, serials))
+        # Print a table of the results for each probe.
+        width = max(len('Probe'), max(len(s) for s in serials))
+        click.echo('{0:<{1}}  {2:<6}  {3:>8}  {4}'.format('Probe', width, 'Result', 'Time', 'Details'))
+        for serial, status, elapsed, details in results:
+            click.echo('{0:<{1}}  {2:<6}  {3:>7.2f}s  {4}'.format(serial, width, status, elapsed, details))
+        failed = len([r for r in results if r[1] != 'OK'])
+        if failed > 0:
+            raise AdaLinkError('{0} of {1} boards failed!'.format(failed, len(results)))
+
+    def _dump(self, programmer, address, length, path):
+        # Save memory to a .bin or .hex file and report how fast it was read.
+        # Hex files are converted from a temporary .bin file a chunk at a
+        # time, so neither is held in memory.
+        start = time.time()
+        with timing.span('dump', bytes=length):
+            if os.path.splitext(path)[1].lower() == '.hex':
+                directory = tempfile.mkdtemp(prefix='adalink')
+                try:
+                    bin_path = os.path.join(directory, 'dump.bin')
+                    programmer.dump_bin(bin_path, address, length)
+                    bin_to_hex(bin_path, address, path)
+                finally:
+                    shutil.rmtree(directory, ignore_errors=True)
+            else:
+                programmer.dump_bin(path, address, length)
+        elapsed = time.time() - start
+        rate = length / 1024.0 / elapsed if elapsed > 0 else 0
+        click.echo('Dumped {0} bytes from 0x{1:08X} to {2} in {3:.2f}s ({4:.1f} KiB/s).'.format(
+            length, address, path, elapsed, rate))
+
+    def _echo_progress(self, event, probe=None):
+        # Print a progress event reported by the programmer on one line,
+        # starting with the probe serial number when programming many boards.
+        values = []
+        if event.bytes is not None:
+            values.append('{0} bytes'.format(event.bytes))
+        if event.seconds is not None:
+            values.append('{0:.3f}s'.format(event.seconds))
+        if event.rate is not None:
+            values.append('{0:.1f} KiB/s'.format(event.rate))
+        line = '{0}: {1}'.format(event.kind.capitalize(), ', '.join(values))
+        if probe is not None:
+            line = '[{0}] {1}'.format(probe, line)
+        click.echo(line, err=True)
+
+    def _echo_block(self, address, width, values):
+        # Print a block of memory with 16 bytes per line, each line starting
+        # with its address.
+        per_line = 128 // width
+        for i in range(0, len(values), per_line):
+            line = ' '.join('{0:0{1}X}'.format(v, width // 4)
+                            for v in values[i:i+per_line])
+            click.echo('0x{0:08X}: {1}'.format(address + i*width//8, line))
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU.  These
@@ -113,9 +564,21 @@ class Core(click.Command):
         """
         raise NotImplementedError
 
+    def create_sim(self):
+        """Create and return a simulated programmer for the core, which models
+        its flash, RAM and info registers in memory.  Cores without uniform
+        flash pages are simulated with SIM_PAGE_SIZE byte pages.
+        """
+        fields = list(self.info_fields) + [f for f in (self.device_id_field, self.device_addr_field)
+                                           if f is not None and f not in self.info_fields]
+        return Sim(self.name, fields, self.flash_region,
+                   self.flash_page_size or SIM_PAGE_SIZE, self.ram_region)
+
     def info(self, programmer):
         """Display information about the device.  Will be passed an instance
         of the programmer created by create_programmer.  The programmer can be
         used to read memory and use it to display information."""
-        # Default implementation does nothing, subclasses should override.
-        pass
+        # Default implementation reads and displays the core's info fields in
+        # one batch, subclasses can override to display something else.
+        if len(self.info_fields) > 0:
+            echo_fields(programmer, self.info_fields)
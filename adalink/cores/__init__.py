@@ -1,18 +1,41 @@
 # adalink.cores Module
 #
-# Import all python files in the directory to make them available to use.
+# Registry of the available cores, which are imported when they're used.
 #
 # Author: Tony DiCola
+import importlib
 
-# Import all python files in the cores directory manually.  This is a change
-# from previous behavior which automatically imported cores, but relied on
-# somewhat brittle behavior for finding the path of the current script (and
-# would have problems with py2exe).  Since dynamically loading new cores
-# isn't really that important, just import each one explicitly:
-from . import atsamd21g18
-from . import lpc824
-from . import lpc1343
-from . import nrf51822
-from . import nrf52832
-from . import nrf52840
-from . import stm32f2
+
+# Every core keyed by the name of its command, with the module in this package
+# and the Core subclass which implement it, and the short help shown in the
+# list of cores.  Cores aren't imported until they're used (so adalink starts
+# quickly), which means a new core must be added here to be available.  This
+# replaces explicitly importing every core module, and earlier still
+# automatically importing every file in the folder (which relied on brittle
+# behavior for finding the path of the current script and had problems with
+# py2exe).
+CORES = {
+    'atsamd21g18': ('atsamd21g18', 'ATSAMD21G18', 'Atmel ATSAMD21G18 CPU.'),
+    'lpc1343':     ('lpc1343',     'LPC1343',     'NXP LPC1343 CPU.'),
+    'lpc824':      ('lpc824',      'LPC824',      'NXP LPC824 CPU.'),
+    'nrf51822':    ('nrf51822',    'nRF51822',    'Nordic nRF51822 CPU.'),
+    'nrf52832':    ('nrf52832',    'nRF52832',    'Nordic nRF52832 CPU.'),
+    'nrf52840':    ('nrf52840',    'nRF52840',    'Nordic nRF52840 CPU.'),
+    'stm32f2':     ('stm32f2',     'STM32F2',     'STMicro STM32F2 CPU.')
+}
+
+# Importing * still imports every core module.
+__all__ = sorted(module for module, cls, short_help in CORES.values())
+
+
+def load_core(name):
+    """Import and return the Core subclass for the named core."""
+    module, cls, short_help = CORES[name]
+    return getattr(importlib.import_module('.' + module, __name__), cls)
+
+
+def all_cores():
+    """Import and return a list of the Core subclass of every core, sorted by
+    name.
+    """
+    return [load_core(name) for name in sorted(CORES)]
@@ -9,7 +9,43 @@ import click
 
 from ..core import Core
 from ..errors import AdaLinkError
+from ..flash import FlashGeometry
 from ..programmers import JLink, STLink, RasPi2
+from ..registers import Field
+
+
+# 128-bit serial number, see section 10.3.3 of the SAM D21 datasheet.
+SERIAL_NUMBER_FIELD = Field('Serial Number', [(0x0080A00C, 32), (0x0080A040, 32),
+                                              (0x0080A044, 32), (0x0080A048, 32)],
+                            lambda *words: ''.join('{0:08X}'.format(w) for w in words))
+
+# 256KB of flash erased in 256 byte rows (four 64 byte pages).
+FLASH_GEOMETRY = FlashGeometry.uniform(0x00000000, 256*1024, 256)
+
+
+def erase_load_commands(programmer, bin_files, ranges):
+    # OpenOCD commands to erase the provided list of (start, size) ranges of
+    # flash, then program the (path, address) .bin files with load_image as
+    # flash write_image doesn't work on the ATSAMD21G18.
+    commands = [
+        'init',
+        'reset init'
+    ]
+    for start, size in ranges:
+        commands.append('flash erase_address 0x{0:08X} 0x{1:X}'.format(start, size))
+    for f, addr in bin_files:
+        f = programmer.escape_path(os.path.abspath(f))
+        commands.append('load_image {0} 0x{1:08X} bin'.format(f, addr))
+    commands.append('reset run')
+    commands.append('exit')
+    return commands
+
+
+def page_ranges(bin_files):
+    # Return the (start, size) ranges of the flash rows the provided list of
+    # (path, address) .bin files are written to.
+    return FLASH_GEOMETRY.erase_ranges([(addr, addr + os.path.getsize(f))
+                                        for f, addr in bin_files])
 
 
 class STLink_ATSAMD21G18(STLink):
@@ -22,18 +58,18 @@ class STLink_ATSAMD21G18(STLink):
         super(STLink_ATSAMD21G18, self).__init__(params='-f interface/stlink-v2.cfg ' \
             '-c "set CHIPNAME at91samd21g18; set ENDIAN little; set CPUTAPID 0x0bc11477; source [find target/at91samdXX.cfg]"')
 
-    def wipe(self):
-        # Run OpenOCD command to wipe ATSAMD21G18 memory.
+    def wipe_commands(self):
+        # OpenOCD command to wipe ATSAMD21G18 memory.
         commands = [
             'init',
             'reset init',
             'at91samd chip-erase',
             'exit'
         ]
-        self.run_commands(commands)
+        return commands
 
-    def program(self, hex_files=[], bin_files=[]):
-        # Program the ATSAMD21G18 with the provided hex/bin files.
+    def program_commands(self, hex_files=[], bin_files=[]):
+        # Commands to program the ATSAMD21G18 with the provided hex/bin files.
         click.echo('WARNING: Make sure the provided hex/bin files are padded with ' \
             'at least 64 bytes of blank (0xFF) data!  This will work around a cache bug with OpenOCD 0.9.0.')
         commands = [
@@ -58,16 +94,25 @@ class STLink_ATSAMD21G18(STLink):
             commands.append('verify_image {0} 0x{1:08X} bin'.format(f, addr))
         commands.append('reset run')
         commands.append('exit')
-        # Run commands.
-        output = self.run_commands(commands)
+        return commands
+
+    def parse_program(self, output, hex_files=[], bin_files=[]):
         # Check that expected number of files were verified.  Look for output lines
         # that start with 'verified ' to signal OpenOCD output that the verification
         # succeeded.  Count up these lines and expect they match the number of
         # programmed files.
-        verified = len(filter(lambda x: x.startswith('verified '), output.splitlines()))
+        verified = len([x for x in output.splitlines() if x.startswith('verified ')])
         if verified != (len(hex_files) + len(bin_files)):
             raise AdaLinkError('Failed to verify all files were programmed!')
 
+    def program_pages_commands(self, bin_files):
+        # Erase just the rows the files are written to, then load them.
+        return erase_load_commands(self, bin_files, page_ranges(bin_files))
+
+    def program_sectors_commands(self, bin_files, ranges):
+        # Erase the ranges, then load the files.
+        return erase_load_commands(self, bin_files, ranges)
+
 class RasPi2_ATSAMD21G18(RasPi2):
     # ATSAMD21G18-specific Raspi2 native-based programmer.  Required to add custom
     # wipe function, and to use the load_image command for programming (the
@@ -78,18 +123,18 @@ class RasPi2_ATSAMD21G18(RasPi2):
         super(RasPi2_ATSAMD21G18, self).__init__(params='-f interface/raspberrypi2-native.cfg ' \
             '-c "transport select swd; set CHIPNAME at91samd21g18; adapter_nsrst_delay 100; adapter_nsrst_assert_width 100; source [find target/at91samdXX.cfg]"')
 
-    def wipe(self):
-        # Run OpenOCD command to wipe ATSAMD21G18 memory.
+    def wipe_commands(self):
+        # OpenOCD command to wipe ATSAMD21G18 memory.
         commands = [
             'init',
             'reset init',
             'at91samd chip-erase',
             'exit'
         ]
-        self.run_commands(commands)
+        return commands
 
-    def program(self, hex_files=[], bin_files=[]):
-        # Program the ATSAMD21G18 with the provided hex/bin files.
+    def program_commands(self, hex_files=[], bin_files=[]):
+        # Commands to program the ATSAMD21G18 with the provided hex/bin files.
         click.echo('WARNING: Make sure the provided hex/bin files are padded with ' \
             'at least 64 bytes of blank (0xFF) data!  This will work around a cache bug with OpenOCD 0.9.0.')
         commands = [
@@ -114,28 +159,42 @@ class RasPi2_ATSAMD21G18(RasPi2):
             commands.append('verify_image {0} 0x{1:08X} bin'.format(f, addr))
         commands.append('reset run')
         commands.append('exit')
-        # Run commands.
-        output = self.run_commands(commands)
+        return commands
+
+    def parse_program(self, output, hex_files=[], bin_files=[]):
         # Check that expected number of files were verified.  Look for output lines
         # that start with 'verified ' to signal OpenOCD output that the verification
         # succeeded.  Count up these lines and expect they match the number of
         # programmed files.
-        verified = len(filter(lambda x: x.startswith('verified '), output.splitlines()))
+        verified = len([x for x in output.splitlines() if x.startswith('verified ')])
         if verified != (len(hex_files) + len(bin_files)):
             raise AdaLinkError('Failed to verify all files were programmed!')
 
+    def program_pages_commands(self, bin_files):
+        # Erase just the rows the files are written to, then load them.
+        return erase_load_commands(self, bin_files, page_ranges(bin_files))
+
+    def program_sectors_commands(self, bin_files, ranges):
+        # Erase the ranges, then load the files.
+        return erase_load_commands(self, bin_files, ranges)
+
 
 class ATSAMD21G18(Core):
     """Atmel ATSAMD21G18 CPU."""
     # Note that the docstring will be used as the short help description.
 
+    flash_page_size = 256
+    flash_region = (0x00000000, 256*1024)
+    ram_region = (0x20000000, 32*1024)
+    device_id_field = SERIAL_NUMBER_FIELD
+
     def __init__(self):
         # Call base class constructor--MUST be done!
         super(ATSAMD21G18, self).__init__()
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU."""
-        return ['jlink', 'stlink', "raspi2"]
+        return ['jlink', 'stlink', "raspi2", 'sim']
 
     def create_programmer(self, programmer):
         """Create and return a programmer instance that will be used to program
@@ -148,6 +207,8 @@ class ATSAMD21G18(Core):
             return STLink_ATSAMD21G18()
         elif programmer == 'raspi2':
             return RasPi2_ATSAMD21G18()
+        elif programmer == 'sim':
+            return self.create_sim()
 
     def info(self, programmer):
         """Display info about the device."""
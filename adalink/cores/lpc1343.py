@@ -1,10 +1,9 @@
 # LPC1343 core implementation
 #
 # Author: Kevin Townsend
-import click
-
 from ..core import Core
 from ..programmers import JLink, STLink
+from ..registers import Register
 
 
 # DEVICE ID register valueto name mapping
@@ -31,18 +30,32 @@ DEVICEID_SEGGER_LOOKUP = {
     0x1830102B: 'LPC1313'
 }
 
+# Fields displayed by --info.
+INFO_FIELDS = [
+    # DEVICE ID = APB0 Base (0x40000000) + SYSCON Base (0x48000) + 3F4
+    Register('Device ID', 0x400483F4, lookup=DEVICEID_CHIPNAME_LOOKUP),
+    # Segger device names only matter when using the JLink.
+    Register('Segger ID', 0x400483F8, lookup=DEVICEID_SEGGER_LOOKUP,
+             hide_unknown=True, programmers=(JLink,))
+]
+
 
 class LPC1343(Core):
     """NXP LPC1343 CPU."""
     # Note that the docstring will be used as the short help description.
-    
+
+    info_fields = INFO_FIELDS
+    flash_page_size = 4096
+    flash_region = (0x00000000, 32*1024)
+    ram_region = (0x10000000, 8*1024)
+
     def __init__(self):
         # Call base class constructor.
         super(LPC1343, self).__init__()
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU."""
-        return ['jlink']
+        return ['jlink', 'sim']
     
     def create_programmer(self, programmer):
         """Create and return a programmer instance that will be used to program
@@ -51,16 +64,5 @@ class LPC1343(Core):
         if programmer == 'jlink':
             return JLink('Cortex-M3 r2p0, Little endian',
                          params='-device LPC1343 -if swd -speed 1000')
-    
-    def info(self, programmer):
-        """Display info about the device."""
-        # DEVICE ID = APB0 Base (0x40000000) + SYSCON Base (0x48000) + 3F4
-        deviceid = programmer.readmem32(0x400483F4)
-        click.echo('Device ID : {0}'.format(DEVICEID_CHIPNAME_LOOKUP.get(deviceid,
-                                                   '0x{0:08X}'.format(deviceid))))
-        # Try to detect the Segger Device ID string and print it if using JLink
-        if isinstance(programmer, JLink):
-            hwid = programmer.readmem32(0x400483F8)
-            hwstring = DEVICEID_SEGGER_LOOKUP.get(hwid, '0x{0:08X}'.format(hwid))
-            if '0x' not in hwstring:
-                click.echo('Segger ID : {0}'.format(hwstring))
+        elif programmer == 'sim':
+            return self.create_sim()
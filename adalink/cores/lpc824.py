@@ -1,10 +1,9 @@
 # LPC824 core implementation
 #
 # Author: Kevin Townsend
-import click
-
 from ..core import Core
 from ..programmers import JLink, STLink
+from ..registers import Register
 
 
 # DEVICE ID register value to name mapping
@@ -40,18 +39,31 @@ DEVICEID_SEGGER_LOOKUP = {
     0x00008222: 'LPC822M101'
 }
 
+# Fields displayed by --info.
+INFO_FIELDS = [
+    Register('Device ID', 0x400483F8, lookup=DEVICEID_CHIPNAME_LOOKUP),
+    # Segger device names only matter when using the JLink.
+    Register('Segger ID', 0x400483F8, lookup=DEVICEID_SEGGER_LOOKUP,
+             hide_unknown=True, programmers=(JLink,))
+]
+
 
 class LPC824(Core):
     """NXP LPC824 CPU."""
     # Note that the docstring will be used as the short help description.
-    
+
+    info_fields = INFO_FIELDS
+    flash_page_size = 1024
+    flash_region = (0x00000000, 32*1024)
+    ram_region = (0x10000000, 8*1024)
+
     def __init__(self):
         # Call base class constructor.
         super(LPC824, self).__init__()
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU."""
-        return ['jlink']
+        return ['jlink', 'sim']
     
     def create_programmer(self, programmer):
         """Create and return a programmer instance that will be used to program
@@ -60,15 +72,5 @@ class LPC824(Core):
         if programmer == 'jlink':
             return JLink('Cortex-M0 r0p0, Little endian',
                          params='-device LPC824M201 -if swd -speed 1000')
-
-    def info(self):
-        """Display info about the device."""
-        deviceid = self.programmer.readmem32(0x400483F8)
-        click.echo('Device ID : {0}'.format(DEVICEID_CHIPNAME_LOOKUP.get(deviceid,
-                                                   '0x{0:08X}'.format(deviceid))))
-        # Try to detect the Segger Device ID string and print it if using JLink
-        if isinstance(self.programmer, JLink):
-            hwid = self.programmer.readmem32(0x400483F8)
-            hwstring = DEVICEID_SEGGER_LOOKUP.get(hwid, '0x{0:08X}'.format(hwid))
-            if '0x' not in hwstring:
-                click.echo('Segger ID : {0}'.format(hwstring))
+        elif programmer == 'sim':
+            return self.create_sim()
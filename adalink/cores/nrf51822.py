@@ -7,6 +7,7 @@ import click
 
 from ..core import Core
 from ..programmers import JLink, STLink, RasPi2
+from ..registers import Field, Register
 
 
 # CONFIGID register HW ID value to name mapping.
@@ -37,6 +38,34 @@ SEGGER_LOOKUP = {
 }
 
 
+def _decode_device_addr(high, low):
+    # The BLE address is the low 48 bits of DEVICEADDR with the top two bits
+    # set to mark it as a random static address.
+    high = (high & 0x0000ffff) | 0x0000c000
+    return '{0:02X}:{1:02X}:{2:02X}:{3:02X}:{4:02X}:{5:02X}'.format(
+        (high >> 8) & 0xFF, high & 0xFF, (low >> 24) & 0xFF,
+        (low >> 16) & 0xFF, (low >> 8) & 0xFF, low & 0xFF)
+
+# FICR device address and ID fields, shared with the nRF52 cores which use the
+# same FICR layout for them.
+DEVICE_ADDR_FIELD = Field('Device Addr', [(0x100000a8, 32), (0x100000a4, 32)],
+                          _decode_device_addr)
+DEVICE_ID_FIELD = Field('Device ID', [(0x10000060, 32), (0x10000064, 32)],
+                        lambda high, low: '{0:08X}{1:08X}'.format(high, low))
+
+# Fields displayed by --info.
+INFO_FIELDS = [
+    Register('Hardware ID', 0x1000005C, 16, lookup=MCU_LOOKUP, fmt='0x{0:04X}'),
+    # Segger device names only matter when using the JLink.
+    Register('Segger ID', 0x1000005C, 16, lookup=SEGGER_LOOKUP,
+             hide_unknown=True, programmers=(JLink,)),
+    Register('SD Version', 0x0000300C, 16, lookup=SD_LOOKUP,
+             fmt='Unknown! (0x{0:04X})'),
+    DEVICE_ADDR_FIELD,
+    DEVICE_ID_FIELD
+]
+
+
 class RasPi2_nRF51822(RasPi2):
     # nRF51822-specific RasPi2-based programmer.  Required to add custom
     # wipe and erase before programming needed for the nRF51822 & OpenOCD.
@@ -46,8 +75,8 @@ class RasPi2_nRF51822(RasPi2):
         super(RasPi2_nRF51822, self).__init__(params='-f interface/raspberrypi2-native.cfg ' \
             '-c "transport select swd; set WORKAREASIZE 0; adapter_nsrst_delay 100; adapter_nsrst_assert_width 100; source [find target/nrf51.cfg]"')
 
-    def wipe(self):
-        # Run OpenOCD commands to wipe nRF51822 memory.
+    def wipe_commands(self):
+        # OpenOCD commands to wipe nRF51822 memory.
         commands = [
             'init',
             'reset',
@@ -57,12 +86,12 @@ class RasPi2_nRF51822(RasPi2):
             'exit',
             'shutdown'
         ]
-        self.run_commands(commands)
+        return commands
 
-    def program(self, hex_files=[], bin_files=[]):
-        # Program the nRF51822 with the provided hex files.  Note that programming
-        # the soft device and bootloader requires erasing the memory so it will
-        # always be done.
+    def program_commands(self, hex_files=[], bin_files=[]):
+        # Commands to program the nRF51822 with the provided hex files.  Note
+        # that programming the soft device and bootloader requires erasing the
+        # memory so it will always be done.
         click.echo('WARNING: Flash memory will be erased before programming nRF51822 with the RasPi2!')
         commands = [
             'init',
@@ -82,7 +111,7 @@ class RasPi2_nRF51822(RasPi2):
         commands.append('reset run')
         commands.append('exit')
         commands.append('shutdown')
-        self.run_commands(commands)
+        return commands
 
 class STLink_nRF51822(STLink):
     # nRF51822-specific STLink-based programmer.  Required to add custom
@@ -92,8 +121,8 @@ class STLink_nRF51822(STLink):
         # Call base STLink initializer and set it up to program the nRF51822.
         super(STLink_nRF51822, self).__init__(params='-f interface/stlink-v2.cfg -f target/nrf51.cfg')
 
-    def wipe(self):
-        # Run OpenOCD commands to wipe nRF51822 memory.
+    def wipe_commands(self):
+        # OpenOCD commands to wipe nRF51822 memory.
         commands = [
             'init',
             'reset init',
@@ -101,12 +130,12 @@ class STLink_nRF51822(STLink):
             'nrf51 mass_erase',
             'exit'
         ]
-        self.run_commands(commands)
+        return commands
 
-    def program(self, hex_files=[], bin_files=[]):
-        # Program the nRF51822 with the provided hex files.  Note that programming
-        # the soft device and bootloader requires erasing the memory so it will
-        # always be done.
+    def program_commands(self, hex_files=[], bin_files=[]):
+        # Commands to program the nRF51822 with the provided hex files.  Note
+        # that programming the soft device and bootloader requires erasing the
+        # memory so it will always be done.
         click.echo('WARNING: Flash memory will be erased before programming nRF51822 with the STLink!')
         commands = [
             'init',
@@ -124,7 +153,7 @@ class STLink_nRF51822(STLink):
             commands.append('flash write_image {0} 0x{1:08X} bin'.format(f, addr))
         commands.append('reset run')
         commands.append('exit')
-        self.run_commands(commands)
+        return commands
 
 
 class nRF51822_JLink(JLink):
@@ -136,8 +165,8 @@ class nRF51822_JLink(JLink):
         super(nRF51822_JLink, self).__init__('Cortex-M0 r0p0, Little endian',
             params='-device nrf51822_xxaa -if swd -speed 1000')
 
-    def wipe(self):
-        # Run JLink commands to wipe nRF51822 memory.
+    def wipe_commands(self):
+        # JLink commands to wipe nRF51822 memory.
         # See this bug for more details on the erase commands:
         #   https://github.com/adafruit/Adafruit_Adalink/issues/17
         commands = [
@@ -149,20 +178,27 @@ class nRF51822_JLink(JLink):
             'r',              # Reset
             'q'               # Quit
         ]
-        self.run_commands(commands)
+        return commands
 
 
 class nRF51822(Core):
     """Nordic nRF51822 CPU."""
     # Note that the docstring will be used as the short help description.
 
+    info_fields = INFO_FIELDS
+    device_id_field = DEVICE_ID_FIELD
+    device_addr_field = DEVICE_ADDR_FIELD
+    flash_page_size = 1024
+    flash_region = (0x00000000, 256*1024)
+    ram_region = (0x20000000, 32*1024)
+
     def __init__(self):
         # Call base class constructor--MUST be done!
         super(nRF51822, self).__init__()
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU."""
-        return ['jlink', 'stlink', 'raspi2']
+        return ['jlink', 'stlink', 'raspi2', 'sim']
 
     def create_programmer(self, programmer):
         """Create and return a programmer instance that will be used to program
@@ -174,34 +210,5 @@ class nRF51822(Core):
             return STLink_nRF51822()
         elif programmer == 'raspi2':
             return RasPi2_nRF51822()
-
-    def info(self, programmer):
-        """Display info about the device."""
-        # Get the HWID register value and print it.
-        # Note for completeness there are also readmem32 and readmem8 functions
-        # available to use for reading memory values too.
-        hwid = programmer.readmem16(0x1000005C)
-        click.echo('Hardware ID : {0}'.format(MCU_LOOKUP.get(hwid, '0x{0:04X}'.format(hwid))))
-        # Try to detect the Segger Device ID string and print it if using JLink
-        if isinstance(programmer, JLink):
-            hwid = programmer.readmem16(0x1000005C)
-            hwstring = SEGGER_LOOKUP.get(hwid, '0x{0:04X}'.format(hwid))
-            if '0x' not in hwstring:
-                click.echo('Segger ID   : {0}'.format(hwstring))
-        # Get the SD firmware version and print it.
-        sdid = programmer.readmem16(0x0000300C)
-        click.echo('SD Version  : {0}'.format(SD_LOOKUP.get(sdid, 'Unknown! (0x{0:04X})'.format(sdid))))
-        # Get the BLE Address and print it.
-        addr_high = (programmer.readmem32(0x100000a8) & 0x0000ffff) | 0x0000c000
-        addr_low  = programmer.readmem32(0x100000a4)
-        click.echo('Device Addr : {0:02X}:{1:02X}:{2:02X}:{3:02X}:{4:02X}:{' \
-                   '5:02X}'.format((addr_high >> 8) & 0xFF,
-                                   (addr_high) & 0xFF,
-                                   (addr_low >> 24) & 0xFF,
-                                   (addr_low >> 16) & 0xFF,
-                                   (addr_low >> 8) & 0xFF,
-                                   (addr_low & 0xFF)))
-        # Get device ID.
-        did_high = programmer.readmem32(0x10000060)
-        did_low  = programmer.readmem32(0x10000064)
-        click.echo('Device ID   : {0:08X}{1:08X}'.format(did_high, did_low))
+        elif programmer == 'sim':
+            return self.create_sim()
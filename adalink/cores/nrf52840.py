@@ -3,10 +3,10 @@
 # Author: Kevin Townsend
 import os
 
-import click
-
 from ..core import Core
 from ..programmers import JLink
+from ..registers import Register
+from .nrf51822 import DEVICE_ADDR_FIELD, DEVICE_ID_FIELD
 
 
 # CONFIGID register HW ID value to name mapping.
@@ -58,6 +58,19 @@ SD_LOOKUP = {
 SEGGER_LOOKUP = {
     0x0000: 'nRF52840_xxaa'
 }
+# Fields displayed by --info.
+INFO_FIELDS = [
+    Register('Hardware ID', 0x10000100, fmt='0x{0:05X}'),
+    Register('Variant', 0x10000104, lookup=MCU_LOOKUP, fmt='0x{0:05X}'),
+    Register('Package', 0x10000108, 16, lookup=PACKAGE_LOOKUP, fmt='0x{0:04X}'),
+    Register('SRAM', 0x1000010C, 16, lookup=SRAM_LOOKUP, fmt='0x{0:02X}'),
+    Register('Flash', 0x10000110, 16, lookup=FLASH_LOOKUP, fmt='0x{0:04X}'),
+    DEVICE_ADDR_FIELD,
+    DEVICE_ID_FIELD,
+    # UICR NFCPINS is left erased when the pins are used for NFC.
+    Register('NFC Pins', 0x1000120C, lookup={0xFFFFFFFF: 'NFC'}, fmt='GPIO')
+]
+
 
 class nRF52840_JLink(JLink):
     # nRF52840-specific JLink programmer, required to add custom wipe command
@@ -68,28 +81,35 @@ class nRF52840_JLink(JLink):
         super(nRF52840_JLink, self).__init__('Cortex-M4 r0p1, Little endian',
             params='-device nrf52840_xxaa -if swd -speed 1000 -autoconnect 1')
 
-    def wipe(self):
-        # Run JLink commands to wipe nRF52840 memory.
+    def wipe_commands(self):
+        # JLink commands to wipe nRF52840 memory.
         commands = [
             'erase',          # Erase all
             'sleep 100',      # Wait again
             'r',              # Reset
             'q'               # Quit
         ]
-        self.run_commands(commands)
+        return commands
 
 
 class nRF52840(Core):
     """Nordic nRF52840 CPU."""
     # Note that the docstring will be used as the short help description.
 
+    info_fields = INFO_FIELDS
+    device_id_field = DEVICE_ID_FIELD
+    device_addr_field = DEVICE_ADDR_FIELD
+    flash_page_size = 4096
+    flash_region = (0x00000000, 1024*1024)
+    ram_region = (0x20000000, 256*1024)
+
     def __init__(self):
         # Call base class constructor--MUST be done!
         super(nRF52840, self).__init__()
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU."""
-        return ['jlink']
+        return ['jlink', 'sim']
 
     def create_programmer(self, programmer):
         """Create and return a programmer instance that will be used to program
@@ -97,55 +117,5 @@ class nRF52840(Core):
         """
         if programmer == 'jlink':
             return nRF52840_JLink()
-
-    def info(self, programmer):
-        """Display info about the device."""
-        # Get the HWID register value and print it.
-        # Note for completeness there are also readmem32 and readmem8 functions
-        # available to use for reading memory values too.
-        hwid = programmer.readmem32(0x10000100)
-        click.echo('Hardware ID : 0x{0:05X}'.format(hwid))
-        # Get the chip variant
-        variant = programmer.readmem32(0x10000104)
-        click.echo('Variant     : {0}'.format(MCU_LOOKUP.get(variant, '0x{0:05X}'.format(variant))))
-        # Get the Package ID
-        package = programmer.readmem16(0x10000108)
-        pkgstring = PACKAGE_LOOKUP.get(package, '0x{0:04X}'.format(package))
-        if '0x' not in pkgstring:
-            click.echo('Package     : {0}'.format(pkgstring))
-        else:
-            click.echo('Package     : 0x{0:04X}'.format(package))
-        # Get the SRAM
-        sram = programmer.readmem16(0x1000010C)
-        sramstring = SRAM_LOOKUP.get(sram, '0x{0:02X}'.format(package))
-        if '0x' not in sramstring:
-            click.echo('SRAM        : {0}'.format(sramstring))
-        else:
-            click.echo('SRAM        : 0x{0:02X}'.format(sram))
-        # Get the Flash size
-        flash = programmer.readmem16(0x10000110)
-        flashstring = FLASH_LOOKUP.get(flash, '0x{0:04X}'.format(package))
-        if '0x' not in flashstring:
-            click.echo('Flash       : {0}'.format(flashstring))
-        else:
-            click.echo('Flash       : 0x{0:04X}'.format(flash))
-        # Get the BLE Address and print it.
-        addr_high = (programmer.readmem32(0x100000a8) & 0x0000ffff) | 0x0000c000
-        addr_low  = programmer.readmem32(0x100000a4)
-        click.echo('Device Addr : {0:02X}:{1:02X}:{2:02X}:{3:02X}:{4:02X}:{' \
-                   '5:02X}'.format((addr_high >> 8) & 0xFF,
-                                   (addr_high) & 0xFF,
-                                   (addr_low >> 24) & 0xFF,
-                                   (addr_low >> 16) & 0xFF,
-                                   (addr_low >> 8) & 0xFF,
-                                   (addr_low & 0xFF)))
-        # Get device ID.
-        did_high = programmer.readmem32(0x10000060)
-        did_low  = programmer.readmem32(0x10000064)
-        click.echo('Device ID   : {0:08X}{1:08X}'.format(did_high, did_low))
-        # Check the UICR NFCPINS register to determine NFC pin status
-        nfcpins = programmer.readmem32(0x1000120C)
-        if nfcpins == 0xFFFFFFFF:
-            click.echo('NFC Pins    : NFC')
-        else:
-            click.echo('NFC Pins    : GPIO')
+        elif programmer == 'sim':
+            return self.create_sim()
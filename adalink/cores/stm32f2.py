@@ -3,10 +3,10 @@
 # Author: Kevin Townsend
 import os
 
-import click
-
 from ..core import Core
+from ..flash import FlashGeometry
 from ..programmers import JLink, STLink
+from ..registers import Field, Register
 
 
 # DEVICE ID register valueto name mapping
@@ -33,6 +33,23 @@ DEVICEID_CHIPREV_LOOKUP = {
     0x201F: '2 (0x201F)'
 }
 
+# Fields displayed by --info, all decoded from a single read of DBGMCU_IDCODE:
+# [0xE0042000] = CHIP_REVISION[31:16] + RESERVED[15:12] + DEVICE_ID[11:0]
+INFO_FIELDS = [
+    Register('Device ID', 0xE0042000, mask=0xFFF,
+             lookup=DEVICEID_CHIPNAME_LOOKUP, fmt='0x{0:03X}'),
+    Register('Chip Rev', 0xE0042000, mask=0xFFFF0000, shift=16,
+             lookup=DEVICEID_CHIPREV_LOOKUP, fmt='0x{0:04X}'),
+    # Segger device names only matter when using the JLink.
+    Register('Segger ID', 0xE0042000, mask=0xFFF,
+             lookup=DEVICEID_SEGGER_LOOKUP, hide_unknown=True,
+             programmers=(JLink,))
+]
+
+# 96-bit unique device ID, see section 31.2 of the STM32F205 Reference Manual.
+UNIQUE_ID_FIELD = Field('Unique ID', [(0x1FFF7A18, 32), (0x1FFF7A14, 32), (0x1FFF7A10, 32)],
+                        lambda high, middle, low: '{0:08X}{1:08X}{2:08X}'.format(high, middle, low))
+
 
 class STLink_STM32F2(STLink):
     # STM32F2-specific STLink-based programmer.  Required to add custom mass
@@ -42,8 +59,8 @@ class STLink_STM32F2(STLink):
         # Call base STLink initializer and set it up to program the STM32F2.
         super(STLink_STM32F2, self).__init__(params='-f interface/stlink-v2.cfg -f target/stm32f2x.cfg')
 
-    def wipe(self):
-        # Run OpenOCD commands to wipe STM32F2 memory.
+    def wipe_commands(self):
+        # OpenOCD commands to wipe STM32F2 memory.
         commands = [
             'init',
             'reset init',
@@ -51,20 +68,27 @@ class STLink_STM32F2(STLink):
             'stm32f2x mass_erase 0',
             'exit'
         ]
-        self.run_commands(commands)
+        return commands
 
 
 class STM32F2(Core):
     """STMicro STM32F2 CPU."""
     # Note that the docstring will be used as the short help description.
 
+    info_fields = INFO_FIELDS
+    flash_region = (0x08000000, 1024*1024)
+    # Four 16KB sectors, one 64KB sector and seven 128KB sectors.
+    flash_geometry = FlashGeometry(0x08000000, [16*1024]*4 + [64*1024] + [128*1024]*7)
+    ram_region = (0x20000000, 128*1024)
+    device_id_field = UNIQUE_ID_FIELD
+
     def __init__(self):
         # Call base class constructor.
         super(STM32F2, self).__init__()
 
     def list_programmers(self):
         """Return a list of the programmer names supported by this CPU."""
-        return ['jlink','stlink']
+        return ['jlink','stlink', 'sim']
 
     def create_programmer(self, programmer):
         """Create and return a programmer instance that will be used to program
@@ -75,19 +99,5 @@ class STM32F2(Core):
                          params='-device STM32F205RG -if swd -speed 2000')
         elif programmer == 'stlink':
             return STLink_STM32F2()
-
-    def info(self, programmer):
-        """Display info about the device."""
-        # [0xE0042000] = CHIP_REVISION[31:16] + RESERVED[15:12] + DEVICE_ID[11:0]
-        deviceid = programmer.readmem32(0xE0042000) & 0xFFF
-        chiprev  = (programmer.readmem32(0xE0042000) & 0xFFFF0000) >> 16
-        click.echo('Device ID : {0}'.format(DEVICEID_CHIPNAME_LOOKUP.get(deviceid,
-                                                   '0x{0:03X}'.format(deviceid))))
-        click.echo('Chip Rev  : {0}'.format(DEVICEID_CHIPREV_LOOKUP.get(chiprev,
-                                                   '0x{0:04X}'.format(chiprev))))
-        # Try to detect the Segger Device ID string and print it if using JLink
-        if isinstance(programmer, JLink):
-            hwid = programmer.readmem32(0xE0042000) & 0xFFF
-            hwstring = DEVICEID_SEGGER_LOOKUP.get(hwid, '0x{0:03X}'.format(hwid))
-            if '0x' not in hwstring:
-                click.echo('Segger ID : {0}'.format(hwstring))
+        elif programmer == 'sim':
+            return self.create_sim()
@@ -0,0 +1,126 @@
+# adalink Programmer Tool Discovery Cache
+#
+# Remembers what was learned about each programmer tool, like whether JLinkExe
+# runs or which OpenOCD version is installed, so the tool doesn't have to be
+# started just to check it every time a programmer is created.  Results are
+# saved to a JSON file in the user's cache folder and keyed on the tool's
+# resolved path, modification time and size, so installing a different version
+# of a tool checks it again.
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Name of the discovery cache file in the cache folder.
+CACHE_FILE = 'tools.json'
+
+# Set to true to ignore the cached results, check every tool again and save
+# the new results (the --refresh-tools option).
+refresh = False
+
+_lock = threading.Lock()
+
+
+def user_cache_dir():
+    """Return the folder adalink keeps its cached data in.  The ADALINK_CACHE_DIR
+    environment variable overrides the platform's usual user cache folder.
+    """
+    path = os.environ.get('ADALINK_CACHE_DIR')
+    if path:
+        return path
+    system = platform.system()
+    if system == 'Windows':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        return os.path.join(base, 'adalink', 'Cache')
+    if system == 'Darwin':
+        return os.path.expanduser(os.path.join('~', 'Library', 'Caches', 'adalink'))
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    return os.path.join(base, 'adalink')
+
+
+def find_executable(path):
+    """Return the full path of the executable that running path would start,
+    searching the system path if it's just a name, or None if there isn't one.
+    """
+    if sys.platform == 'win32':
+        extensions = [''] + os.environ.get('PATHEXT', '.EXE').lower().split(os.pathsep)
+    else:
+        extensions = ['']
+    if os.path.dirname(path):
+        folders = ['']
+    else:
+        folders = os.environ.get('PATH', os.defpath).split(os.pathsep)
+    for folder in folders:
+        for extension in extensions:
+            candidate = os.path.join(folder, path + extension)
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                return os.path.abspath(candidate)
+    return None
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save(path, cache):
+    # Write to a temporary file and rename it over the cache so other adalink
+    # processes never read a partly written cache.
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    handle, temp = tempfile.mkstemp(prefix='tools', suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(handle, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        if hasattr(os, 'replace'):
+            os.replace(temp, path)
+        else:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def check_tool(kind, path, check):
+    """Return what's known about the programmer tool of the provided kind (like
+    'jlink') which is run with path.  Check is a function called with the full
+    path to the tool to find out about it and returns a dict of JSON values,
+    which is saved and returned without calling check again until the tool
+    changes.  Returns None without calling check if the tool isn't found.
+    """
+    executable = find_executable(path)
+    if executable is None:
+        return None
+    resolved = os.path.realpath(executable)
+    stat = os.stat(resolved)
+    key = '{0}:{1}'.format(kind, resolved)
+    cache_path = os.path.join(user_cache_dir(), CACHE_FILE)
+    with _lock:
+        entry = _load(cache_path).get(key)
+    if not refresh and entry is not None and entry.get('mtime') == stat.st_mtime \
+       and entry.get('size') == stat.st_size:
+        logger.debug('Using cached {0} info for {1}'.format(kind, resolved))
+        return entry['info']
+    info = check(executable)
+    with _lock:
+        # Reload the cache in case another programmer saved to it meanwhile.
+        cache = _load(cache_path)
+        cache[key] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'info': info}
+        try:
+            _save(cache_path, cache)
+        except (IOError, OSError) as ex:
+            # A cache that can't be saved only means checking again next time.
+            logger.warning('Failed to save tool cache {0}: {1}'.format(cache_path, ex))
+    return info
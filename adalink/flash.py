@@ -0,0 +1,78 @@
+# adalink Flash Geometry
+#
+# Map of the sectors a core's flash is divided into, the smallest pieces it can
+# be erased in.  Used to erase only the sectors an image is written to instead
+# of the whole chip, which is faster on parts with large sectors (like the
+# STM32F2's 128KB sectors) and keeps data outside the image, like a SoftDevice
+# or calibration pages, intact.
+import bisect
+
+
+class FlashGeometry(object):
+    """Sorted, contiguous list of the (start address, size in bytes) sectors
+    of a core's flash.
+    """
+
+    def __init__(self, start, sizes):
+        """Create the geometry of flash starting at the provided address and
+        made of sectors with the provided list of sizes, in address order.
+        """
+        self.sectors = []
+        for size in sizes:
+            self.sectors.append((start, size))
+            start += size
+        self._starts = [s for s, size in self.sectors]
+
+    @classmethod
+    def uniform(cls, start, size, sector_size):
+        """Create the geometry of flash made of equal sized sectors."""
+        return cls(start, [sector_size] * (size // sector_size))
+
+    @property
+    def start(self):
+        """Start address of flash."""
+        return self.sectors[0][0]
+
+    @property
+    def end(self):
+        """Address just after the end of flash."""
+        start, size = self.sectors[-1]
+        return start + size
+
+    def sector_index(self, address):
+        """Return the index of the sector holding the address, or None if it
+        isn't in flash.
+        """
+        if address < self.start or address >= self.end:
+            return None
+        return bisect.bisect_right(self._starts, address) - 1
+
+    def covering(self, ranges):
+        """Return the sorted list of (start, size) sectors which hold any of
+        the provided list of (start, end) address ranges.  Addresses outside
+        flash are ignored.
+        """
+        indexes = set()
+        for start, end in ranges:
+            start = max(start, self.start)
+            end = min(end, self.end)
+            if start >= end:
+                continue
+            first = self.sector_index(start)
+            last = self.sector_index(end - 1)
+            indexes.update(range(first, last + 1))
+        return [self.sectors[i] for i in sorted(indexes)]
+
+    def erase_ranges(self, ranges):
+        """Return the list of (start, size) ranges of flash to erase so every
+        sector holding any of the provided list of (start, end) address ranges
+        is erased.  Neighbouring sectors are merged so each range can be
+        erased with one command.
+        """
+        merged = []
+        for start, size in self.covering(ranges):
+            if len(merged) > 0 and sum(merged[-1]) == start:
+                merged[-1] = (merged[-1][0], merged[-1][1] + size)
+            else:
+                merged.append((start, size))
+        return merged
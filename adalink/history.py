@@ -0,0 +1,336 @@
+# adalink Device History
+#
+# Optional record of every board adalink wipes or programs, for traceability:
+# when it happened, the core, programmer and probe used, the device's unique ID
+# and address (for cores which have them), a hash of the image programmed,
+# whether it worked and how long each phase took.  The hash of each flash page
+# of every image programmed is kept too, so later runs can tell which pages
+# changed since a device was last programmed without reading it back.  Records
+# are kept in a SQLite database (chosen with the --history option) in WAL mode,
+# and written in batches by a background thread so recording doesn't slow down
+# programming.
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .errors import AdaLinkError
+
+
+logger = logging.getLogger(__name__)
+
+# Most records written with one database transaction, and the longest a record
+# waits for more to batch with it.
+BATCH_SIZE = 100
+FLUSH_SECONDS = 0.5
+
+# Statements which create the database.  Runs are looked up by device ID and
+# image hash, and summarized over windows of time.  Images have a JSON object
+# of the hash of each flash page keyed by page address.
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        time REAL NOT NULL,
+        core TEXT NOT NULL,
+        programmer TEXT,
+        probe TEXT,
+        device_id TEXT,
+        device_addr TEXT,
+        image_hash TEXT,
+        image_bytes INTEGER,
+        ok INTEGER NOT NULL,
+        result TEXT,
+        error TEXT,
+        seconds REAL,
+        phases TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS runs_device_id ON runs (device_id, time)',
+    'CREATE INDEX IF NOT EXISTS runs_image_hash ON runs (image_hash, time)',
+    'CREATE INDEX IF NOT EXISTS runs_time ON runs (time)',
+    '''CREATE TABLE IF NOT EXISTS images (
+        hash TEXT NOT NULL,
+        page_size INTEGER NOT NULL,
+        pages TEXT NOT NULL,
+        PRIMARY KEY (hash, page_size)
+    )'''
+]
+
+# Values of each run, in the order of the runs table's columns.
+COLUMNS = ('time', 'core', 'programmer', 'probe', 'device_id', 'device_addr',
+           'image_hash', 'image_bytes', 'ok', 'result', 'error', 'seconds',
+           'phases')
+
+# Statements which write a run and an image's page hashes.
+RUN_INSERT = 'INSERT INTO runs ({0}) VALUES ({1})'.format(', '.join(COLUMNS),
+                                                         ', '.join('?' * len(COLUMNS)))
+IMAGE_INSERT = 'INSERT OR IGNORE INTO images (hash, page_size, pages) VALUES (?, ?, ?)'
+
+# What run summaries can be grouped by, and the SQL expression for each.
+GROUPS = {
+    'core': 'core',
+    'programmer': 'programmer',
+    'probe': 'probe',
+    'image': 'image_hash',
+    'hour': "strftime('%Y-%m-%d %H:00', time, 'unixepoch', 'localtime')",
+    'day': "strftime('%Y-%m-%d', time, 'unixepoch', 'localtime')"
+}
+
+# Seconds in each unit of age accepted by parse_age.
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 60*60, 'd': 24*60*60, 'w': 7*24*60*60}
+
+# History store being recorded to, or None when history is off.
+_active = None
+
+
+def _connect(path):
+    # Open a connection to the database.  SQLite is only imported when the
+    # history is used so adalink starts quickly.
+    import sqlite3
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+
+def parse_age(text):
+    """Return the number of seconds in an age like 30m, 12h or 7d, or None for
+    all.
+    """
+    if text == 'all':
+        return None
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhdw])$', text.strip().lower())
+    if match is None:
+        raise AdaLinkError('Bad age: {0}, use a number and unit like 30m, 12h or 7d.'.format(text))
+    return float(match.group(1)) * AGE_UNITS[match.group(2)]
+
+
+class HistoryStore(object):
+    """SQLite database of the runs adalink has made and the images they
+    programmed.  Runs and images are queued by record and add_image and
+    written in batches by a background thread, and can be looked up and
+    summarized from any thread.
+    """
+
+    def __init__(self, path):
+        """Open (or create) the history database at path."""
+        self.path = path
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        connection = _connect(path)
+        try:
+            with connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+        finally:
+            connection.close()
+        self._lock = threading.Lock()
+        self._images = set()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, name='history')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, **values):
+        """Queue a run to be written.  Values are the COLUMNS of the run, the
+        time defaults to now and phases is a dict of the seconds spent in each
+        phase.
+        """
+        values.setdefault('time', time.time())
+        values['phases'] = json.dumps(values.get('phases'), sort_keys=True)
+        self._queue.put((RUN_INSERT, [values.get(c) for c in COLUMNS]))
+
+    def add_image(self, image, page_size, digest=None):
+        """Queue the hash of each flash page of page_size bytes of the
+        image.Image to be written, unless it already was.  Digest is the
+        image's digest if it's already known.
+        """
+        digest = digest or image.digest()
+        with self._lock:
+            if (digest, page_size) in self._images:
+                return
+            self._images.add((digest, page_size))
+        pages = dict((str(page), h) for page, h in image.page_hashes(page_size).items())
+        self._queue.put((IMAGE_INSERT, [digest, page_size, json.dumps(pages, sort_keys=True)]))
+
+    def flush(self):
+        """Wait until every queued run has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Write the queued runs and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        # Write queued statements in batches until the store is closed.  They
+        # are batched until BATCH_SIZE are queued or the first has waited
+        # FLUSH_SECONDS.
+        import sqlite3
+        connection = _connect(self.path)
+        try:
+            stop = False
+            while not stop:
+                batch = [self._queue.get()]
+                deadline = time.time() + FLUSH_SECONDS
+                while batch[-1] is not None and len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get(timeout=max(0, deadline - time.time())))
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is None
+                writes = [w for w in batch if w is not None]
+                try:
+                    if len(writes) > 0:
+                        with connection:
+                            for sql, row in writes:
+                                connection.execute(sql, row)
+                except sqlite3.Error:
+                    logger.exception('Failed to write {0} records to the history'.format(len(writes)))
+                for r in batch:
+                    self._queue.task_done()
+        finally:
+            connection.close()
+
+    def _query(self, sql, args):
+        # Return a list of dicts of the rows a query returns, after writing any
+        # queued runs.
+        self.flush()
+        connection = _connect(self.path)
+        try:
+            cursor = connection.execute(sql, args)
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        finally:
+            connection.close()
+
+    def _where(self, since, device_id, image_hash):
+        # Return the WHERE clause and its arguments which filter runs.  Image
+        # hashes can be abbreviated to their first characters.
+        clauses = []
+        args = []
+        if since is not None:
+            clauses.append('time >= ?')
+            args.append(since)
+        if device_id is not None:
+            clauses.append('device_id = ?')
+            args.append(device_id)
+        if image_hash is not None:
+            clauses.append('image_hash BETWEEN ? AND ?')
+            args.extend([image_hash.lower(), image_hash.lower() + '~'])
+        if len(clauses) == 0:
+            return '', args
+        return 'WHERE ' + ' AND '.join(clauses), args
+
+    def runs(self, since=None, device_id=None, image_hash=None, limit=None):
+        """Return a list of dicts of the runs (newest first) since the provided
+        time, on the provided device ID and programming the image with the
+        provided hash (or a prefix of it), each if not None.
+        """
+        where, args = self._where(since, device_id, image_hash)
+        sql = 'SELECT * FROM runs {0} ORDER BY time DESC, id DESC'.format(where)
+        if limit is not None:
+            sql += ' LIMIT {0:d}'.format(limit)
+        runs = self._query(sql, args)
+        for run in runs:
+            run['ok'] = bool(run['ok'])
+            run['phases'] = json.loads(run['phases']) if run['phases'] else {}
+        return runs
+
+    def last_run(self, device_id, core):
+        """Return a dict of the newest run of the named core on the provided
+        device ID, or None if there isn't one.
+        """
+        runs = self._query('SELECT * FROM runs WHERE device_id = ? AND core = ? '
+                           'ORDER BY time DESC, id DESC LIMIT 1', (device_id, core))
+        if len(runs) == 0:
+            return None
+        runs[0]['ok'] = bool(runs[0]['ok'])
+        return runs[0]
+
+    def image_pages(self, digest, page_size):
+        """Return a dict of the hash of each flash page of page_size bytes of
+        the image with the provided digest keyed by page address, or None if
+        the image isn't known.
+        """
+        rows = self._query('SELECT pages FROM images WHERE hash = ? AND page_size = ?',
+                           (digest, page_size))
+        if len(rows) == 0:
+            return None
+        return dict((int(page), h) for page, h in json.loads(rows[0]['pages']).items())
+
+    def summary(self, since=None, by='core', device_id=None, image_hash=None):
+        """Return a list of dicts summarizing the runs since the provided time
+        (and filtered like runs), grouped by one of the GROUPS.  Each has the
+        group, number of runs, failed runs, failure rate, number of different
+        devices, average seconds per run and successful runs per hour.
+        """
+        where, args = self._where(since, device_id, image_hash)
+        rows = self._query(
+            'SELECT {0} AS grp, COUNT(*) AS runs, SUM(1 - ok) AS failed, '
+            'COUNT(DISTINCT device_id) AS devices, AVG(seconds) AS seconds, '
+            'MIN(time) AS first FROM runs {1} GROUP BY grp ORDER BY grp'.format(GROUPS[by], where),
+            args)
+        now = time.time()
+        summary = []
+        for row in rows:
+            # Throughput is over the group's hour or day when grouped by time,
+            # otherwise over the whole window (or since the group's first run
+            # when there's no window).
+            if by in ('hour', 'day'):
+                hours = 1.0 if by == 'hour' else 24.0
+            else:
+                hours = (now - (since if since is not None else row['first'])) / 3600.0
+            summary.append({
+                'group': row['grp'],
+                'runs': row['runs'],
+                'failed': row['failed'],
+                'failure_rate': float(row['failed']) / row['runs'],
+                'devices': row['devices'],
+                'seconds': row['seconds'],
+                'per_hour': (row['runs'] - row['failed']) / hours if hours > 0 else None
+            })
+        return summary
+
+
+def start(path):
+    """Start recording runs to the history store at path and return it."""
+    global _active
+    _active = HistoryStore(path)
+    return _active
+
+
+def stop():
+    """Write any queued runs and stop recording."""
+    global _active
+    store, _active = _active, None
+    if store is not None:
+        store.close()
+
+
+def active():
+    """Return the history store being recorded to, or None if history is off."""
+    return _active
+
+
+def record(**values):
+    """Queue a run to be written to the history store, if history is on.  See
+    HistoryStore.record.
+    """
+    if _active is not None:
+        _active.record(**values)
+
+
+def add_image(image, page_size, digest=None):
+    """Queue the page hashes of an image.Image to be written to the history
+    store, if history is on.  See HistoryStore.add_image.
+    """
+    if _active is not None:
+        _active.add_image(image, page_size, digest)
@@ -0,0 +1,275 @@
+# adalink Memory Image
+#
+# Sparse model of the memory contents to program into a chip, built from any
+# number of Intel HEX and binary files.  Data is kept as a sorted list of
+# contiguous segments so the image can be programmed with as few writes as
+# possible.
+import binascii
+import bisect
+import contextlib
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+from .errors import AdaLinkError
+
+
+class Image(object):
+    """Sparse memory image made of sorted, non-overlapping segments of data."""
+
+    def __init__(self):
+        # Start addresses and data of each segment, kept sorted by address.
+        self._starts = []
+        self._data = []
+
+    @classmethod
+    def from_files(cls, hex_files=[], bin_files=[]):
+        """Create an image from a list of .hex file paths and a list of
+        (path, address) tuples for .bin files.
+        """
+        image = cls()
+        for f in hex_files:
+            image.add_hex_file(f)
+        for f, address in bin_files:
+            image.add_bin_file(f, address)
+        return image
+
+    @property
+    def segments(self):
+        """List of (address, data) tuples for each contiguous segment of the
+        image, in address order.
+        """
+        return [(start, bytes(data)) for start, data in zip(self._starts, self._data)]
+
+    def __len__(self):
+        """Return the number of bytes of data in the image."""
+        return sum(len(data) for data in self._data)
+
+    def add(self, address, data, source='data'):
+        """Add data at the provided address.  Data may overlap data already in
+        the image as long as the overlapping bytes are the same, otherwise an
+        error naming the source of the new data is raised.  Segments which
+        touch or overlap are merged together.
+        """
+        if len(data) == 0:
+            return
+        end = address + len(data)
+        # Find the range of existing segments which overlap or touch the data.
+        first = bisect.bisect_right(self._starts, address) - 1
+        if first < 0 or self._starts[first] + len(self._data[first]) < address:
+            first += 1
+        last = bisect.bisect_right(self._starts, end)
+        if first == last:
+            # Nothing overlaps, insert a new segment.
+            self._starts.insert(first, address)
+            self._data.insert(first, bytearray(data))
+            return
+        for i in range(first, last):
+            start = self._starts[i]
+            lo = max(start, address)
+            hi = min(start + len(self._data[i]), end)
+            if lo < hi and self._data[i][lo-start:hi-start] != data[lo-address:hi-address]:
+                raise AdaLinkError('{0} conflicts with data already at 0x{1:08X}!'.format(source, lo))
+        start = self._starts[first]
+        if last == first + 1 and start + len(self._data[first]) == address:
+            # Common case of data continuing on from the end of a segment.
+            self._data[first].extend(data)
+            return
+        start = min(start, address)
+        merged = bytearray(max(end, self._starts[last-1] + len(self._data[last-1])) - start)
+        for i in range(first, last):
+            offset = self._starts[i] - start
+            merged[offset:offset+len(self._data[i])] = self._data[i]
+        merged[address-start:end-start] = data
+        self._starts[first:last] = [start]
+        self._data[first:last] = [merged]
+
+    def add_bin_file(self, path, address):
+        """Add the contents of a binary file at the provided address."""
+        with open(path, 'rb') as f:
+            self.add(address, f.read(), path)
+
+    def add_hex_file(self, path):
+        """Add the contents of an Intel HEX file."""
+        base = 0
+        run_start = None
+        run = bytearray()
+        with open(path, 'r') as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    if line[0] != ':':
+                        raise ValueError
+                    record = bytearray(binascii.unhexlify(line[1:]))
+                except (ValueError, TypeError, binascii.Error):
+                    raise AdaLinkError('{0} line {1} is not a valid hex record!'.format(path, number))
+                if len(record) < 5 or len(record) != record[0] + 5 or sum(record) & 0xFF != 0:
+                    raise AdaLinkError('{0} line {1} has a bad length or checksum!'.format(path, number))
+                kind = record[3]
+                if kind == 0:
+                    # Data record, collect contiguous records into one run so
+                    # the image only has to merge each run once.
+                    address = base + ((record[1] << 8) | record[2])
+                    if run_start is None or run_start + len(run) != address:
+                        if run_start is not None:
+                            self.add(run_start, run, path)
+                        run_start = address
+                        run = bytearray()
+                    run.extend(record[4:-1])
+                elif kind == 1:
+                    # End of file.
+                    break
+                elif kind == 2:
+                    # Extended segment address.
+                    base = ((record[4] << 8) | record[5]) << 4
+                elif kind == 4:
+                    # Extended linear address.
+                    base = ((record[4] << 8) | record[5]) << 16
+                # Start address records (3 and 5) don't hold any data.
+        if run_start is not None:
+            self.add(run_start, run, path)
+
+    def coalesced(self, page_size, fill=0xFF):
+        """Return a copy of the image where segments that share a flash page
+        are merged into one, with the gaps between them filled.  The page is
+        erased before being written so the filled gaps are left unchanged.
+        """
+        image = Image()
+        for start, data in zip(self._starts, self._data):
+            if page_size and image._starts:
+                last_end = image._starts[-1] + len(image._data[-1])
+                if start // page_size <= (last_end - 1) // page_size:
+                    image._data[-1].extend(bytearray([fill]) * (start - last_end))
+                    image._data[-1].extend(data)
+                    continue
+            image._starts.append(start)
+            image._data.append(bytearray(data))
+        return image
+
+    def _page_chunks(self, page_size):
+        # Yield (page address, address, data) for each piece of a segment
+        # within a single flash page, in address order.
+        for start, data in zip(self._starts, self._data):
+            offset = 0
+            while offset < len(data):
+                address = start + offset
+                page = address - address % page_size
+                count = min(len(data) - offset, page + page_size - address)
+                yield page, address, data[offset:offset+count]
+                offset += count
+
+    def page_digests(self, page_size):
+        """Return a dict of the CRC32 of the image data in each flash page the
+        image touches, keyed by page address.  Only bytes in the image are
+        included, the rest of each page is ignored.
+        """
+        digests = {}
+        for page, address, data in self._page_chunks(page_size):
+            digests[page] = zlib.crc32(data, digests.get(page, 0)) & 0xFFFFFFFF
+        return digests
+
+    def digest(self):
+        """Return the SHA-256 hex digest of the image's data and the addresses
+        it's at, which identifies the image no matter which files it was
+        loaded from.
+        """
+        digest = hashlib.sha256()
+        for start, data in zip(self._starts, self._data):
+            digest.update(struct.pack('<II', start, len(data)))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def page_hashes(self, page_size):
+        """Return a dict of the SHA-256 hex digest of the image data in each
+        flash page the image touches and the addresses it's at, keyed by page
+        address.  Unlike page_digests, pages only match when they hold the
+        same bytes at the same addresses.
+        """
+        hashes = {}
+        for page, address, data in self._page_chunks(page_size):
+            digest = hashes.setdefault(page, hashlib.sha256())
+            digest.update(struct.pack('<II', address, len(data)))
+            digest.update(data)
+        return dict((page, digest.hexdigest()) for page, digest in hashes.items())
+
+    def select_pages(self, pages, page_size):
+        """Return a new image with only the data in the provided list of flash
+        page addresses.
+        """
+        pages = set(pages)
+        image = Image()
+        for page, address, data in self._page_chunks(page_size):
+            if page in pages:
+                image.add(address, data)
+        return image
+
+    def select_ranges(self, ranges):
+        """Return a new image with only the data inside the provided list of
+        (start, end) address ranges.
+        """
+        image = Image()
+        for start, data in zip(self._starts, self._data):
+            for lo, hi in ranges:
+                lo = max(lo, start)
+                hi = min(hi, start + len(data))
+                if lo < hi:
+                    image.add(lo, bytes(data[lo-start:hi-start]))
+        return image
+
+    @contextlib.contextmanager
+    def bin_files(self):
+        """Context manager which writes each segment of the image to a
+        temporary .bin file and provides a list of (path, address) tuples for
+        them.  The files are deleted when the context exits.
+        """
+        directory = tempfile.mkdtemp(prefix='adalink')
+        try:
+            files = []
+            for start, data in zip(self._starts, self._data):
+                path = os.path.join(directory, '{0:08X}.bin'.format(start))
+                with open(path, 'wb') as f:
+                    f.write(data)
+                files.append((path, start))
+            yield files
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _hex_record(kind, address, data=b''):
+    # Return an Intel HEX record line with its checksum.
+    record = bytearray([len(data), (address >> 8) & 0xFF, address & 0xFF, kind])
+    record.extend(data)
+    record.append(-sum(record) & 0xFF)
+    return ':{0}\n'.format(binascii.hexlify(bytes(record)).decode('ascii').upper())
+
+
+def bin_to_hex(bin_path, address, hex_path, chunk_size=64*1024):
+    """Convert the .bin file at bin_path, holding memory from the provided
+    start address, to an Intel HEX file at hex_path.  The .bin file is read
+    and converted chunk_size bytes at a time so large files aren't held in
+    memory.
+    """
+    base = None
+    with open(bin_path, 'rb') as source:
+        with open(hex_path, 'w') as f:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                offset = 0
+                while offset < len(chunk):
+                    # Records hold up to 16 bytes and can't cross a 64KB
+                    # boundary, which needs an extended linear address record.
+                    if base != address >> 16:
+                        base = address >> 16
+                        f.write(_hex_record(4, 0, bytearray([base >> 8, base & 0xFF])))
+                    count = min(16, len(chunk) - offset, 0x10000 - (address & 0xFFFF))
+                    f.write(_hex_record(0, address & 0xFFFF, chunk[offset:offset+count]))
+                    offset += count
+                    address += count
+            f.write(_hex_record(1, 0))
@@ -1,19 +1,59 @@
-import logging
 import os
 import platform
 
 import click
 
 from . import __version__
-from .core import Core
+from . import timing
+from .cores import CORES, load_core
 
 
-@click.group(subcommand_metavar='CORE')
+class CoreGroup(click.Group):
+    """Click group with a command for every core in the cores registry.  Each
+    core is only imported and built when its command is used, so running one
+    command or showing the help doesn't pay to set up every core.
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(CORES) | set(self.commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in CORES:
+            self.add_command(load_core(name)())
+        return self.commands.get(name)
+
+    def format_commands(self, ctx, formatter):
+        # List the cores with the short help from the registry instead of
+        # building each of them.
+        names = self.list_commands(ctx)
+        limit = formatter.width - 6 - max(len(n) for n in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                if self.commands[name].hidden:
+                    continue
+                rows.append((name, self.commands[name].get_short_help_str(limit)))
+            else:
+                rows.append((name, CORES[name][2]))
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=CoreGroup, subcommand_metavar='CORE')
 @click.option('-v', '--verbose', is_flag=True,
               help='Display verbose output like raw programmer commands.')
+@click.option('--profile', type=click.File('w'), metavar='FILE',
+              help='Write how long each phase of the run took to FILE as JSON when done.')
+@click.option('--profile-python', type=click.Path(dir_okay=False), metavar='FILE',
+              help='Profile adalink\'s own Python code and write the cProfile stats to FILE when done.')
+@click.option('--refresh-tools', is_flag=True,
+              help='Check the programmer tools again instead of using the results cached from earlier runs.')
+@click.option('--history', 'history_path', type=click.Path(dir_okay=False), metavar='FILE',
+              envvar='ADALINK_HISTORY',
+              help='Record every board wiped or programmed to the SQLite database FILE, and query it with the history command.')
 @click.version_option(version=__version__)
 @click.pass_context
-def main(ctx, verbose):
+def main(ctx, verbose, profile, profile_python, refresh_tools, history_path):
     """AdaLink ARM CPU Programmer.
 
     AdaLink can program different ARM CPUs using programming hardware such as
@@ -33,17 +73,226 @@ def main(ctx, verbose):
         os.environ["PATH"] = os.environ["PATH"] + ':/usr/local/bin'
     # Initialize context as empty dict to store data sent from core to commands.
     ctx.obj = {}
-    # Enable verbose debug output if required.
+    # Enable verbose debug output if required.  Logging (like cProfile below)
+    # is only imported when it's used so adalink starts quickly.
     if verbose:
+        import logging
         logging.basicConfig(level=logging.DEBUG)
+    # Ignore the cached programmer tool checks if requested.
+    if refresh_tools:
+        from . import discovery
+        discovery.refresh = True
+    # Record the time taken by each phase of the run if requested, and write
+    # it out when the run is done (even if it failed).
+    if profile is not None:
+        timing.start()
+        def write_profile():
+            profile.write(timing.stop().to_json() + '\n')
+            profile.flush()
+        ctx.call_on_close(write_profile)
+    # Record each run to the history store if requested, writing any runs
+    # still queued when adalink is done.
+    if history_path is not None:
+        from . import history
+        history.start(history_path)
+        ctx.call_on_close(history.stop)
+    if profile_python is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        def write_stats():
+            profiler.disable()
+            profiler.dump_stats(profile_python)
+        ctx.call_on_close(write_stats)
 
 
-# Import all the cores.  Must be done after the main function above or else
-# there will be a circular reference.  Also MUST be a * reference to ensure all
-# the cores are dynamically loaded.
-from .cores import *
-for core in Core.__subclasses__():
-    main.add_command(core())
+@main.command(short_help='Run a station server which programs boards for submitted jobs.')
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help='Address to listen on.')
+@click.option('--port', type=int, default=8808, show_default=True,
+              help='TCP port to listen on.')
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False), metavar='PATH',
+              help='Listen on a Unix socket at PATH instead of a TCP port.')
+def serve(host, port, socket_path):
+    """Run a station server which programs boards for submitted jobs.
+
+    Jobs are submitted as JSON over HTTP to POST /jobs, and queued for each
+    probe.  The programmer tools are kept running between the jobs of each
+    probe so boards are programmed without starting adalink every time.  See
+    adalink/server.py for the API.
+    """
+    # The server is only imported when it's used so adalink starts quickly.
+    from .server import serve as run_server
+    def ready(server):
+        click.echo('Listening on {0}'.format(socket_path or '{0}:{1}'.format(host, port)))
+    run_server(host, port, socket_path, ready)
+
+
+@main.command(short_help='Run the steps of a manifest file.')
+@click.argument('manifest', type=click.Path(exists=True, dir_okay=False))
+@click.option('--json', 'as_json', is_flag=True,
+              help='Print the results of every step as JSON.')
+def run(manifest, as_json):
+    """Run the steps of a JSON or YAML manifest file in one process.
+
+    Each step can wipe, program, verify, write and read memory on a core with
+    a probe.  The steps of each probe run in order over one programmer session,
+    and different probes run at the same time.  See adalink/manifest.py for
+    the format.
+    """
+    import json
+    from . import manifest as manifests
+    from .errors import AdaLinkError
+    steps = manifests.load(manifest)
+    jobs = manifests.run(steps)
+    if as_json:
+        results = [dict(job.to_dict(), name=step['name']) for step, job in zip(steps, jobs)]
+        click.echo(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        # Print a table of the result of each step, followed by anything it
+        # read.
+        width = max([len('Step')] + [len(s['name']) for s in steps])
+        probes = [str(job.options['probe'] or '-') for job in jobs]
+        probe_width = max([len('Probe')] + [len(p) for p in probes])
+        click.echo('{0:<{1}}  {2:<{3}}  {4:<7}  {5:>8}  {6}'.format(
+            'Step', width, 'Probe', probe_width, 'Result', 'Time', 'Details'))
+        for step, probe, job in zip(steps, probes, jobs):
+            seconds = job.finished - job.started
+            details = job.error or (job.results or {}).get('result') or 'Done.'
+            click.echo('{0:<{1}}  {2:<{3}}  {4:<7}  {5:>7.2f}s  {6}'.format(
+                step['name'], width, probe, probe_width, job.state.upper(), seconds, details))
+        for step, job in zip(steps, jobs):
+            results = job.results or {}
+            for label, text in results.get('info', []):
+                click.echo('{0}: {1} : {2}'.format(step['name'], label, text))
+            for (address, count, bits), values in zip(job.options['reads'],
+                                                       results.get('reads', [])):
+                address = address if isinstance(address, int) else int(address, 0)
+                click.echo('{0}: 0x{1:08X} = {2}'.format(step['name'], address, ' '.join(
+                    '0x{0:0{1}X}'.format(v, bits // 4) for v in values)))
+    failed = len([job for job in jobs if job.state != 'done'])
+    if failed > 0:
+        raise AdaLinkError('{0} of {1} steps failed!'.format(failed, len(jobs)))
+
+
+@main.command(short_help='Show throughput and failure rates from the history.')
+@click.option('--since', default='24h', show_default=True, metavar='AGE',
+              help='Only include runs newer than AGE, like 30m, 12h or 7d, or all.')
+@click.option('--by', type=click.Choice(['core', 'day', 'hour', 'image', 'probe', 'programmer']),
+              default='core', show_default=True, help='Group the runs by this.')
+@click.option('--device', metavar='ID', help='Only include runs on the device with this ID.')
+@click.option('--image', metavar='HASH',
+              help='Only include runs which programmed the image with this hash, or the start of it.')
+@click.option('--list', 'list_runs', is_flag=True, help='List each run instead of summarizing them.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the results as JSON.')
+def history(since, by, device, image, list_runs, as_json):
+    """Show throughput and failure rates of the runs in the history.
+
+    The history is recorded and read from the SQLite database chosen with the
+    --history option (or ADALINK_HISTORY environment variable) before the
+    command.
+    """
+    import json
+    import time
+    from . import history as histories
+    from .errors import AdaLinkError
+    store = histories.active()
+    if store is None:
+        raise AdaLinkError('Choose the history database with the --history option before the command.')
+    age = histories.parse_age(since)
+    since = None if age is None else time.time() - age
+    if list_runs:
+        rows = store.runs(since, device, image)
+        if as_json:
+            click.echo(json.dumps(rows, indent=2, sort_keys=True))
+            return
+        click.echo('{0:<19}  {1:<10}  {2:<10}  {3:<24}  {4:<12}  {5:<6}  {6:>8}  {7}'.format(
+            'Time', 'Core', 'Probe', 'Device ID', 'Image', 'Result', 'Time', 'Details'))
+        for r in rows:
+            click.echo('{0:<19}  {1:<10}  {2:<10}  {3:<24}  {4:<12}  {5:<6}  {6:>7.2f}s  {7}'.format(
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r['time'])), r['core'],
+                r['probe'] or '-', r['device_id'] or '-', (r['image_hash'] or '-')[:12],
+                'OK' if r['ok'] else 'FAILED', r['seconds'] or 0,
+                (r['error'] if not r['ok'] else r['result']) or ''))
+        return
+    rows = store.summary(since, by, device, image)
+    if as_json:
+        click.echo(json.dumps(rows, indent=2, sort_keys=True))
+        return
+    groups = [str(r['group'] or '-')[:12 if by == 'image' else None] for r in rows]
+    width = max([len(by)] + [len(g) for g in groups])
+    click.echo('{0:<{1}}  {2:>6}  {3:>6}  {4:>6}  {5:>7}  {6:>8}  {7:>8}'.format(
+        by.capitalize(), width, 'Runs', 'Failed', 'Fail %', 'Devices', 'Avg time', 'Per hour'))
+    for group, r in zip(groups, rows):
+        click.echo('{0:<{1}}  {2:>6}  {3:>6}  {4:>5.1f}%  {5:>7}  {6:>7.2f}s  {7:>8}'.format(
+            group, width, r['runs'], r['failed'], 100 * r['failure_rate'], r['devices'],
+            r['seconds'] or 0, '-' if r['per_hour'] is None else '{0:.1f}'.format(r['per_hour'])))
+
+
+@main.command(short_help='Sample memory at a fixed rate and stream the values.')
+@click.argument('core', type=click.Choice(sorted(CORES)))
+@click.argument('addresses', nargs=-1, required=True, metavar='ADDRESS[:WIDTH]...')
+@click.option('-p', '--programmer', required=True, help='Programmer type.')
+@click.option('--probe', metavar='SERIAL', help='Use the probe with this serial number.')
+@click.option('--rate', type=float, default=10.0, show_default=True,
+              help='Samples per second.')
+@click.option('--count', type=int, help='Stop after this many samples.')
+@click.option('--duration', type=float, metavar='SECONDS', help='Stop after this many seconds.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'ndjson']), default='csv',
+              show_default=True, help='Print each sample as a CSV line or a JSON object.')
+def watch(core, addresses, programmer, probe, rate, count, duration, output_format):
+    """Sample memory at a fixed rate over one programmer session and print
+    each sample as it's read, timestamped, until stopped with Ctrl-C.
+
+    Each ADDRESS is read as a 32-bit value, or add :8 or :16 to read a byte
+    or half word, like 0x20000000:16.
+    """
+    from . import watch as watches
+    from .errors import AdaLinkError
+    if rate <= 0:
+        raise AdaLinkError('The --rate must be more than 0.')
+    reads = [watches.parse_read(a) for a in addresses]
+    core, programmer = watches.open_programmer(core, programmer, probe)
+    line = watches.csv_line if output_format == 'csv' else watches.json_line
+    try:
+        with programmer.session():
+            watches.check_connected(core, programmer)
+            if output_format == 'csv':
+                click.echo(watches.csv_header(reads))
+            for now, values in watches.sample(programmer, reads, 1.0 / rate, count, duration):
+                click.echo(line(now, reads, values))
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command('wait-for', short_help='Wait until a memory value has the expected bits set.')
+@click.argument('core', type=click.Choice(sorted(CORES)))
+@click.argument('address')
+@click.argument('mask')
+@click.argument('value')
+@click.option('-p', '--programmer', required=True, help='Programmer type.')
+@click.option('--probe', metavar='SERIAL', help='Use the probe with this serial number.')
+@click.option('--width', type=click.Choice(['8', '16', '32']), default='32', show_default=True,
+              help='Bits of memory to read at ADDRESS.')
+@click.option('--timeout', type=float, default=10.0, show_default=True, metavar='SECONDS',
+              help='Fail if the value doesn\'t match within this many seconds.')
+@click.option('--interval', type=float, default=0.01, show_default=True, metavar='SECONDS',
+              help='Seconds between reads.')
+def wait_for(core, address, mask, value, programmer, probe, width, timeout, interval):
+    """Read memory at ADDRESS over one programmer session until the value
+    ANDed with MASK equals VALUE, then print it.  Fails with an error (and a
+    non-zero exit status) if it doesn't within the timeout, for use in test
+    scripts.  ADDRESS, MASK and VALUE can be in hex, like 0x1234ABCD.
+    """
+    from . import watch as watches
+    address, mask, value = [watches.parse_int(t) for t in (address, mask, value)]
+    width = int(width)
+    core, programmer = watches.open_programmer(core, programmer, probe)
+    with programmer.session():
+        watches.check_connected(core, programmer)
+        current, seconds = watches.wait_for(programmer, address, mask, value, timeout,
+                                            width, interval)
+    click.echo('0x{0:0{1}X} after {2:.3f}s'.format(current, width // 4, seconds))
 
 
 if __name__ == '__main__':
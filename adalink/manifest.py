@@ -0,0 +1,96 @@
+# adalink Batch Manifests
+#
+# Runs a manifest of many operations, across cores and probes, in one adalink
+# process behind the `adalink run` command.  A manifest is a JSON (or, with
+# PyYAML installed, YAML) file with a list of steps, each one a station job
+# (see server.Station.submit) which can wipe, program, verify, write words and
+# read memory.  Any other top level values are defaults for every step:
+#
+#   {
+#     "core": "nrf51822",
+#     "programmer": "jlink",
+#     "steps": [
+#       {"name": "board 1", "probe": "682000001", "wipe": true, "hex": ["app.hex"]},
+#       {"name": "board 2", "probe": "682000002", "wipe": true, "hex": ["app.hex"]},
+#       {"probe": "682000001", "writes": [["0x10001080", "0x1", 32]]}
+#     ]
+#   }
+#
+# The steps are run by a server.Station, so each probe's steps run in order
+# over one open programmer session while different probes run at the same
+# time, and images are loaded once for every step that programs them.  When a
+# step fails the later steps on its probe are skipped.
+import json
+import os
+
+from .errors import AdaLinkError
+from .server import Station
+
+
+def load(path):
+    """Load the manifest at path and return its list of steps, each a dict of
+    job options with the manifest's defaults applied and relative file paths
+    resolved from the manifest's folder.
+    """
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise AdaLinkError('YAML manifests need PyYAML, install it with: pip install pyyaml')
+            try:
+                manifest = yaml.safe_load(f)
+            except yaml.YAMLError as ex:
+                raise AdaLinkError('Could not read manifest {0}: {1}'.format(path, ex))
+        else:
+            try:
+                manifest = json.load(f)
+            except ValueError as ex:
+                raise AdaLinkError('Could not read manifest {0}: {1}'.format(path, ex))
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('steps'), list):
+        raise AdaLinkError('The manifest must be an object with a list of steps.')
+    defaults = dict(manifest)
+    del defaults['steps']
+    folder = os.path.dirname(os.path.abspath(path))
+    steps = []
+    for i, step in enumerate(manifest['steps']):
+        if not isinstance(step, dict):
+            raise AdaLinkError('Step {0} of the manifest must be an object.'.format(i + 1))
+        step = dict(defaults, **step)
+        step['name'] = str(step.get('name', i + 1))
+        if not isinstance(step.get('hex', []), list):
+            raise AdaLinkError('Step {0}: hex must be a list of paths.'.format(step['name']))
+        bins = step.get('bin', [])
+        if not isinstance(bins, list) or not all(isinstance(b, list) and len(b) == 2 for b in bins):
+            raise AdaLinkError('Step {0}: bin must be a list of [path, address] pairs.'.format(step['name']))
+        step['hex'] = [os.path.join(folder, p) for p in step.get('hex', [])]
+        step['bin'] = [[os.path.join(folder, p), a] for p, a in step.get('bin', [])]
+        steps.append(step)
+    return steps
+
+
+def run(steps):
+    """Check and run the provided list of steps and return a list with the
+    finished server.Job of each one, in the same order.  Nothing is run if
+    any step is invalid.
+    """
+    station = Station()
+    try:
+        options = []
+        for step in steps:
+            try:
+                options.append(station.check(dict((k, v) for k, v in step.items()
+                                                  if k != 'name')))
+            except AdaLinkError as ex:
+                raise AdaLinkError('Step {0}: {1}'.format(step['name'], ex))
+        jobs = []
+        last = {}
+        for o in options:
+            job = station.submit(o, after=last.get(o['probe']))
+            last[o['probe']] = job
+            jobs.append(job)
+        for job in jobs:
+            job.done.wait()
+    finally:
+        station.stop()
+    return jobs
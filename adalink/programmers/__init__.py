@@ -1,3 +1,5 @@
 from .jlink import JLink
+from .openocd import OpenOCD
 from .stlink import STLink
 from .raspi2 import RasPi2
+from .sim import Sim
@@ -0,0 +1,505 @@
+# adalink asyncio Programmers
+#
+# Asyncio interface to the JLink and OpenOCD based programmers, for embedding
+# adalink in an event loop which supervises many probes at once.  An async
+# programmer wraps a normal programmer instance (like the ones created by the
+# cores) and reuses its commands and output parsing, but runs the programmer
+# tool with asyncio subprocesses and streams instead of blocking a thread.
+# Timeouts are applied with asyncio.wait_for, and cancelling an operation
+# kills the tool process it was waiting on.
+#
+# Requires Python 3.7 or greater.
+import asyncio
+import contextlib
+import logging
+import os
+import tempfile
+
+from .base import (changed_image_pages, check_dump, mismatched_ranges,
+                   range_blocks, range_bytes, segment_ranges)
+from .jlink import JLink, JLinkSession, QUIT_COMMANDS
+from .openocd import (OpenOCD, RPC_RUN_PROC, RPC_TERMINATOR,
+                      SESSION_SKIP_COMMANDS, _free_port)
+from ..errors import AdaLinkError
+
+
+logger = logging.getLogger(__name__)
+
+# Largest amount of output a stream can buffer while looking for the end of a
+# response, big enough for a large memory dump.
+STREAM_LIMIT = 16*1024*1024
+
+# Messages for when the programmer tools can't be started.
+JLINK_MISSING = "'{0}' missing. Is the J-Link folder in your system path?"
+OPENOCD_MISSING = "'{0}' missing. Is OpenOCD installed and in your system path?"
+
+
+async def _kill(process):
+    # Stop a process if it's still running and wait for it to exit.
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+
+async def _spawn(args, missing, **kwargs):
+    # Start a process with its output and errors combined on stdout.
+    try:
+        return await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT, limit=STREAM_LIMIT, **kwargs)
+    except OSError:
+        raise AdaLinkError(missing.format(args[0]))
+
+
+async def _run_process(args, monitor, missing, timeout_sec):
+    # Run a process to completion feeding its output to the monitor line by
+    # line, and return the output.  The process is killed if the monitor finds
+    # a fatal error, it takes longer than timeout_sec, or the caller is
+    # cancelled.
+    process = await _spawn(args, missing)
+
+    async def read_output():
+        async for line in process.stdout:
+            monitor.feed(line.decode('utf-8', 'replace'))
+        await process.wait()
+    try:
+        await asyncio.wait_for(read_output(), timeout_sec)
+    except asyncio.TimeoutError:
+        raise AdaLinkError('{0} process exceeded timeout!'.format(monitor.name))
+    finally:
+        await _kill(process)
+    output = monitor.close()
+    logger.debug('{0} response: {1}'.format(monitor.name, output))
+    return output
+
+
+class AsyncProgrammer(object):
+    """Base class for asyncio programmers.  Wraps a normal programmer and
+    provides the same functions as coroutines.
+    """
+
+    def __init__(self, programmer):
+        """Create an async programmer which runs the commands of the provided
+        programmer instance.  Any probe must already be selected on it with
+        select_probe.
+        """
+        self.programmer = programmer
+        self._session = None
+        self._session_depth = 0
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """Async context manager which keeps a single programmer tool process
+        running for every call made inside it.  The process is started by the
+        first command.  Sessions can be nested, the process is only stopped
+        when the outermost one exits.
+        """
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if self._session_depth == 0 and self._session is not None:
+                session, self._session = self._session, None
+                await session.close()
+
+    async def run_commands(self, commands, timeout_sec=60, abort=True):
+        """Run the provided list of programmer tool commands and return their
+        output.  If execution takes longer than timeout_sec an exception will
+        be thrown.  Set timeout_sec to None to disable the timeout completely.
+        If abort is true the commands are stopped with an exception as soon as
+        the tool reports a fatal error.
+        """
+        raise NotImplementedError
+
+    async def is_connected(self):
+        """Return true if the device is connected to the programmer."""
+        output = await self.run_commands(self.programmer.is_connected_commands(),
+                                         abort=False)
+        return self.programmer.parse_is_connected(output)
+
+    async def wipe(self):
+        """Wipe clean the flash memory of the device."""
+        await self.run_commands(self.programmer.wipe_commands())
+
+    async def program(self, hex_files=[], bin_files=[]):
+        """Program chip with provided list of hex and/or bin files, see
+        Programmer.program.
+        """
+        output = await self.run_commands(self.programmer.program_commands(hex_files, bin_files))
+        self.programmer.parse_program(output, hex_files, bin_files)
+
+    async def program_image(self, image):
+        """Program chip with the contents of an image.Image."""
+        with image.bin_files() as bin_files:
+            await self.program([], bin_files)
+
+    async def program_pages(self, image):
+        """Erase and program only the flash pages touched by the provided
+        image.Image, see Programmer.program_pages.
+        """
+        await self.program_image(image)
+
+    async def program_sectors(self, image, ranges):
+        """Erase the provided list of (start, size) ranges of flash and program
+        the image.Image without erasing anything else, see
+        Programmer.program_sectors.
+        """
+        with image.bin_files() as bin_files:
+            await self.run_commands(self.programmer.program_sectors_commands(bin_files, ranges))
+
+    async def changed_pages(self, image, page_size):
+        """Return an image.Image with the data from image that is in flash
+        pages of page_size bytes whose contents differ from the target.
+        """
+        target = await self.readmem_ranges(segment_ranges(image))
+        return changed_image_pages(image, page_size, target)
+
+    async def verify_image(self, image):
+        """Return a list of (start, end) address ranges where the image.Image
+        doesn't match the target's memory, see Programmer.verify_image.  Each
+        segment is compared by the programmer's tool, or if it can't the
+        memory is read back and compared here.
+        """
+        with image.bin_files() as bin_files:
+            output = await self.run_commands(self.programmer.verify_image_commands(bin_files),
+                                             abort=False)
+        mismatched = self.programmer.parse_verify_image(output, image)
+        if mismatched is not None:
+            return mismatched
+        target = await self.readmem_ranges(segment_ranges(image))
+        return mismatched_ranges(image, target)
+
+    async def readmem_blocks(self, blocks):
+        """Read a list of (address, count, width) blocks of memory and return a
+        list with an array of values for each block.
+        """
+        output = await self.run_commands(self.programmer.readmem_blocks_commands(blocks))
+        return self.programmer.parse_readmem_blocks(output, blocks)
+
+    async def readmem_block(self, address, count, width=32):
+        """Read count values of the provided bit width (8, 16 or 32) starting
+        at the provided memory address.
+        """
+        return (await self.readmem_blocks([(address, count, width)]))[0]
+
+    async def readmem_ranges(self, ranges):
+        """Read a list of (address, length) byte ranges of memory and return a
+        list with the bytes of each range.
+        """
+        blocks = range_blocks(ranges)
+        return range_bytes(ranges, blocks, await self.readmem_blocks(blocks))
+
+    async def writemem_words(self, writes):
+        """Write a list of (address, value, width) words to memory in order."""
+        await self.run_commands(self.programmer.writemem_words_commands(writes))
+
+    async def readmem32(self, address):
+        """Read a 32-bit value from the provided memory address."""
+        return (await self.readmem_block(address, 1, 32))[0]
+
+    async def readmem16(self, address):
+        """Read a 16-bit value from the provided memory address."""
+        return (await self.readmem_block(address, 1, 16))[0]
+
+    async def readmem8(self, address):
+        """Read a 8-bit value from the provided memory address."""
+        return (await self.readmem_block(address, 1, 8))[0]
+
+    async def dump_bin(self, path, address, length):
+        """Save length bytes of memory starting at the provided address to a
+        .bin file at path, see Programmer.dump_bin.
+        """
+        await self.run_commands(self.programmer.dump_bin_commands(path, address, length))
+        check_dump(path, address, length)
+
+
+class AsyncJLinkSession(object):
+    """Long running JLinkExe process driven interactively over its stdin and
+    stdout with asyncio streams, see jlink.JLinkSession.
+    """
+
+    # Prompt printed by JLinkExe when it is ready for the next command.
+    PROMPT = JLinkSession.PROMPT.encode('utf-8')
+
+    def __init__(self, args):
+        self._args = args
+        self._process = None
+
+    async def start(self, timeout_sec=60):
+        """Start JLinkExe and wait for its first prompt."""
+        logger.debug('Starting JLink session: {0}'.format(' '.join(self._args)))
+        self._process = await _spawn(self._args, JLINK_MISSING,
+                                     stdin=asyncio.subprocess.PIPE)
+        await self._read_until_prompt(timeout_sec)
+
+    async def _read_until_prompt(self, timeout_sec):
+        # Return everything JLinkExe prints before its next prompt.  The
+        # process is killed if the prompt never comes, or the wait is
+        # cancelled, as its output can't be matched to commands after that.
+        try:
+            output = await asyncio.wait_for(
+                self._process.stdout.readuntil(self.PROMPT), timeout_sec)
+        except asyncio.TimeoutError:
+            await self.kill()
+            raise AdaLinkError('JLink process exceeded timeout!')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            await self.kill()
+            raise AdaLinkError('JLink process exited unexpectedly!')
+        except asyncio.CancelledError:
+            await self.kill()
+            raise
+        return output[:-len(self.PROMPT)].decode('utf-8', 'replace')
+
+    async def execute(self, command, timeout_sec=60):
+        """Run a single JLinkExe command and return its output, formatted like
+        JLinkExe echoes commands in a script.
+        """
+        if self._process.returncode is not None:
+            raise AdaLinkError('JLink process exited unexpectedly!')
+        logger.debug('Running JLink session command: {0}'.format(command))
+        try:
+            self._process.stdin.write((command + '\n').encode('utf-8'))
+            await self._process.stdin.drain()
+        except (ConnectionError, OSError):
+            await self.kill()
+            raise AdaLinkError('JLink process exited unexpectedly!')
+        output = await self._read_until_prompt(timeout_sec)
+        logger.debug('JLink response: {0}'.format(output))
+        return '{0}{1}\n{2}'.format(JLinkSession.PROMPT, command, output)
+
+    async def close(self, timeout_sec=5):
+        """Ask JLinkExe to quit and wait for it to exit, killing the process if
+        it doesn't exit within timeout_sec seconds.
+        """
+        if self._process.returncode is None:
+            try:
+                self._process.stdin.write(b'q\n')
+                await self._process.stdin.drain()
+                await asyncio.wait_for(self._process.wait(), timeout_sec)
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                pass
+        await self.kill()
+
+    async def kill(self):
+        """Stop the JLinkExe process immediately."""
+        await _kill(self._process)
+
+
+class AsyncJLink(AsyncProgrammer):
+    """Asyncio interface to a jlink.JLink programmer."""
+
+    def _args(self):
+        args = [self.programmer._jlink_path]
+        args.extend(self.programmer._jlink_params)
+        return args
+
+    async def run_commands(self, commands, timeout_sec=60, abort=True):
+        """Run the provided list of JLinkExe commands and return their output,
+        see AsyncProgrammer.run_commands.
+        """
+        monitor = self.programmer.output_monitor(abort)
+        if self._session_depth > 0:
+            if self._session is None:
+                session = AsyncJLinkSession(self._args())
+                await session.start()
+                self._session = session
+            # Skip any quit command as the session owns the process lifetime.
+            for c in commands:
+                if c.strip().lower() in QUIT_COMMANDS:
+                    continue
+                monitor.feed(await self._session.execute(c, timeout_sec))
+            return monitor.close()
+        # Run the commands as a script with a new JLinkExe process.
+        script_file = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        try:
+            script_file.write('\n'.join(commands))
+            script_file.close()
+            logger.debug('Running JLink commands: {0}'.format(commands))
+            return await _run_process(self._args() + [script_file.name], monitor,
+                                      JLINK_MISSING, timeout_sec)
+        finally:
+            os.remove(script_file.name)
+
+
+class AsyncOpenOCDSession(object):
+    """Long running OpenOCD process which commands are sent to over its TCL
+    RPC port with asyncio streams, see openocd.OpenOCDSession.
+    """
+
+    def __init__(self, args, timeout_sec=60):
+        self._args = args
+        self._timeout_sec = timeout_sec
+        self._process = None
+        self._writer = None
+        self._log_task = None
+
+    async def start(self):
+        """Start OpenOCD and connect to its TCL RPC port."""
+        port = _free_port()
+        args = list(self._args)
+        args.extend(['-c', 'tcl_port {0}'.format(port),
+                     '-c', 'gdb_port disabled',
+                     '-c', 'telnet_port disabled'])
+        logger.debug('Starting OpenOCD session: {0}'.format(' '.join(args)))
+        self._process = await _spawn(args, OPENOCD_MISSING)
+        # Drain OpenOCD's log output so it can't fill the pipe, and keep it to
+        # report why OpenOCD stopped.
+        self._log = []
+        self._log_task = asyncio.ensure_future(self._read_log())
+        # Wait for OpenOCD to initialize the target and open its RPC port.
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self._timeout_sec
+        try:
+            while True:
+                if self._process.returncode is not None:
+                    await self._log_task
+                    raise AdaLinkError('OpenOCD exited before accepting commands:\n'
+                                       '{0}'.format(''.join(self._log)))
+                try:
+                    self._reader, self._writer = await asyncio.open_connection(
+                        '127.0.0.1', port, limit=STREAM_LIMIT)
+                    break
+                except OSError:
+                    if loop.time() > deadline:
+                        raise AdaLinkError('OpenOCD process exceeded timeout!')
+                    await asyncio.sleep(0.05)
+            await self._roundtrip(RPC_RUN_PROC, self._timeout_sec)
+        except BaseException:
+            await self.kill()
+            raise
+
+    async def _read_log(self):
+        async for line in self._process.stdout:
+            self._log.append(line.decode('utf-8', 'replace'))
+
+    async def _roundtrip(self, command, timeout_sec):
+        # Send a command and return the response up to the terminator.
+        if self._writer is None:
+            raise ConnectionError('OpenOCD connection is closed')
+        self._writer.write(command.encode('utf-8') + RPC_TERMINATOR)
+        await self._writer.drain()
+        response = await asyncio.wait_for(self._reader.readuntil(RPC_TERMINATOR),
+                                          timeout_sec)
+        return response[:-len(RPC_TERMINATOR)].decode('utf-8', 'replace')
+
+    async def execute(self, command, timeout_sec=60):
+        """Run a single OpenOCD command and return its output.  If the
+        connection dies OpenOCD is restarted and the command retried once.
+        """
+        logger.debug('Running OpenOCD session command: {0}'.format(command))
+        rpc = 'adalink_run {{{0}}}'.format(command)
+        try:
+            output = await self._roundtrip(rpc, timeout_sec)
+        except asyncio.TimeoutError:
+            await self.kill()
+            raise AdaLinkError('OpenOCD process exceeded timeout!')
+        except (OSError, EOFError, asyncio.LimitOverrunError):
+            # Connection died, start OpenOCD again and retry once.
+            logger.debug('OpenOCD connection lost, restarting session.')
+            await self.kill()
+            await self.start()
+            try:
+                output = await self._roundtrip(rpc, timeout_sec)
+            except (OSError, EOFError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                await self.kill()
+                raise AdaLinkError('Lost connection to OpenOCD!')
+        except asyncio.CancelledError:
+            # The response to the cancelled command would be read as the
+            # response to the next one, so stop OpenOCD.  It's restarted if
+            # the session is used again.
+            await self.kill()
+            raise
+        logger.debug('OpenOCD response: {0}'.format(output))
+        if output and not output.endswith('\n'):
+            output += '\n'
+        return output
+
+    async def close(self, timeout_sec=5):
+        """Ask OpenOCD to shut down and wait for it to exit, killing the process
+        if it doesn't exit within timeout_sec seconds.
+        """
+        if self._process is not None and self._process.returncode is None:
+            try:
+                await self._roundtrip('shutdown', timeout_sec)
+                await asyncio.wait_for(self._process.wait(), timeout_sec)
+            except (OSError, EOFError, asyncio.TimeoutError):
+                pass
+        await self.kill()
+
+    async def kill(self):
+        """Stop the OpenOCD process immediately."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._process is not None:
+            await _kill(self._process)
+        if self._log_task is not None:
+            await self._log_task
+            self._log_task = None
+
+
+class AsyncOpenOCD(AsyncProgrammer):
+    """Asyncio interface to an openocd.OpenOCD based programmer."""
+
+    def _args(self):
+        args = [self.programmer._openocd_path]
+        args.extend(self.programmer._openocd_params)
+        return args
+
+    async def run_commands(self, commands, timeout_sec=60, abort=True):
+        """Run the provided list of OpenOCD commands and return their output,
+        see AsyncProgrammer.run_commands.
+        """
+        monitor = self.programmer.output_monitor(abort)
+        if self._session_depth > 0 and self.programmer.supports_sessions():
+            if self._session is None:
+                session = AsyncOpenOCDSession(self._args())
+                await session.start()
+                self._session = session
+            for c in commands:
+                if c.strip() in SESSION_SKIP_COMMANDS:
+                    continue
+                monitor.feed(await self._session.execute(c, timeout_sec))
+            return monitor.close()
+        # Run the commands with a new OpenOCD process.
+        args = self._args()
+        for c in commands:
+            args.append('-c')
+            args.append(c)
+        logger.debug('Running OpenOCD command: {0}'.format(' '.join(args)))
+        return await _run_process(args, monitor, OPENOCD_MISSING, timeout_sec)
+
+    async def is_connected(self):
+        """Return true if the device is connected to the programmer."""
+        try:
+            output = await self.run_commands(self.programmer.is_connected_commands(),
+                                             abort=False)
+        except AdaLinkError:
+            # A session fails to start when OpenOCD can't find the target.
+            if self._session_depth == 0 or not self.programmer.supports_sessions():
+                raise
+            return False
+        return self.programmer.parse_is_connected(output)
+
+    async def program_pages(self, image):
+        """Erase and program only the flash pages touched by the provided
+        image.Image, leaving the rest of flash as it is.
+        """
+        with image.bin_files() as bin_files:
+            await self.run_commands(self.programmer.program_pages_commands(bin_files))
+
+
+def async_programmer(programmer):
+    """Return an asyncio programmer which wraps the provided programmer
+    instance, like one created by a core's create_programmer function.
+    """
+    if isinstance(programmer, JLink):
+        return AsyncJLink(programmer)
+    if isinstance(programmer, OpenOCD):
+        return AsyncOpenOCD(programmer)
+    raise AdaLinkError('The {0} programmer has no asyncio interface.'.format(
+        getattr(programmer, 'name', programmer.__class__.__name__)))
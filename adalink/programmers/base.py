@@ -6,12 +6,244 @@
 #
 # Author: Tony DiCola
 import abc
+import array
+import binascii
+import contextlib
+import os
+import re
+import sys
+import time
+
+from .output import OutputMonitor, ProgressEvent
+from . import planner
+from .. import timing
+from ..errors import AdaLinkError
+
+
+# Bytes of memory read at a time when a programmer dumps memory to a file with
+# the default chunked reads.  Each chunk is written to the file as soon as it's
+# read so a dump of all of flash is never held in memory at once.
+DUMP_CHUNK_SIZE = 64*1024
+
+# Bytes of memory compared at a time when looking for the ranges of memory
+# which don't match an image.
+VERIFY_CHUNK_SIZE = 256
+
+
+def memory_array(width, data=b''):
+    """Return an array of unsigned values with the provided bit width (8, 16
+    or 32), optionally filled from a bytes buffer of little endian values.
+    """
+    if width == 8:
+        typecode = 'B'
+    elif width == 16:
+        typecode = 'H'
+    elif width == 32:
+        typecode = 'I' if array.array('I').itemsize == 4 else 'L'
+    else:
+        raise AdaLinkError('Unsupported memory width: {0}'.format(width))
+    values = array.array(typecode)
+    if data:
+        values.frombytes(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+    return values
+
+
+def parse_memory_dump(output, pattern, blocks):
+    """Parse the memory dump printed by a programmer tool into arrays for
+    each of the requested (address, count, width) blocks.  Pattern is a regex
+    which matches a line of the dump with the line's hex address in its first
+    group and the values on the line in its second group.  Returns None in
+    place of any block that can't be found in the output.
+    """
+    # Index each line of values by its address and value width (taken from
+    # the number of hex digits in each value).  When blocks start at the same
+    # address the longest line is kept, as it holds the values of all of them.
+    lines = {}
+    for match in re.finditer(pattern, output, re.IGNORECASE | re.MULTILINE):
+        tokens = match.group(2).split()
+        if not tokens:
+            continue
+        digits = len(tokens[0])
+        values = []
+        for t in tokens:
+            if len(t) != digits:
+                break
+            values.append(t)
+        key = (int(match.group(1), 16), digits*4)
+        if len(values) > len(lines.get(key, [])):
+            lines[key] = values
+    results = []
+    for address, count, width in blocks:
+        # Walk the lines of the block and join all its values into one hex
+        # string, which is decoded in a single step instead of value by value.
+        size = width // 8
+        hexvalues = []
+        remaining = count
+        while remaining > 0:
+            values = lines.get((address, width))
+            if not values:
+                break
+            values = values[:remaining]
+            hexvalues.extend(values)
+            remaining -= len(values)
+            address += len(values)*size
+        if remaining > 0:
+            results.append(None)
+            continue
+        values = memory_array(width)
+        values.frombytes(binascii.unhexlify(''.join(hexvalues)))
+        # Values are printed most significant byte first.
+        if sys.byteorder == 'little' and size > 1:
+            values.byteswap()
+        results.append(values)
+    return results
+
+
+def range_blocks(ranges):
+    """Return the list of (address, count, width) 32-bit word blocks which
+    cover each of the provided (address, length) byte ranges.
+    """
+    blocks = []
+    for address, length in ranges:
+        start = address & ~3
+        end = (address + length + 3) & ~3
+        blocks.append((start, (end - start) // 4, 32))
+    return blocks
+
+
+def range_bytes(ranges, blocks, results):
+    """Return a list with the bytes of each (address, length) range, sliced
+    from the arrays read for the range_blocks that cover them.
+    """
+    data = []
+    for (address, length), (start, count, width), values in zip(ranges, blocks, results):
+        offset = address - start
+        data.append(values.tobytes()[offset:offset+length])
+    return data
+
+
+def changed_image_pages(image, page_size, target):
+    """Return an image.Image with the data from image that is in flash pages
+    of page_size bytes which differ from the target.  Target is a list with
+    the bytes read from the target for each segment of the image.  CRC32
+    digests of each page are compared.
+    """
+    actual = image.__class__()
+    for (start, data), read in zip(image.segments, target):
+        actual.add(start, read)
+    expected = image.page_digests(page_size)
+    actual = actual.page_digests(page_size)
+    changed = [page for page in expected if expected[page] != actual.get(page)]
+    return image.select_pages(changed, page_size)
+
+
+def mismatched_ranges(image, target):
+    """Return a list of (start, end) address ranges where the image.Image
+    doesn't match the list of bytes read from the target for each segment.
+    Matching segments and VERIFY_CHUNK_SIZE byte chunks are compared whole, and
+    only chunks which differ are compared byte by byte to find the ranges.
+    """
+    mismatched = []
+    for (start, data), actual in zip(image.segments, target):
+        if actual == data:
+            continue
+        for offset in range(0, len(data), VERIFY_CHUNK_SIZE):
+            expected = bytearray(data[offset:offset+VERIFY_CHUNK_SIZE])
+            read = bytearray(actual[offset:offset+VERIFY_CHUNK_SIZE])
+            if expected == read:
+                continue
+            for i in range(len(expected)):
+                if i < len(read) and expected[i] == read[i]:
+                    continue
+                address = start + offset + i
+                if len(mismatched) > 0 and mismatched[-1][1] == address:
+                    mismatched[-1] = (mismatched[-1][0], address + 1)
+                else:
+                    mismatched.append((address, address + 1))
+    return mismatched
+
+
+def check_dump(path, address, length):
+    """Raise an error if the file a programmer's tool dumped memory to doesn't
+    hold the expected length of bytes.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) != length:
+        raise AdaLinkError('Could not dump {0} bytes of memory from 0x{1:08X}!'.format(length, address))
+
+
+def segment_ranges(image):
+    """Return a list of (address, length) ranges for each segment of the
+    image.Image.
+    """
+    return [(start, len(data)) for start, data in image.segments]
 
 
 class Programmer(object):
     __metaclass__ = abc.ABCMeta
     """Base class for adalink CPU programmer implementations."""
 
+    # Name of the programmer's tool used in error messages, a list of regexes
+    # for lines of tool output which mean a run failed, and a list of (kind,
+    # regex) tuples for lines which report progress.  See output.OutputMonitor.
+    tool_name = 'Programmer'
+    fatal_patterns = []
+    progress_patterns = []
+
+    # Function which is called with an output.ProgressEvent for each bit of
+    # progress the programmer's tool reports, or None to ignore progress.
+    progress_callback = None
+
+    # Serial number of the probe chosen with select_probe, or None.
+    probe = None
+
+    # True if the programmer's tool stops running commands by itself when it
+    # can't connect to the device, so a CommandTransaction doesn't need a
+    # session to stop the commands after a failed connection check.
+    connect_stops_tool = False
+
+    def output_monitor(self, abort=True):
+        """Return an output.OutputMonitor to parse the output of one run of the
+        programmer's tool.  Fatal errors only stop the run if abort is true,
+        otherwise the caller checks the output itself.
+        """
+        return OutputMonitor(self.tool_name,
+                             self.fatal_patterns if abort else [],
+                             self.progress_patterns, self.progress_callback)
+
+    def transaction(self):
+        """Return a new Transaction to run a batch of steps, like checking the
+        connection, wiping, programming and reading memory, together.  The
+        default transaction runs each step as its own call.
+        """
+        return Transaction(self)
+
+    def command_effect(self, command):
+        """Return the effect the provided command has on the target, one of
+        the effect constants in the planner module, so a transaction can drop
+        commands which are redundant.  The default returns None for every
+        command, meaning the effect is unknown and nothing is dropped.
+        """
+        return None
+
+    @contextlib.contextmanager
+    def session(self):
+        """Context manager which keeps the connection to the programmer open
+        for all the calls made inside it.  Programmers that can keep their
+        tool running between calls should override this, the default
+        implementation does nothing and each call stands on its own.
+        """
+        yield self
+
+    def select_probe(self, serial):
+        """Use the programmer hardware with the provided serial number, for
+        when more than one is attached.  Must be called before any other
+        function.  The default implementation doesn't support selecting a probe.
+        """
+        raise AdaLinkError('The {0} programmer can\'t select a probe by serial number.'.format(
+            getattr(self, 'name', self.__class__.__name__)))
+
     @abc.abstractmethod
     def is_connected(self):
         """Return true if the device is connected to the programmer."""
@@ -32,6 +264,51 @@ class Programmer(object):
         being the integer starting address for the bin file."""
         raise NotImplementedError
 
+    def program_image(self, image):
+        """Program chip with the contents of an image.Image.  Each contiguous
+        segment of the image is programmed as a single write.  The default
+        implementation passes the segments to program as .bin files.
+        """
+        with image.bin_files() as bin_files:
+            self.program([], bin_files)
+
+    def program_pages(self, image):
+        """Erase and program only the flash pages touched by the provided
+        image.Image, leaving the rest of flash as it is.  The default
+        implementation uses program_image, which is only correct for
+        programmers that erase just the pages they write.
+        """
+        self.program_image(image)
+
+    def program_sectors(self, image, ranges):
+        """Erase the provided list of (start, size) ranges of flash, each made
+        of whole sectors, then program the image.Image without erasing
+        anything else.  The default implementation uses program_pages, which
+        erases the pages the image touches.
+        """
+        self.program_pages(image)
+
+    def changed_pages(self, image, page_size):
+        """Return an image.Image with the data from image that is in flash
+        pages of page_size bytes whose contents differ from the target.  The
+        default implementation reads the image's memory back in one batch and
+        compares CRC32 digests of each page on the host.
+        """
+        target = self.readmem_ranges(segment_ranges(image))
+        return changed_image_pages(image, page_size, target)
+
+    def verify_image(self, image):
+        """Compare the contents of an image.Image with the target's memory and
+        return a list of (start, end) address ranges which don't match.  An
+        empty list means the target holds the image.  The default
+        implementation reads the segments back in one batch and compares them
+        on the host, finding exactly which bytes differ.  Programmers which
+        checksum memory on the target return the whole of each segment which
+        doesn't match.
+        """
+        target = self.readmem_ranges(segment_ranges(image))
+        return mismatched_ranges(image, target)
+
     @abc.abstractmethod
     def readmem32(self, address):
         """Read a 32-bit value from the provided memory address."""
@@ -46,3 +323,257 @@ class Programmer(object):
     def readmem8(self, address):
         """Read a 8-bit value from the provided memory address."""
         raise NotImplementedError
+
+    def readmem_block(self, address, count, width=32):
+        """Read count values of the provided bit width (8, 16 or 32) starting
+        at the provided memory address.  Returns an array of the values, call
+        tobytes on it to get the raw little endian memory.
+        """
+        return self.readmem_blocks([(address, count, width)])[0]
+
+    def readmem_blocks(self, blocks):
+        """Read a list of (address, count, width) blocks of memory and return a
+        list with an array of values for each block.  Programmers should
+        override this to read all the blocks with as few tool invocations as
+        possible, the default implementation reads one value at a time.
+        """
+        readers = {8: self.readmem8, 16: self.readmem16, 32: self.readmem32}
+        results = []
+        for address, count, width in blocks:
+            values = memory_array(width)
+            for i in range(count):
+                values.append(readers[width](address + i*width//8))
+            results.append(values)
+        return results
+
+    def readmem_ranges(self, ranges):
+        """Read a list of (address, length) byte ranges of memory and return a
+        list with the bytes of each range.  The ranges are read as 32-bit words
+        in a single batch.
+        """
+        blocks = range_blocks(ranges)
+        return range_bytes(ranges, blocks, self.readmem_blocks(blocks))
+
+    def writemem_words(self, writes):
+        """Write a list of (address, value, width) words to memory in order,
+        where width is 8, 16 or 32 bits.  Programmers should override this to
+        write all the words with a single tool invocation, the default
+        implementation doesn't support writing memory.
+        """
+        raise AdaLinkError('The {0} programmer can\'t write memory.'.format(
+            getattr(self, 'name', self.__class__.__name__)))
+
+    def dump_bin(self, path, address, length):
+        """Save length bytes of memory starting at the provided address to a
+        .bin file at path.  Programmers whose tool can save memory to a file
+        should override this, the default implementation reads DUMP_CHUNK_SIZE
+        bytes at a time with readmem_ranges over a session, writing each chunk
+        to the file and reporting it as read progress.
+        """
+        start = time.time()
+        with open(path, 'wb') as f:
+            with self.session():
+                for offset in range(0, length, DUMP_CHUNK_SIZE):
+                    count = min(DUMP_CHUNK_SIZE, length - offset)
+                    f.write(self.readmem_ranges([(address + offset, count)])[0])
+                    if self.progress_callback is not None:
+                        seconds = time.time() - start
+                        rate = (offset + count) / 1024.0 / seconds if seconds > 0 else None
+                        self.progress_callback(ProgressEvent('read', offset + count,
+                                                             seconds, rate, None))
+
+
+class TransactionStep(object):
+    """A step of a Transaction, which calls the named programmer function with
+    the provided arguments.  Result is set to the value the function returns
+    when the transaction runs, and stays None if the step is skipped.
+    """
+
+    def __init__(self, phase, function, args):
+        self.phase = phase
+        self.function = function
+        self.args = args
+        self.result = None
+
+
+class Transaction(object):
+    """Batch of steps to run on a programmer one after another.  Add steps
+    with the functions named like the programmer's, which return the
+    TransactionStep that holds the result, then call run.  If a connection
+    check finds no device the steps after it are skipped.  This default runs
+    each step as its own call to the programmer.
+    """
+
+    def __init__(self, programmer):
+        self.programmer = programmer
+        self.steps = []
+
+    def add(self, phase, function, *args):
+        """Add a step which calls the named programmer function with args and
+        is timed as the named timing phase.  Returns the TransactionStep.
+        """
+        step = TransactionStep(phase, function, args)
+        self.steps.append(step)
+        return step
+
+    def is_connected(self):
+        """Add a step which checks the device is connected."""
+        return self.add('connect', 'is_connected')
+
+    def wipe(self):
+        """Add a step which wipes the flash memory of the device."""
+        return self.add('erase', 'wipe')
+
+    def program_image(self, image):
+        """Add a step which programs the contents of an image.Image."""
+        return self.add('write', 'program_image', image)
+
+    def program_sectors(self, image, ranges):
+        """Add a step which erases the provided (start, size) ranges of flash
+        and programs the contents of an image.Image.
+        """
+        return self.add('write', 'program_sectors', image, ranges)
+
+    def readmem_blocks(self, blocks):
+        """Add a step which reads a list of (address, count, width) blocks of
+        memory.  Its result is a list with an array of values for each block.
+        """
+        return self.add('read', 'readmem_blocks', blocks)
+
+    def writemem_words(self, writes):
+        """Add a step which writes a list of (address, value, width) words to
+        memory.
+        """
+        return self.add('write', 'writemem_words', writes)
+
+    def run(self):
+        """Run every step in order and set its result."""
+        for step in self.steps:
+            with timing.span(step.phase):
+                step.result = getattr(self.programmer, step.function)(*step.args)
+            if step.function == 'is_connected' and not step.result:
+                break
+
+
+class CommandTransaction(Transaction):
+    """Transaction for programmers which drive a tool with lists of commands,
+    like JLinkExe and OpenOCD.  The commands of every step are joined and run
+    with a single run of the tool (or sent to its session), and the output is
+    split back up so each step's result is parsed from its own output.
+
+    The programmer builds each step's commands with its *_commands functions
+    and parses them with its parse_* functions.  It joins them with
+    transaction_commands, which takes a list of each step's commands and
+    returns the commands to run, and splits the output with
+    split_transaction_output, which returns a list with the output of each
+    step that started.  Each step is timed from the line of output which
+    starts it, found with the function transaction_step_starts returns.
+    Before they're joined the planner drops redundant commands, like a second
+    mass erase, using the programmer's command_effect.
+
+    When the first step checks the connection it's parsed as soon as the next
+    step starts, and if the device wasn't found the tool is stopped before
+    any later step's commands, like erasing and programming, run.  Unless the
+    tool stops by itself (see Programmer.connect_stops_tool) the commands are
+    sent over a session, one at a time, so none are sent after the check.
+    """
+
+    def _build(self, step, files):
+        # Return the (commands, parse function) for a step.  Files is a list
+        # of the context managers of temporary files to close after the run.
+        p = self.programmer
+        if step.function == 'is_connected':
+            return p.is_connected_commands(), p.parse_is_connected
+        if step.function == 'wipe':
+            return p.wipe_commands(), lambda output: None
+        if step.function == 'program_image':
+            bin_files = step.args[0].bin_files()
+            files.append(bin_files)
+            bin_files = bin_files.__enter__()
+            return (p.program_commands([], bin_files),
+                    lambda output: p.parse_program(output, [], bin_files))
+        if step.function == 'program_sectors':
+            image, ranges = step.args
+            bin_files = image.bin_files()
+            files.append(bin_files)
+            bin_files = bin_files.__enter__()
+            return p.program_sectors_commands(bin_files, ranges), lambda output: None
+        if step.function == 'readmem_blocks':
+            blocks = step.args[0]
+            return (p.readmem_blocks_commands(blocks),
+                    lambda output: p.parse_readmem_blocks(output, blocks))
+        if step.function == 'writemem_words':
+            return p.writemem_words_commands(step.args[0]), lambda output: None
+        raise AdaLinkError('Unsupported transaction step: {0}'.format(step.function))
+
+    def _record(self, started, ok):
+        # Record the timing span of each step that started, which lasts until
+        # the next one starts.  Only the last step that started failed.
+        end = time.time()
+        count = len([s for s in started if s is not None])
+        for i in range(count):
+            finish = started[i + 1] if i + 1 < count else end
+            timing.record(self.steps[i].phase, started[i], finish, ok or i + 1 < count)
+
+    def run(self):
+        """Run every step with a single run of the programmer's tool and set
+        each step's result.
+        """
+        if len(self.steps) == 0:
+            return
+        files = []
+        try:
+            built = [self._build(step, files) for step in self.steps]
+            steps = planner.plan([c for c, parse in built], self.programmer.command_effect)
+            commands = self.programmer.transaction_commands(steps)
+            monitor = self.programmer.output_monitor()
+            # Note when each step starts, as its first line of output arrives,
+            # so every step is timed as its own phase.
+            started = [time.time()] + [None] * (len(steps) - 1)
+            step_start = self.programmer.transaction_step_starts(steps)
+            connect = self.steps[0].function == 'is_connected' and len(steps) > 1
+            gated = connect and not self.programmer.connect_stops_tool
+            def line_callback(line):
+                index = step_start(line)
+                if index is None or index == 0:
+                    return
+                checked = started[1] is not None
+                for i in range(1, index + 1):
+                    started[i] = started[i] or time.time()
+                # Stop before the steps after a connection check which didn't
+                # find the device.
+                if connect and not checked:
+                    outputs = self.programmer.split_transaction_output(monitor.output, steps)
+                    if not built[0][1](outputs[0]):
+                        raise AdaLinkError('Could not find the device.')
+            monitor.line_callback = line_callback
+            try:
+                if gated:
+                    with self.programmer.session():
+                        output = self.programmer.run_commands(commands, monitor=monitor)
+                else:
+                    output = self.programmer.run_commands(commands, monitor=monitor)
+            except AdaLinkError:
+                self._record(started, False)
+                # When there's no device the run fails.  If the first step
+                # is a connection check which didn't finish or didn't find
+                # the device that's its result, and the later steps are
+                # skipped.  Any other failure is raised.
+                step = self.steps[0]
+                if step.function != 'is_connected':
+                    raise
+                outputs = self.programmer.split_transaction_output(
+                    monitor.output, steps)
+                if len(outputs) > 1 and built[0][1](outputs[0]):
+                    raise
+                step.result = False
+                return
+            self._record(started, True)
+            outputs = self.programmer.split_transaction_output(output, steps)
+            for step, (c, parse), step_output in zip(self.steps, built, outputs):
+                step.result = parse(step_output)
+                if step.function == 'is_connected' and not step.result:
+                    break
+        finally:
+            for f in reversed(files):
+                f.__exit__(None, None, None)
@@ -9,6 +9,7 @@
 # provided to the JLink class initializer).
 #
 # Author: Tony DiCola
+import contextlib
 import logging
 import os
 import platform
@@ -19,7 +20,16 @@ import tempfile
 import threading
 import time
 
-from .base import Programmer
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import planner
+from .base import CommandTransaction, Programmer, check_dump, parse_memory_dump
+from .output import run_monitored
+from .. import discovery
+from .. import timing
 from ..errors import AdaLinkError
 
 # OSX GUI-based app does not has the same PATH as terminal-based
@@ -29,12 +39,174 @@ if platform.system() == 'Darwin':
 
 logger = logging.getLogger(__name__)
 
+# Commands which end a JLinkExe script.  These are dropped when running
+# commands over a session so the JLinkExe process stays alive.
+QUIT_COMMANDS = ('q', 'qc', 'exit')
+
+# Commands which reset the target, timed as the reset phase in sessions.
+RESET_COMMANDS = ('r', 'rx', 'reset')
+
+# Effect of each JLinkExe command on the target, used to plan transactions.
+# Any other command, like a write to a register with w4, has an unknown effect.
+COMMAND_EFFECTS = {
+    'connect': planner.NONE,
+    'erase':   planner.ERASE,
+    'loadfile': planner.WRITE,
+    'loadbin': planner.WRITE,
+    'h':       planner.HALT,
+    'halt':    planner.HALT,
+    'g':       planner.RUN,
+    'go':      planner.RUN,
+    'mem':     planner.READ,
+    'mem8':    planner.READ,
+    'mem16':   planner.READ,
+    'mem32':   planner.READ,
+    'savebin': planner.READ,
+    'verifybin': planner.READ,
+    'sleep':   planner.WAIT
+}
+COMMAND_EFFECTS.update((c, planner.RESET) for c in RESET_COMMANDS)
+COMMAND_EFFECTS.update((c, planner.NONE) for c in QUIT_COMMANDS)
+
+
+def _skipped(command):
+    # Return true if the command is blank or a quit command, which are dropped
+    # when commands are joined or sent to a session.
+    words = command.strip().lower().split()
+    return not words or words[0] in QUIT_COMMANDS
+
+
+class JLinkSession(object):
+    """Long running JLinkExe process which is driven interactively over its
+    stdin and stdout.  Each command is written to JLinkExe followed by a wait
+    for the 'J-Link>' prompt which signals the command is complete, so the
+    probe only has to be connected once for many commands.
+    """
+
+    # Prompt printed by JLinkExe when it is ready for the next command.
+    PROMPT = 'J-Link>'
+
+    def __init__(self, args, timeout_sec=60):
+        """Start JLinkExe with the provided list of arguments (the first being
+        the path to JLinkExe) and wait for its first prompt.
+        """
+        logger.debug('Starting JLink session: {0}'.format(' '.join(args)))
+        with timing.span('spawn', tool='JLink'):
+            try:
+                self._process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                                 stdout=subprocess.PIPE,
+                                                 stderr=subprocess.STDOUT)
+            except OSError:
+                raise AdaLinkError("'{0}' missing. Is the J-Link folder in your system "
+                                   "path?".format(args[0]))
+            # Read output on a background thread so waiting for the prompt can
+            # time out even if JLinkExe stops responding.  This works the same
+            # on every platform, unlike select on a pipe.
+            self._output = queue.Queue()
+            self._reader = threading.Thread(target=self._read_output)
+            self._reader.daemon = True
+            self._reader.start()
+            self._buffer = ''
+            self._read_until_prompt(timeout_sec)
+
+    def _read_output(self):
+        # Push chunks of JLinkExe output onto the queue until it exits, then
+        # push None to signal the end of output.
+        fd = self._process.stdout.fileno()
+        while True:
+            data = os.read(fd, 4096)
+            if not data:
+                break
+            self._output.put(data.decode('utf-8', 'replace'))
+        self._output.put(None)
+
+    def _read_until_prompt(self, timeout_sec):
+        # Collect output until JLinkExe prints its prompt and return everything
+        # printed before it.
+        deadline = None if timeout_sec is None else time.time() + timeout_sec
+        while True:
+            index = self._buffer.find(self.PROMPT)
+            if index != -1:
+                output = self._buffer[:index]
+                self._buffer = self._buffer[index+len(self.PROMPT):]
+                return output
+            try:
+                remaining = None if deadline is None else max(deadline - time.time(), 0)
+                data = self._output.get(timeout=remaining)
+            except queue.Empty:
+                self.kill()
+                raise AdaLinkError('JLink process exceeded timeout!')
+            if data is None:
+                self.kill()
+                raise AdaLinkError('JLink process exited unexpectedly!')
+            self._buffer += data
+
+    @property
+    def alive(self):
+        """Return true if the JLinkExe process is still running."""
+        return self._process.poll() is None
+
+    def execute(self, command, timeout_sec=60):
+        """Run a single JLinkExe command and return its output.  If the command
+        takes longer than timeout_sec an exception will be thrown and the
+        session is killed.  Set timeout_sec to None to disable the timeout.
+        """
+        if not self.alive:
+            raise AdaLinkError('JLink process exited unexpectedly!')
+        logger.debug('Running JLink session command: {0}'.format(command))
+        try:
+            self._process.stdin.write((command + '\n').encode('utf-8'))
+            self._process.stdin.flush()
+        except (IOError, OSError):
+            self.kill()
+            raise AdaLinkError('JLink process exited unexpectedly!')
+        output = self._read_until_prompt(timeout_sec)
+        logger.debug('JLink response: {0}'.format(output))
+        # Format the result like JLinkExe echoes commands in a script so output
+        # can be parsed the same way in both modes.
+        return '{0}{1}\n{2}'.format(self.PROMPT, command, output)
+
+    def close(self, timeout_sec=5):
+        """Ask JLinkExe to quit and wait for it to exit, killing the process if
+        it doesn't exit within timeout_sec seconds.
+        """
+        if self.alive:
+            try:
+                self._process.stdin.write(b'q\n')
+                self._process.stdin.flush()
+            except (IOError, OSError):
+                pass
+            deadline = time.time() + timeout_sec
+            while self.alive and time.time() < deadline:
+                time.sleep(0.01)
+        self.kill()
+
+    def kill(self):
+        """Stop the JLinkExe process immediately."""
+        if self.alive:
+            self._process.kill()
+        self._process.wait()
+
 
 class JLink(Programmer):
 
     # Name used to identify this programmer on the command line.
     name = 'jlink'
 
+    # JLinkExe output which stops a run early, and output which reports
+    # progress programming flash.
+    tool_name = 'JLink'
+    fatal_patterns = [
+        r'Cannot connect to target',
+        r'Connecting to J-Link via USB\.\.\.FAILED',
+        r'Could not connect to J-Link'
+    ]
+    progress_patterns = [
+        ('write', r'Flash download: Bank \d+ @ 0x[0-9A-F]+: \d+ ranges? affected \((?P<bytes>\d+) bytes\)'),
+        ('write', r'Flash download: Total(?: time needed)?: (?P<seconds>[\d.]+)s'),
+        ('write', r'Flash download: Program(?: & Verify)? speed: (?P<rate>[\d.]+) KiB/s')
+    ]
+
     def __init__(self, connected, jlink_exe=None, jlink_path='', params=None):
         """Create a new instance of the JLink communication class.  By default
         JLinkExe should be accessible in your system path and it will be used
@@ -71,57 +243,102 @@ class JLink(Programmer):
         if params is not None:
             self._jlink_params.extend(params.split())
             logger.info('Using parameters to JLinkExe: {0}'.format(params))
+        # No JLinkExe session is open until one is requested.
+        self._session = None
+        self._session_depth = 0
         # Make sure we have the J-Link executable in the system path
         self._test_jlinkexe()
 
+    def select_probe(self, serial):
+        """Use the JLink with the provided serial number, for when more than
+        one is attached.  Must be called before any other function.
+        """
+        self._jlink_params.extend(['-SelectEmuBySN', str(serial)])
+        self.probe = str(serial)
+
     def _test_jlinkexe(self):
-        """Checks if JLinkExe is found in the system path or not."""
-        # Spawn JLinkExe process and capture its output.
-        args = [self._jlink_path]
-        args.append('?')
+        """Checks if JLinkExe is found in the system path or not.  The result
+        is cached so JLinkExe is only run to check it again when it changes.
+        """
+        def check(path):
+            # Spawn JLinkExe process to make sure it runs.
+            process = subprocess.Popen([path, '?'], stdout=subprocess.PIPE)
+            process.communicate()
+            return {'present': True}
         try:
-            process = subprocess.Popen(args, stdout=subprocess.PIPE)
-            process.wait()
+            info = discovery.check_tool('jlink', self._jlink_path, check)
         except OSError:
+            info = None
+        if info is None:
             raise AdaLinkError("'{0}' missing. Is the J-Link folder in your system "
                                "path?".format(self._jlink_path))
 
-    def run_filename(self, filename, timeout_sec=60):
+    def run_filename(self, filename, timeout_sec=60, abort=True, monitor=None):
         """Run the provided script with JLinkExe.  Filename should be a path to
         a script file with JLinkExe commands to run.  Returns the output of
         JLinkExe.  If execution takes longer than timeout_sec an exception will
         be thrown.  Set timeout_sec to None to disable the timeout completely.
+        Output is parsed as it's printed, and if abort is true JLinkExe is
+        stopped with an exception as soon as it reports a fatal error.  Monitor
+        is an optional output.OutputMonitor to parse the output with.
         """
+        if monitor is None:
+            monitor = self.output_monitor(abort)
         # Spawn JLinkExe process and capture its output.
         args = [self._jlink_path]
         args.extend(self._jlink_params)
         args.append(filename)
-        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        if timeout_sec is not None:
-            # Use a timer to stop the subprocess if the timeout is exceeded.
-            # This helps prevent very subtle issues with deadlocks on reading
-            # subprocess output.  See: http://stackoverflow.com/a/10012262
-            def timeout_exceeded(p):
-                # Stop the subprocess and kill the whole program.
-                p.kill()
-                raise AdaLinkError('JLink process exceeded timeout!')
-            timeout = threading.Timer(timeout_sec, timeout_exceeded, [process])
-            timeout.start()
-        # Grab output of JLink.
-        output, err = process.communicate()
-        if timeout_sec is not None:
-            # Stop timeout timer when communicate call returns.
-            timeout.cancel()
+        output = run_monitored(args, monitor, timeout_sec)
         logger.debug('JLink response: {0}'.format(output))
-        return output.decode('utf-8')
+        return output
+
+    @contextlib.contextmanager
+    def session(self):
+        """Context manager which starts a single JLinkExe process and sends
+        every command run inside it to that process, instead of starting a new
+        JLinkExe for each call.  Sessions can be nested, the process is only
+        stopped when the outermost one exits.
+        """
+        if self._session is None:
+            args = [self._jlink_path]
+            args.extend(self._jlink_params)
+            self._session = JLinkSession(args)
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if self._session_depth == 0:
+                self._session.close()
+                self._session = None
 
-    def run_commands(self, commands, timeout_sec=60):
+    def run_commands(self, commands, timeout_sec=60, abort=True, monitor=None):
         """Run the provided list of commands with JLinkExe.  Commands should be
         a list of strings with with JLinkExe commands to run.  Returns the
         output of JLinkExe.  If execution takes longer than timeout_sec an
         exception will be thrown. Set timeout_sec to None to disable the timeout
-        completely.
+        completely.  If abort is true the commands are stopped with an
+        exception as soon as JLinkExe reports a fatal error.  Monitor is an
+        optional output.OutputMonitor to parse the output with instead of a
+        new one, so the output is still available if the run fails.
         """
+        if monitor is None:
+            monitor = self.output_monitor(abort)
+        if self._session is not None:
+            # Send each command to the running JLinkExe, skipping any quit
+            # command as the session owns the process lifetime.  The output of
+            # each command is checked before the next one is sent.
+            for c in commands:
+                if _skipped(c):
+                    continue
+                words = c.strip().lower().split()
+                # The echo of the command is fed before it's sent, so the
+                # monitor can stop the run before the command runs.
+                echo = '{0}{1}\n'.format(JLinkSession.PROMPT, c)
+                monitor.feed(echo)
+                with timing.span('reset' if words[0] in RESET_COMMANDS else None):
+                    monitor.feed(self._session.execute(c, timeout_sec)[len(echo):])
+            return monitor.close()
         # Create temporary file to hold script.
         script_file = tempfile.NamedTemporaryFile(mode='w', delete=False)
         # commands.insert(0, 'connect\n')
@@ -130,7 +347,78 @@ class JLink(Programmer):
         script_file.close()
         logger.debug('Using script file name: {0}'.format(script_file.name))
         logger.debug('Running JLink commands: {0}'.format(commands))
-        return self.run_filename(script_file.name, timeout_sec)
+        return self.run_filename(script_file.name, timeout_sec, abort, monitor)
+
+    def transaction(self):
+        """Return a new Transaction which runs all of its steps with a single
+        JLinkExe script, or over the open session.
+        """
+        return CommandTransaction(self)
+
+    def command_effect(self, command):
+        """Return the effect of the provided JLinkExe command on the target,
+        see the planner module.  JLinkExe's reset leaves the target halted.
+        """
+        words = command.strip().lower().split()
+        if not words:
+            return planner.NONE
+        if words[0] == 'erase' and len(words) > 1:
+            # Erasing a range of flash only changes part of it, like a write.
+            return planner.WRITE
+        return COMMAND_EFFECTS.get(words[0])
+
+    def transaction_commands(self, steps):
+        """Join the provided list of each transaction step's commands into one
+        script, dropping the quit command that ends each of them.
+        """
+        commands = [c for step in steps for c in step if not _skipped(c)]
+        commands.append('q')
+        return commands
+
+    def split_transaction_output(self, output, steps):
+        """Split the output of the transaction_commands into a list with the
+        output of each step that started.  JLinkExe echoes each command after
+        its prompt, which marks where the output of each command starts.
+        """
+        starts = [m.start() for m in re.finditer('^' + re.escape(JLinkSession.PROMPT),
+                                                 output, re.MULTILINE)]
+        outputs = []
+        first = 0
+        for i, step in enumerate(steps):
+            # The first step also gets the output from starting JLinkExe, and
+            # the last step everything after its commands.
+            if i == 0:
+                begin = 0
+            elif first < len(starts):
+                begin = starts[first]
+            else:
+                break
+            first += len([c for c in step if not _skipped(c)])
+            if i < len(steps) - 1 and first < len(starts):
+                end = starts[first]
+            else:
+                end = len(output)
+            outputs.append(output[begin:end])
+        return outputs
+
+    def transaction_step_starts(self, steps):
+        """Return a function which is called with each line of the output of
+        the transaction_commands, and returns the index of the step whose
+        output starts with that line or None.  Each step starts at the prompt
+        echoed before its first command.
+        """
+        starts = {}
+        first = 0
+        for i, step in enumerate(steps):
+            starts[first] = i
+            first += len([c for c in step if not _skipped(c)])
+        prompts = []
+        def step_start(line):
+            if not line.startswith(JLinkSession.PROMPT):
+                return None
+            prompts.append(line)
+            return starts.get(len(prompts) - 1)
+        return step_start
 
     def _readmem(self, address, command):
         """Read the specified register with the provided register read command.
@@ -150,15 +438,67 @@ class JLink(Programmer):
         else:
             raise AdaLinkError('Could not find expected memory value, are the JLink and board connected?')
 
-    def is_connected(self):
-        """Return true if the device is connected to the programmer."""
-        output = self.run_commands(['connect', 'q'])
+    def readmem_blocks_commands(self, blocks):
+        """Return the list of JLinkExe commands which read the provided list of
+        (address, count, width) blocks of memory.
+        """
+        commands = ['mem{0} {1:08X} {2:X}'.format(width, address, count)
+                    for address, count, width in blocks]
+        commands.append('q')
+        return commands
+
+    def parse_readmem_blocks(self, output, blocks):
+        """Parse the output of the readmem_blocks_commands into a list with an
+        array of values for each block.
+        """
+        results = parse_memory_dump(output, r'^([0-9A-F]{8}) = (.*)$', blocks)
+        if None in results:
+            raise AdaLinkError('Could not find expected memory value, are the JLink and board connected?')
+        return results
+
+    def readmem_blocks(self, blocks):
+        """Read a list of (address, count, width) blocks of memory and return a
+        list with an array of values for each block.  All the blocks are read
+        with a single run of JLinkExe commands.
+        """
+        output = self.run_commands(self.readmem_blocks_commands(blocks))
+        return self.parse_readmem_blocks(output, blocks)
+
+    def writemem_words_commands(self, writes):
+        """Return the list of JLinkExe commands which write the provided list
+        of (address, value, width) words to memory.
+        """
+        commands = ['w{0} {1:08X} {2:X}'.format(width // 8, address, value)
+                    for address, value, width in writes]
+        commands.append('q')
+        return commands
+
+    def writemem_words(self, writes):
+        """Write a list of (address, value, width) words to memory in order
+        with a single run of JLinkExe commands.
+        """
+        self.run_commands(self.writemem_words_commands(writes))
+
+    def is_connected_commands(self):
+        """Return the list of JLinkExe commands which check for the device."""
+        return ['connect', 'q']
+
+    def parse_is_connected(self, output):
+        """Parse the output of the is_connected_commands and return true if the
+        device was found.
+        """
         findstr = 'Found {0}'.format(self._connected)
         return output.find(findstr) != -1
 
-    def wipe(self):
-        """Wipe clean the flash memory of the device.  Will happen before any
-        programming if requested.
+    def is_connected(self):
+        """Return true if the device is connected to the programmer."""
+        # Don't stop on errors, a failed connect just means there's no device.
+        output = self.run_commands(self.is_connected_commands(), abort=False)
+        return self.parse_is_connected(output)
+
+    def wipe_commands(self):
+        """Return the list of JLinkExe commands which wipe the flash memory of
+        the device.  Cores which need a special erase sequence override this.
         """
         # Build list of commands to wipe memory.
         commands = [
@@ -167,14 +507,18 @@ class JLink(Programmer):
             'r',      # Reset
             'q'       # Quit
         ]
-        # Run commands.
-        self.run_commands(commands)
+        return commands
 
-    def program(self, hex_files=[], bin_files=[]):
-        """Program chip with provided list of hex and/or bin files.  Hex_files
-        is a list of paths to .hex files, and bin_files is a list of tuples with
-        the first value being the path to the .bin file and the second value
-        being the integer starting address for the bin file."""
+    def wipe(self):
+        """Wipe clean the flash memory of the device.  Will happen before any
+        programming if requested.
+        """
+        self.run_commands(self.wipe_commands())
+
+    def program_commands(self, hex_files=[], bin_files=[]):
+        """Return the list of JLinkExe commands which program the provided list
+        of hex and/or bin files, see program for the parameters.
+        """
         # Build list of commands to program hex files.
         commands = ['r']   # Reset
         # Program each hex file.
@@ -190,8 +534,101 @@ class JLink(Programmer):
             'g',  # Run the MCU
             'q'   # Quit
         ])
-        # Run commands.
-        self.run_commands(commands)
+        return commands
+
+    def program_sectors_commands(self, bin_files, ranges):
+        """Return the list of JLinkExe commands which erase the provided list
+        of (start, size) ranges of flash and program the provided list of
+        (path, address) .bin files without erasing anything else.
+        """
+        commands = ['r']   # Reset
+        # Erase each range, given by the addresses of its first and last byte.
+        for start, size in ranges:
+            commands.append('erase 0x{0:08X} 0x{1:08X}'.format(start, start + size - 1))
+        for f, addr in bin_files:
+            f = os.path.abspath(f)
+            commands.append('loadbin "{0}" 0x{1:08X}'.format(f, addr))
+        commands.extend([
+            'r',  # Reset
+            'g',  # Run the MCU
+            'q'   # Quit
+        ])
+        return commands
+
+    def program_sectors(self, image, ranges):
+        """Erase the provided list of (start, size) ranges of flash, each made
+        of whole sectors, then program the image.Image without erasing
+        anything else.
+        """
+        with image.bin_files() as bin_files:
+            self.run_commands(self.program_sectors_commands(bin_files, ranges))
+
+    def parse_program(self, output, hex_files=[], bin_files=[]):
+        """Check the output of the program_commands and raise an error if
+        programming failed.  The default implementation doesn't check anything.
+        """
+        pass
+
+    def program(self, hex_files=[], bin_files=[]):
+        """Program chip with provided list of hex and/or bin files.  Hex_files
+        is a list of paths to .hex files, and bin_files is a list of tuples with
+        the first value being the path to the .bin file and the second value
+        being the integer starting address for the bin file."""
+        output = self.run_commands(self.program_commands(hex_files, bin_files))
+        self.parse_program(output, hex_files, bin_files)
+
+    def verify_image_commands(self, bin_files):
+        """Return the list of JLinkExe commands which compare each of the
+        provided list of (path, address) .bin files with the target.
+        """
+        commands = []
+        for f, addr in bin_files:
+            f = os.path.abspath(f)
+            commands.append('verifybin "{0}" 0x{1:08X}'.format(f, addr))
+        commands.append('q')
+        return commands
+
+    def parse_verify_image(self, output, image):
+        """Parse the output of the verify_image_commands into a list of (start,
+        end) address ranges of the image segments which don't match.  Returns
+        None if the result of every segment couldn't be found, like when
+        JLinkExe is too old to have the verifybin command.
+        """
+        results = re.findall(r'Verify (successful|failed)', output, re.IGNORECASE)
+        if len(results) != len(image.segments):
+            return None
+        mismatched = []
+        for (start, data), result in zip(image.segments, results):
+            if result.lower() != 'successful':
+                mismatched.append((start, start + len(data)))
+        return mismatched
+
+    def verify_image(self, image):
+        """Compare the contents of an image.Image with the target's memory and
+        return a list of (start, end) address ranges of the image segments
+        which don't match.  JLinkExe compares each segment with its verifybin
+        command, or if that fails the memory is read back and compared here.
+        """
+        with image.bin_files() as bin_files:
+            output = self.run_commands(self.verify_image_commands(bin_files), abort=False)
+        mismatched = self.parse_verify_image(output, image)
+        if mismatched is None:
+            return super(JLink, self).verify_image(image)
+        return mismatched
+
+    def dump_bin_commands(self, path, address, length):
+        """Return the list of JLinkExe commands which save length bytes of
+        memory starting at address to a .bin file at path.
+        """
+        path = os.path.abspath(path)
+        return ['savebin "{0}" 0x{1:08X} 0x{2:X}'.format(path, address, length), 'q']
+
+    def dump_bin(self, path, address, length):
+        """Save length bytes of memory starting at the provided address to a
+        .bin file at path, with JLinkExe's savebin command.
+        """
+        self.run_commands(self.dump_bin_commands(path, address, length))
+        check_dump(path, address, length)
 
     def readmem32(self, address):
         """Read a 32-bit value from the provided memory address."""
@@ -0,0 +1,727 @@
+# adalink OpenOCD Programmer Base Class
+#
+# Common logic for programmers which drive OpenOCD, like the STLink V2 and
+# Raspberry Pi 2 native programmers.  Commands can either be run by starting a
+# new OpenOCD process for each call, or over a session which keeps a single
+# OpenOCD process running and talks to it with its TCL RPC protocol.
+#
+# Note you MUST have OpenOCD installed.
+import contextlib
+import logging
+import os
+import platform
+import re
+import shlex
+import socket
+import subprocess
+import threading
+import time
+
+from . import planner
+from .base import CommandTransaction, Programmer, check_dump, parse_memory_dump
+from .output import run_monitored
+from .. import discovery
+from .. import timing
+from ..errors import AdaLinkError
+
+# OSX GUI-based app does not has the same PATH as terminal-based
+if platform.system() == 'Darwin':
+    os.environ["PATH"] = os.environ["PATH"] + ':/usr/local/bin'
+
+logger = logging.getLogger(__name__)
+
+# Commands which stop OpenOCD or are only needed when it is started fresh.
+# These are dropped when running commands over a session.
+SESSION_SKIP_COMMANDS = ('init', 'exit', 'shutdown')
+
+# Commands which reset the target, timed as the reset phase in sessions.
+RESET_COMMANDS = ('reset',)
+
+# Effect of each OpenOCD command on the target, used to plan transactions.
+# Reset and flash are looked up with their subcommand, and any other command
+# has an unknown effect.
+COMMAND_EFFECTS = {
+    'echo':       planner.NONE,
+    'reset':      planner.RUN,
+    'reset run':  planner.RUN,
+    'reset init': planner.RESET,
+    'reset halt': planner.RESET,
+    'halt':       planner.HALT,
+    'resume':     planner.RUN,
+    'flash write_image': planner.WRITE,
+    'flash erase_address': planner.WRITE,
+    'load_image': planner.WRITE,
+    'mdb':        planner.READ,
+    'mdh':        planner.READ,
+    'mdw':        planner.READ,
+    'verify_image': planner.READ,
+    'verify_image_checksum': planner.READ,
+    'dump_image': planner.READ,
+    'sleep':      planner.WAIT
+}
+COMMAND_EFFECTS.update((c, planner.NONE) for c in SESSION_SKIP_COMMANDS)
+
+# Subcommands of the chip specific flash drivers, like nrf51 mass_erase, which
+# erase all of flash.
+ERASE_SUBCOMMANDS = ('mass_erase', 'chip-erase')
+
+# Start of the line echoed between the steps of a transaction.
+TRANSACTION_MARKER = 'adalink-step-'
+
+# Byte which terminates each TCL RPC command and response.
+RPC_TERMINATOR = b'\x1a'
+
+# Tcl procedure defined at the start of a session to run a command, capture its
+# output, and flag failures with the same 'Error:' prefix OpenOCD prints.  The
+# capture command was added in OpenOCD 0.11, so older versions can't be driven
+# over a session.
+SESSION_MIN_VERSION = (0, 11)
+RPC_RUN_PROC = ('proc adalink_run {cmd} { '
+                'if {[catch {capture $cmd} out]} { return "Error: $out" }; '
+                'return $out }')
+
+
+def _free_port():
+    # Ask the OS for a free TCP port on the loopback interface.
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+class OpenOCDSession(object):
+    """Long running OpenOCD process which commands are sent to over its TCL
+    RPC port.  OpenOCD initializes the target once when it starts, and each
+    command after that is a single round trip on the open connection.  If the
+    connection dies OpenOCD is restarted and the command retried once.
+    """
+
+    def __init__(self, args, timeout_sec=60):
+        """Start OpenOCD with the provided list of arguments (the first being
+        the path to OpenOCD) and connect to its TCL RPC port.
+        """
+        self._args = args
+        self._timeout_sec = timeout_sec
+        self._process = None
+        self._socket = None
+        with timing.span('spawn', tool='OpenOCD'):
+            self._start()
+
+    def _start(self):
+        self._port = _free_port()
+        args = list(self._args)
+        args.extend(['-c', 'tcl_port {0}'.format(self._port),
+                     '-c', 'gdb_port disabled',
+                     '-c', 'telnet_port disabled'])
+        logger.debug('Starting OpenOCD session: {0}'.format(' '.join(args)))
+        try:
+            self._process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                             stderr=subprocess.STDOUT)
+        except OSError:
+            raise AdaLinkError("'{0}' missing. Is OpenOCD installed and in "
+                               "your system path?".format(args[0]))
+        # Drain OpenOCD's log output on a background thread so it can't fill
+        # the pipe, and keep it to report why OpenOCD stopped.
+        self._log = []
+        reader = threading.Thread(target=self._read_log)
+        reader.daemon = True
+        reader.start()
+        # Wait for OpenOCD to initialize the target and open its RPC port.
+        deadline = time.time() + self._timeout_sec
+        while True:
+            if not self.alive:
+                self._process.wait()
+                raise AdaLinkError('OpenOCD exited before accepting commands:\n'
+                                   '{0}'.format(''.join(self._log)))
+            try:
+                self._socket = socket.create_connection(('127.0.0.1', self._port),
+                                                        timeout=1)
+                break
+            except (IOError, OSError):
+                if time.time() > deadline:
+                    self.kill()
+                    raise AdaLinkError('OpenOCD process exceeded timeout!')
+                time.sleep(0.05)
+        self._buffer = b''
+        self._roundtrip(RPC_RUN_PROC, self._timeout_sec)
+
+    def _read_log(self):
+        for line in iter(self._process.stdout.readline, b''):
+            self._log.append(line.decode('utf-8', 'replace'))
+
+    @property
+    def alive(self):
+        """Return true if the OpenOCD process is still running."""
+        return self._process is not None and self._process.poll() is None
+
+    def _roundtrip(self, command, timeout_sec):
+        # Send a command and return the response up to the terminator.
+        self._socket.settimeout(timeout_sec)
+        self._socket.sendall(command.encode('utf-8') + RPC_TERMINATOR)
+        while RPC_TERMINATOR not in self._buffer:
+            data = self._socket.recv(4096)
+            if not data:
+                raise socket.error('OpenOCD closed the connection')
+            self._buffer += data
+        response, self._buffer = self._buffer.split(RPC_TERMINATOR, 1)
+        return response.decode('utf-8', 'replace')
+
+    def execute(self, command, timeout_sec=60):
+        """Run a single OpenOCD command and return its output.  If the command
+        takes longer than timeout_sec an exception will be thrown and the
+        session is killed.  Set timeout_sec to None to disable the timeout.
+        """
+        logger.debug('Running OpenOCD session command: {0}'.format(command))
+        rpc = 'adalink_run {{{0}}}'.format(command)
+        try:
+            output = self._roundtrip(rpc, timeout_sec)
+        except socket.timeout:
+            self.kill()
+            raise AdaLinkError('OpenOCD process exceeded timeout!')
+        except (IOError, OSError):
+            # Connection died, start OpenOCD again and retry once.
+            logger.debug('OpenOCD connection lost, restarting session.')
+            self.kill()
+            self._start()
+            try:
+                output = self._roundtrip(rpc, timeout_sec)
+            except (IOError, OSError):
+                self.kill()
+                raise AdaLinkError('Lost connection to OpenOCD!')
+        logger.debug('OpenOCD response: {0}'.format(output))
+        if output and not output.endswith('\n'):
+            output += '\n'
+        return output
+
+    def close(self, timeout_sec=5):
+        """Ask OpenOCD to shut down and wait for it to exit, killing the process
+        if it doesn't exit within timeout_sec seconds.
+        """
+        if self.alive:
+            try:
+                self._roundtrip('shutdown', timeout_sec)
+            except (IOError, OSError):
+                pass
+            deadline = time.time() + timeout_sec
+            while self.alive and time.time() < deadline:
+                time.sleep(0.01)
+        self.kill()
+
+    def kill(self):
+        """Stop the OpenOCD process immediately."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        if self.alive:
+            self._process.kill()
+        if self._process is not None:
+            self._process.wait()
+
+
+class OpenOCD(Programmer):
+    """Base class for programmers which are controlled with OpenOCD."""
+
+    # Hint added to errors when the board can't be read.
+    connect_hint = 'is the board connected?'
+
+    # OpenOCD exits when init can't find the target, before running any
+    # later commands.
+    connect_stops_tool = True
+
+    # OpenOCD output which stops a run early, and output which reports
+    # progress writing and verifying memory.
+    tool_name = 'OpenOCD'
+    fatal_patterns = [
+        r'^Error:'
+    ]
+    progress_patterns = [
+        ('write', r'^wrote (?P<bytes>\d+) bytes from file .* in (?P<seconds>[\d.]+)s \((?P<rate>[\d.]+) KiB/s\)'),
+        ('verify', r'^verified (?P<bytes>\d+) bytes (?:from file .* )?in (?P<seconds>[\d.]+)s \((?P<rate>[\d.]+) KiB/s\)'),
+        ('read', r'^dumped (?P<bytes>\d+) bytes in (?P<seconds>[\d.]+)s \((?P<rate>[\d.]+) KiB/s\)')
+    ]
+
+    def __init__(self, openocd_exe=None, openocd_path='', params=None):
+        """Create a new instance of the OpenOCD communication class.  By default
+        OpenOCD should be accessible in your system path and it will be used
+        to communicate with a connected device.
+
+        You can override the OpenOCD executable name by specifying a value in
+        the openocd_exe parameter.  You can also manually specify the path to the
+        OpenOCD executable in the openocd_path parameter.
+
+        Optional command line arguments to OpenOCD can be provided in the
+        params parameter as a string.
+        """
+        # If not provided, pick the appropriate OpenOCD name based on the
+        # platform:
+        # - Linux   = openocd
+        # - Mac     = openocd
+        # - Windows = openocd.exe
+        if openocd_exe is None:
+            system = platform.system()
+            if system == 'Linux' or system == 'Darwin':
+                openocd_exe = 'openocd'
+            elif system == 'Windows':
+                openocd_exe = 'openocd.exe'
+            else:
+                raise AdaLinkError('Unsupported system: {0}'.format(system))
+        # Store the path to the OpenOCD tool so it can later be run.
+        self._openocd_path = os.path.join(openocd_path, openocd_exe)
+        logger.info('Using path to OpenOCD: {0}'.format(self._openocd_path))
+        # Apply command line parameters if specified.  Split them like a shell
+        # would so quoted -c commands stay together.
+        self._openocd_params = []
+        if params is not None:
+            self._openocd_params.extend(shlex.split(params))
+            logger.info('Using parameters to OpenOCD: {0}'.format(params))
+        # No OpenOCD session is open until one is requested.  The session
+        # process itself is only started by the first command.
+        self._session = None
+        self._session_depth = 0
+        # Make sure we have OpenOCD in the system path and find its version.
+        self._openocd_version = None
+        self._test_openocd()
+
+    def _test_openocd(self):
+        """Checks if OpenOCD 0.9.0 is found in the system path or not.  The
+        version is cached so OpenOCD is only run to check it again when it
+        changes.
+        """
+        def check(path):
+            # Spawn OpenOCD process with --version and capture its output.
+            args = [path, '--version']
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output, err = process.communicate()
+            output = output.decode('utf-8', 'replace')
+            # Parse out version number from response.
+            match = re.search('^Open On-Chip Debugger (\S+)', output,
+                              re.IGNORECASE | re.MULTILINE)
+            return {'version': match.group(1) if match else None}
+        try:
+            info = discovery.check_tool('openocd', self._openocd_path, check)
+            if info is None:
+                raise RuntimeError('{0} not found'.format(self._openocd_path))
+            if info['version'] is None:
+                return
+            # Simple semantic version check to see if OpenOCD version is greater
+            # or equal to 0.9.0.
+            version = info['version'].split('.')
+            self._openocd_version = tuple(int(re.match('\d*', x).group(0) or 0) for x in version)
+            if int(version[0]) > 0:
+                # Version 1 or greater, assume it's good (higher than 0.9.0).
+                return
+            if int(version[0]) == 0 and int(version[1]) >= 9:
+                # Version 0.9 or greater, assume it's good.
+                return
+            # Otherwise assume version is too old because it's below 0.9.0.
+            raise RuntimeError
+        except Exception as ex:
+            print('ERROR', ex)
+            raise AdaLinkError('Failed to find OpenOCD 0.9.0 or greater!  Make '
+                               'sure OpenOCD 0.9.0 is installed and in your '
+                               'system path.')
+
+    def select_probe(self, serial):
+        """Use the probe with the provided serial number, for when more than
+        one is attached.  Must be called before any other function.
+        """
+        # OpenOCD 0.12 replaced the hla_serial command with adapter serial.
+        if self._openocd_version is not None and self._openocd_version >= (0, 12):
+            command = 'adapter serial {0}'
+        else:
+            command = 'hla_serial {0}'
+        self._openocd_params.extend(['-c', command.format(serial)])
+        self.probe = str(serial)
+
+    def supports_sessions(self):
+        """Return true if this version of OpenOCD can run commands over a
+        session.  Before OpenOCD 0.11 sessions still work, but start a new
+        OpenOCD for each call.
+        """
+        return self._openocd_version is None or self._openocd_version >= SESSION_MIN_VERSION
+
+    @contextlib.contextmanager
+    def session(self):
+        """Context manager which sends every command run inside it to a single
+        OpenOCD process over its TCL RPC port, instead of starting a new
+        OpenOCD for each call.  OpenOCD is started by the first command so a
+        missing board is still reported by is_connected.  Sessions can be
+        nested, OpenOCD is only shut down when the outermost one exits.  With
+        OpenOCD older than 0.11 each call still starts its own OpenOCD, see
+        supports_sessions.
+        """
+        self._session_depth += 1
+        try:
+            yield self
+        finally:
+            self._session_depth -= 1
+            if self._session_depth == 0 and self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def run_commands(self, commands, timeout_sec=60, abort=True, monitor=None):
+        """Run the provided list of commands with OpenOCD.  Commands should be
+        a list of strings with with OpenOCD commands to run.  Returns the
+        output of OpenOCD.  If execution takes longer than timeout_sec an
+        exception will be thrown. Set timeout_sec to None to disable the timeout
+        completely.  Output is parsed as it's printed, and if abort is true
+        the commands are stopped with an exception as soon as OpenOCD reports
+        an error.  Monitor is an optional output.OutputMonitor to parse the
+        output with instead of a new one, so the output is still available if
+        the run fails.
+        """
+        if monitor is None:
+            monitor = self.output_monitor(abort)
+        if self._session_depth > 0 and self.supports_sessions():
+            if self._session is None:
+                args = [self._openocd_path]
+                args.extend(self._openocd_params)
+                self._session = OpenOCDSession(args)
+            # The output of each command is checked before the next one is
+            # sent.
+            for c in commands:
+                words = c.split()
+                if not words or c.strip() in SESSION_SKIP_COMMANDS:
+                    continue
+                with timing.span('reset' if words[0] in RESET_COMMANDS else None):
+                    monitor.feed(self._session.execute(c, timeout_sec))
+            return monitor.close()
+        # Spawn OpenOCD process and capture its output.
+        args = [self._openocd_path]
+        args.extend(self._openocd_params)
+        for c in commands:
+            args.append('-c')
+            args.append(c)
+        logger.debug('Running OpenOCD command: {0}'.format(' '.join(args)))
+        output = run_monitored(args, monitor, timeout_sec)
+        logger.debug('OpenOCD response: {0}'.format(output))
+        return output
+
+    def transaction(self):
+        """Return a new Transaction which runs all of its steps with a single
+        run of OpenOCD, or over the open session.
+        """
+        return CommandTransaction(self)
+
+    def command_effect(self, command):
+        """Return the effect of the provided OpenOCD command on the target, see
+        the planner module.
+        """
+        words = command.strip().lower().split()
+        if not words:
+            return planner.NONE
+        if len(words) > 1 and words[1] in ERASE_SUBCOMMANDS:
+            return planner.ERASE
+        if words[0] in ('reset', 'flash') and len(words) > 1:
+            return COMMAND_EFFECTS.get(' '.join(words[:2]))
+        return COMMAND_EFFECTS.get(words[0])
+
+    def transaction_commands(self, steps):
+        """Join the provided list of each transaction step's commands into one
+        list, which initializes OpenOCD once and exits at the end.  An echo of
+        a marker line between the steps shows where each one's output starts.
+        """
+        commands = ['init']
+        for i, step in enumerate(steps):
+            if i > 0:
+                commands.append('echo {0}{1}'.format(TRANSACTION_MARKER, i))
+            commands.extend(c for c in step if c.strip() not in SESSION_SKIP_COMMANDS)
+        commands.append('exit')
+        return commands
+
+    def split_transaction_output(self, output, steps):
+        """Split the output of the transaction_commands into a list with the
+        output of each step that started.
+        """
+        marker = r'^{0}\d+\r?\n'.format(TRANSACTION_MARKER)
+        return re.split(marker, output, flags=re.MULTILINE)[:len(steps)]
+
+    def transaction_step_starts(self, steps):
+        """Return a function which is called with each line of the output of
+        the transaction_commands, and returns the index of the step whose
+        output starts with that line or None.  Steps after the first start at
+        their marker line.
+        """
+        marker = re.compile(r'^{0}(\d+)$'.format(TRANSACTION_MARKER))
+        def step_start(line):
+            match = marker.match(line.strip())
+            return int(match.group(1)) if match else None
+        return step_start
+
+    def _readmem(self, address, command):
+        """Read the specified register with the provided register read command.
+        """
+        # Build list of commands to read register.
+        address = '0x{0:08X}'.format(address)  # Convert address value to hex string.
+        commands = [
+            'init',
+            '{0} {1}'.format(command, address),
+            'exit'
+        ]
+        # Run command and parse output for register value.
+        output = self.run_commands(commands)
+        match = re.search('^{0}: (\S+)'.format(address), output,
+                          re.IGNORECASE | re.MULTILINE)
+        if match:
+            return int(match.group(1), 16)
+        else:
+            raise AdaLinkError('Could not find expected memory value, {0}'.format(self.connect_hint))
+
+    def readmem_blocks_commands(self, blocks):
+        """Return the list of OpenOCD commands which read the provided list of
+        (address, count, width) blocks of memory.
+        """
+        commands = ['init']
+        for address, count, width in blocks:
+            command = {8: 'mdb', 16: 'mdh', 32: 'mdw'}[width]
+            commands.append('{0} 0x{1:08X} {2}'.format(command, address, count))
+        commands.append('exit')
+        return commands
+
+    def parse_readmem_blocks(self, output, blocks):
+        """Parse the output of the readmem_blocks_commands into a list with an
+        array of values for each block.
+        """
+        results = parse_memory_dump(output, r'^0x([0-9A-F]{8}): (.*)$', blocks)
+        if None in results:
+            raise AdaLinkError('Could not find expected memory value, {0}'.format(self.connect_hint))
+        return results
+
+    def readmem_blocks(self, blocks):
+        """Read a list of (address, count, width) blocks of memory and return a
+        list with an array of values for each block.  All the blocks are read
+        with a single run of OpenOCD commands.
+        """
+        output = self.run_commands(self.readmem_blocks_commands(blocks))
+        return self.parse_readmem_blocks(output, blocks)
+
+    def writemem_words_commands(self, writes):
+        """Return the list of OpenOCD commands which write the provided list of
+        (address, value, width) words to memory.
+        """
+        commands = ['init']
+        for address, value, width in writes:
+            command = {8: 'mwb', 16: 'mwh', 32: 'mww'}[width]
+            commands.append('{0} 0x{1:08X} 0x{2:X}'.format(command, address, value))
+        commands.append('exit')
+        return commands
+
+    def writemem_words(self, writes):
+        """Write a list of (address, value, width) words to memory in order
+        with a single run of OpenOCD commands.
+        """
+        self.run_commands(self.writemem_words_commands(writes))
+
+    def is_connected_commands(self):
+        """Return the list of OpenOCD commands which check for the device."""
+        return ['init', 'exit']
+
+    def parse_is_connected(self, output):
+        """Parse the output of the is_connected_commands and return true if the
+        device was found.
+        """
+        return output.find('Error:') == -1
+
+    def is_connected(self):
+        """Return true if the device is connected to the programmer."""
+        try:
+            # Don't stop on errors, they just mean there's no device.
+            output = self.run_commands(self.is_connected_commands(), abort=False)
+        except AdaLinkError:
+            # A session fails to start when OpenOCD can't find the target.
+            if self._session_depth == 0 or not self.supports_sessions():
+                raise
+            return False
+        return self.parse_is_connected(output)
+
+    def wipe_commands(self):
+        """Return the list of OpenOCD commands which wipe the flash memory of
+        the device.
+        """
+        # There is no general mass erase function with OpenOCD, instead only
+        # chip-specific functions.  For that reason don't implement a default
+        # wipe and instead force cores to subclass and provide their own
+        # wipe functionality.
+        raise NotImplementedError
+
+    def wipe(self):
+        """Wipe clean the flash memory of the device.  Will happen before any
+        programming if requested.
+        """
+        self.run_commands(self.wipe_commands())
+
+    def program_commands(self, hex_files=[], bin_files=[]):
+        """Return the list of OpenOCD commands which program the provided list
+        of hex and/or bin files, see program for the parameters.
+        """
+        # Build list of commands to program hex files.
+        commands = [
+            'init',
+            'reset init',
+            'halt'
+        ]
+        # Program each hex file.
+        for f in hex_files:
+            f = self.escape_path(os.path.abspath(f))
+            commands.append('flash write_image {0} 0 ihex'.format(f))
+        # Program each bin file.
+        for f, addr in bin_files:
+            f = self.escape_path(os.path.abspath(f))
+            commands.append('flash write_image {0} 0x{1:08X} bin'.format(f, addr))
+        commands.append('reset run')
+        commands.append('exit')
+        return commands
+
+    def parse_program(self, output, hex_files=[], bin_files=[]):
+        """Check the output of the program_commands and raise an error if
+        programming failed.  The default implementation doesn't check anything.
+        """
+        pass
+
+    def program(self, hex_files=[], bin_files=[]):
+        """Program chip with provided list of hex and/or bin files.  Hex_files
+        is a list of paths to .hex files, and bin_files is a list of tuples with
+        the first value being the path to the .bin file and the second value
+        being the integer starting address for the bin file."""
+        output = self.run_commands(self.program_commands(hex_files, bin_files))
+        self.parse_program(output, hex_files, bin_files)
+
+    def program_pages_commands(self, bin_files):
+        """Return the list of OpenOCD commands which erase and program only the
+        flash pages touched by the provided list of (path, address) .bin files.
+        """
+        commands = [
+            'init',
+            'reset init',
+            'halt'
+        ]
+        # Let OpenOCD erase just the sectors each file is written to.
+        for f, addr in bin_files:
+            f = self.escape_path(os.path.abspath(f))
+            commands.append('flash write_image erase {0} 0x{1:08X} bin'.format(f, addr))
+        commands.append('reset run')
+        commands.append('exit')
+        return commands
+
+    def program_pages(self, image):
+        """Erase and program only the flash pages touched by the provided
+        image.Image, leaving the rest of flash as it is.
+        """
+        with image.bin_files() as bin_files:
+            self.run_commands(self.program_pages_commands(bin_files))
+
+    def program_sectors_commands(self, bin_files, ranges):
+        """Return the list of OpenOCD commands which erase the provided list of
+        (start, size) ranges of flash and program the provided list of (path,
+        address) .bin files without erasing anything else.
+        """
+        commands = [
+            'init',
+            'reset init',
+            'halt'
+        ]
+        for start, size in ranges:
+            commands.append('flash erase_address 0x{0:08X} 0x{1:X}'.format(start, size))
+        for f, addr in bin_files:
+            f = self.escape_path(os.path.abspath(f))
+            commands.append('flash write_image {0} 0x{1:08X} bin'.format(f, addr))
+        commands.append('reset run')
+        commands.append('exit')
+        return commands
+
+    def program_sectors(self, image, ranges):
+        """Erase the provided list of (start, size) ranges of flash, each made
+        of whole sectors, then program the image.Image without erasing
+        anything else.  Unlike program this never mass erases, even for cores
+        which always do before programming.
+        """
+        with image.bin_files() as bin_files:
+            self.run_commands(self.program_sectors_commands(bin_files, ranges))
+
+    def verify_image_commands(self, bin_files):
+        """Return the list of OpenOCD commands which checksum each of the
+        provided list of (path, address) .bin files against the target.
+        """
+        commands = [
+            'init',
+            'halt'
+        ]
+        for f, addr in bin_files:
+            f = self.escape_path(os.path.abspath(f))
+            commands.append('verify_image_checksum {0} 0x{1:08X} bin'.format(f, addr))
+        commands.append('resume')
+        commands.append('exit')
+        return commands
+
+    def parse_verify_image(self, output, image):
+        """Parse the output of the verify_image_commands into a list of (start,
+        end) address ranges of the image segments which don't match.  Returns
+        None if OpenOCD is too old to verify checksums.
+        """
+        if output.find('invalid command name') != -1:
+            # OpenOCD before 0.11 has no verify_image_checksum.
+            return None
+        # Each segment reports either its verified byte count or an error.  If
+        # OpenOCD stops at the first error the later segments are unknown and
+        # treated as not matching.
+        results = re.findall('^(verified |Error:)', output, re.MULTILINE)
+        mismatched = []
+        for i, (start, data) in enumerate(image.segments):
+            if i >= len(results) or results[i] != 'verified ':
+                mismatched.append((start, start + len(data)))
+        return mismatched
+
+    def verify_image(self, image):
+        """Compare the contents of an image.Image with the target's memory and
+        return a list of (start, end) address ranges of the image segments
+        which don't match.  OpenOCD computes a checksum of each segment on the
+        target so the memory isn't read back, unless OpenOCD is too old to
+        support this.
+        """
+        with image.bin_files() as bin_files:
+            # Mismatches are reported as errors, so don't stop on them.
+            output = self.run_commands(self.verify_image_commands(bin_files), abort=False)
+        mismatched = self.parse_verify_image(output, image)
+        if mismatched is None:
+            return super(OpenOCD, self).verify_image(image)
+        return mismatched
+
+    def dump_bin_commands(self, path, address, length):
+        """Return the list of OpenOCD commands which save length bytes of
+        memory starting at address to a .bin file at path.
+        """
+        path = self.escape_path(os.path.abspath(path))
+        return [
+            'init',
+            'halt',
+            'dump_image {0} 0x{1:08X} {2}'.format(path, address, length),
+            'resume',
+            'exit'
+        ]
+
+    def dump_bin(self, path, address, length):
+        """Save length bytes of memory starting at the provided address to a
+        .bin file at path, with OpenOCD's dump_image command.
+        """
+        self.run_commands(self.dump_bin_commands(path, address, length))
+        check_dump(path, address, length)
+
+    def readmem32(self, address):
+        """Read a 32-bit value from the provided memory address."""
+        return self._readmem(address, 'mdw')
+
+    def readmem16(self, address):
+        """Read a 16-bit value from the provided memory address."""
+        return self._readmem(address, 'mdh')
+
+    def readmem8(self, address):
+        """Read a 8-bit value from the provided memory address."""
+        return self._readmem(address, 'mdb')
+
+    def escape_path(self, path):
+        """Escape the path with Tcl '{}' chars to prevent spaces,
+        backslashes, etc. from being misinterpreted.
+        """
+        return '{{{0}}}'.format(path)
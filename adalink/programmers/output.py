@@ -0,0 +1,130 @@
+# adalink Programmer Tool Output Monitor
+#
+# Parses the output of a programmer tool one line at a time as it arrives, so
+# a run can be stopped as soon as the tool reports a fatal error, and progress
+# like the bytes written and the tool's reported speed is available while the
+# tool is still running.
+import collections
+import re
+import subprocess
+import threading
+import time
+
+from .. import timing
+from ..errors import AdaLinkError
+
+
+# Progress reported by a programmer tool.  Kind is the type of progress like
+# 'write' or 'verify', and bytes, seconds and rate (in KiB/s) are the values
+# the tool reported, or None for any it didn't report.  Line is the raw line of
+# tool output the event was parsed from.
+ProgressEvent = collections.namedtuple('ProgressEvent',
+                                       'kind bytes seconds rate line')
+
+
+class OutputMonitor(object):
+    """Line by line parser of programmer tool output.  Each complete line is
+    checked against a list of fatal error regexes, and an AdaLinkError is
+    raised for the first one that matches.  Lines which match a progress regex
+    are turned into ProgressEvent tuples and passed to a callback.  Every line
+    is also passed to line_callback if it's set, which can raise an
+    AdaLinkError to stop the run like a fatal line.
+    """
+
+    def __init__(self, name, fatal_patterns=[], progress_patterns=[],
+                 callback=None):
+        """Create a monitor for the output of the named tool.  Fatal_patterns
+        is a list of regexes for lines that mean the run failed.
+        Progress_patterns is a list of (kind, regex) tuples, where the regex
+        has named groups for any of the bytes, seconds and rate values it
+        reports.  Callback is called with each ProgressEvent.
+        """
+        self.name = name
+        self._fatal = [re.compile(p) for p in fatal_patterns]
+        self._progress = [(kind, re.compile(p)) for kind, p in progress_patterns]
+        self._callback = callback
+        self.line_callback = None
+        self._lines = []
+        self._partial = ''
+
+    @property
+    def output(self):
+        """All of the output fed to the monitor so far."""
+        return ''.join(self._lines) + self._partial
+
+    def feed(self, text):
+        """Add the next piece of tool output and check each line it completes.
+        Raises an AdaLinkError if a line matches a fatal pattern.
+        """
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._lines.append(line + '\n')
+            self._check(line.rstrip('\r'))
+
+    def close(self):
+        """Check any final line without a newline and return all the output."""
+        if self._partial:
+            line, self._partial = self._partial, ''
+            self._lines.append(line)
+            self._check(line.rstrip('\r'))
+        return self.output
+
+    def _check(self, line):
+        for pattern in self._fatal:
+            if pattern.search(line):
+                raise AdaLinkError('{0} failed: {1}'.format(self.name, line.strip()))
+        if self.line_callback is not None:
+            self.line_callback(line)
+        if self._callback is None:
+            return
+        for kind, pattern in self._progress:
+            match = pattern.search(line)
+            if match:
+                values = match.groupdict()
+                self._callback(ProgressEvent(
+                    kind,
+                    int(values['bytes']) if values.get('bytes') else None,
+                    float(values['seconds']) if values.get('seconds') else None,
+                    float(values['rate']) if values.get('rate') else None,
+                    line))
+
+
+def run_monitored(args, monitor, timeout_sec=60):
+    """Run a process with the provided list of arguments and feed its output to
+    the monitor line by line as it's printed.  The process is stopped as soon
+    as the monitor finds a fatal error, or if it runs longer than timeout_sec
+    seconds (None disables the timeout).  Returns all of the output.
+    """
+    start = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    timed_out = []
+    timeout = None
+    if timeout_sec is not None:
+        # Use a timer to stop the subprocess if the timeout is exceeded, which
+        # ends its output and the loop reading it below.
+        def timeout_exceeded():
+            timed_out.append(True)
+            process.kill()
+        timeout = threading.Timer(timeout_sec, timeout_exceeded)
+        timeout.start()
+    try:
+        spawned = False
+        for line in iter(process.stdout.readline, b''):
+            if not spawned:
+                # Count the time until the tool prints anything as starting it.
+                timing.record('spawn', start, time.time(), tool=monitor.name)
+                spawned = True
+            monitor.feed(line.decode('utf-8', 'replace'))
+        process.wait()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        if timeout is not None:
+            timeout.cancel()
+        process.stdout.close()
+    if timed_out:
+        raise AdaLinkError('{0} process exceeded timeout!'.format(monitor.name))
+    return monitor.close()
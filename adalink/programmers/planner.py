@@ -0,0 +1,96 @@
+# adalink Operation Planner
+#
+# Removes redundant work from the commands of a transaction before they're
+# run.  Each command is classified by the effect it has on the target, and the
+# planner follows what state the target is in (erased, freshly reset, halted
+# or running) to drop commands that don't change it, like a second mass erase
+# or a reset straight after another reset.  Starting the target running is
+# moved after any reads that follow it, so memory is read from a halted target
+# and the target ends up running as requested.
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Effects a command can have on the target.  Commands with an unknown effect
+# (None) could do anything, so the planner forgets what it knows about the
+# target's state when it sees one.
+ERASE = 'erase'   # Erases all of flash.
+WRITE = 'write'   # Writes to memory.
+RESET = 'reset'   # Resets the target and leaves it halted.
+HALT = 'halt'     # Halts the target.
+RUN = 'run'       # Starts the target running (which may reset it first).
+READ = 'read'     # Reads memory.
+WAIT = 'wait'     # Waits for the previous command, like a sleep.
+NONE = 'none'     # Doesn't touch the target, like connecting or quitting.
+
+
+def plan(steps, effect):
+    """Return a copy of steps, a list of each transaction step's list of
+    commands, with redundant commands removed and reads moved before the
+    target is started.  Effect is a function which returns the effect of a
+    command (one of the constants above, or None if it's unknown).
+    """
+    commands = [(i, c, effect(c)) for i, step in enumerate(steps) for c in step]
+    commands = _drop_redundant(commands)
+    commands = _run_after_reads(commands)
+    planned = [[] for step in steps]
+    for i, c, e in commands:
+        planned[i].append(c)
+    return planned
+
+
+def _drop_redundant(commands):
+    # Follow the state of the target and drop commands which don't change it,
+    # along with any wait that follows a dropped command.
+    erased = False
+    state = None   # One of RESET, HALT, RUN or None if it's unknown.
+    kept = []
+    dropped = False
+    for i, c, e in commands:
+        if e == WAIT and dropped:
+            logger.debug('Dropping wait after redundant command: {0}'.format(c))
+            continue
+        dropped = False
+        if e == ERASE and erased:
+            dropped = True
+        elif e == RESET and state == RESET:
+            dropped = True
+        elif e == HALT and state in (RESET, HALT):
+            dropped = True
+        if dropped:
+            logger.debug('Dropping redundant command: {0}'.format(c))
+            continue
+        if e == ERASE:
+            erased = True
+            state = HALT if state in (RESET, HALT) else state
+        elif e == WRITE:
+            erased = False
+            state = HALT if state in (RESET, HALT) else state
+        elif e in (RESET, HALT, RUN):
+            state = e
+        elif e is None:
+            erased = False
+            state = None
+        kept.append((i, c, e))
+    return kept
+
+
+def _run_after_reads(commands):
+    # Move the last command which starts the target after the reads that
+    # follow it, as long as nothing else that touches the target follows it.
+    runs = [n for n, (i, c, e) in enumerate(commands) if e == RUN]
+    if len(runs) == 0:
+        return commands
+    run = runs[-1]
+    after = commands[run+1:]
+    if not any(e == READ for i, c, e in after) or \
+       any(e not in (READ, WAIT, NONE) for i, c, e in after):
+        return commands
+    # The run joins the step of the last read, and goes before any command
+    # that doesn't touch the target, like a quit at the end of the step.
+    last = max(n for n, (i, c, e) in enumerate(after) if e == READ)
+    step = after[last][0]
+    logger.debug('Moving command after reads: {0}'.format(commands[run][1]))
+    moved = (step, commands[run][1], RUN)
+    return commands[:run] + after[:last+1] + [moved] + after[last+1:]
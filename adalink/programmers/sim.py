@@ -0,0 +1,213 @@
+# adalink Simulated Programmer
+#
+# Programmer which talks to an in-memory model of a target instead of real
+# hardware, for exercising adalink and the tools built on it without a probe
+# attached.  The model has flash which must be erased a page at a time, RAM,
+# and the core's info registers seeded with values from its lookup tables.
+# Everything runs in-process so thousands of programming cycles can be
+# simulated quickly.
+import random
+import threading
+
+from .base import Programmer, memory_array
+from ..image import Image
+from ..registers import seed_values
+
+
+# Simulated targets keyed by (core name, probe serial), so every programmer
+# created for the same core and probe in a process sees the same target.
+_targets = {}
+_targets_lock = threading.Lock()
+
+
+class SimTarget(object):
+    """In-memory model of a target's flash, RAM and registers."""
+
+    def __init__(self, flash_region, page_size, ram_region=None):
+        """Create a target with flash at the (start, size) flash_region which is
+        erased in pages of page_size bytes, and RAM at the (start, size)
+        ram_region.  Flash starts out erased and RAM zeroed.
+        """
+        start, size = flash_region
+        self.page_size = page_size
+        self.flash = (start, bytearray(b'\xFF' * size))
+        self.ram = None
+        if ram_region is not None:
+            self.ram = (ram_region[0], bytearray(ram_region[1]))
+        # Sparse bytes of everything else, like registers, keyed by address.
+        self.other = {}
+
+    def _region(self, address, length):
+        # Return the (start, data) region which holds the whole range, or None.
+        for region in (self.flash, self.ram):
+            if region is not None and region[0] <= address and \
+               address + length <= region[0] + len(region[1]):
+                return region
+        return None
+
+    def read(self, address, length):
+        """Return length bytes of memory starting at address."""
+        region = self._region(address, length)
+        if region is not None:
+            offset = address - region[0]
+            return bytes(region[1][offset:offset+length])
+        if length > 1:
+            return b''.join(self.read(address + i, 1) for i in range(length))
+        return bytes(bytearray([self.other.get(address, 0xFF)]))
+
+    def write(self, address, data):
+        """Write data to memory starting at address.  Like real flash, writes
+        to flash can only clear bits, so it must be erased first.
+        """
+        region = self._region(address, len(data))
+        if region is self.flash:
+            offset = address - region[0]
+            flash = region[1]
+            if flash[offset:offset+len(data)] == b'\xFF' * len(data):
+                # Erased flash takes the data as it is.
+                flash[offset:offset+len(data)] = data
+                return
+            for i, b in enumerate(bytearray(data)):
+                flash[offset+i] &= b
+        elif region is not None:
+            offset = address - region[0]
+            region[1][offset:offset+len(data)] = data
+        elif len(data) > 0:
+            for i, b in enumerate(bytearray(data)):
+                self.write_byte(address + i, b)
+
+    def write_byte(self, address, value):
+        # Write a single byte anywhere in memory.
+        if self._region(address, 1) is not None:
+            self.write(address, bytearray([value]))
+        else:
+            self.other[address] = value
+
+    def erase_pages(self, address, length):
+        """Erase every flash page touched by the range of memory."""
+        start, flash = self.flash
+        first = max(address, start)
+        last = min(address + length, start + len(flash))
+        if first >= last:
+            return
+        first = start + (first - start) // self.page_size * self.page_size
+        last = start + ((last - start) + self.page_size - 1) // self.page_size * self.page_size
+        flash[first-start:last-start] = b'\xFF' * (min(last, start + len(flash)) - first)
+
+    def erase_all(self):
+        """Erase all of flash."""
+        start, flash = self.flash
+        flash[:] = b'\xFF' * len(flash)
+
+
+class Sim(Programmer):
+
+    # Name used to identify this programmer on the command line.
+    name = 'sim'
+
+    def __init__(self, core, fields=[], flash_region=(0, 256*1024),
+                 page_size=4096, ram_region=(0x20000000, 32*1024)):
+        """Create a simulated programmer for the named core.  Flash_region and
+        ram_region are the (start, size) of the target's flash and RAM, and
+        page_size is the size of a flash page.  The values read by the provided
+        list of registers.Field instances are seeded with values that decode
+        to entries in their lookup tables, and random values otherwise.
+        """
+        self._core = core
+        self._fields = fields
+        self._flash_region = flash_region
+        self._page_size = page_size
+        self._ram_region = ram_region
+
+    def select_probe(self, serial):
+        """Simulate the board attached to the probe with the provided serial
+        number.  Each probe has its own target.
+        """
+        self.probe = str(serial)
+
+    @property
+    def target(self):
+        """The SimTarget for the core and probe, created on first use."""
+        key = (self._core, self.probe)
+        with _targets_lock:
+            target = _targets.get(key)
+            if target is None:
+                target = SimTarget(self._flash_region, self._page_size, self._ram_region)
+                # Seed the info registers with values unique to the probe.
+                rng = random.Random('{0}:{1}'.format(self._core, self.probe))
+                for (address, width), value in seed_values(self._fields, rng).items():
+                    for i in range(width // 8):
+                        target.write_byte(address + i, (value >> (i*8)) & 0xFF)
+                _targets[key] = target
+        return target
+
+    def is_connected(self):
+        """Return true if the device is connected to the programmer."""
+        return True
+
+    def wipe(self):
+        """Wipe clean the flash memory of the device."""
+        self.target.erase_all()
+
+    def program(self, hex_files=[], bin_files=[]):
+        """Program chip with provided list of hex and/or bin files.  Hex_files
+        is a list of paths to .hex files, and bin_files is a list of tuples with
+        the first value being the path to the .bin file and the second value
+        being the integer starting address for the bin file."""
+        self.program_image(Image.from_files(hex_files, bin_files))
+
+    def program_image(self, image):
+        """Program chip with the contents of an image.Image.  The flash pages
+        the image touches are all erased before any of it is written.
+        """
+        target = self.target
+        segments = image.segments
+        for start, data in segments:
+            target.erase_pages(start, len(data))
+        for start, data in segments:
+            target.write(start, data)
+
+    def program_pages(self, image):
+        """Erase and program only the flash pages touched by the provided
+        image.Image, leaving the rest of flash as it is.
+        """
+        self.program_image(image)
+
+    def program_sectors(self, image, ranges):
+        """Erase the provided list of (start, size) ranges of flash, then
+        program the image.Image without erasing anything else.
+        """
+        target = self.target
+        for start, size in ranges:
+            target.erase_pages(start, size)
+        for start, data in image.segments:
+            target.write(start, data)
+
+    def readmem_blocks(self, blocks):
+        """Read a list of (address, count, width) blocks of memory and return a
+        list with an array of values for each block.
+        """
+        target = self.target
+        return [memory_array(width, target.read(address, count*width//8))
+                for address, count, width in blocks]
+
+    def writemem_words(self, writes):
+        """Write a list of (address, value, width) words to memory in order.
+        Like the other programmers, writes to flash can only clear bits.
+        """
+        target = self.target
+        for address, value, width in writes:
+            target.write(address, bytearray((value >> (i*8)) & 0xFF
+                                            for i in range(width // 8)))
+
+    def readmem32(self, address):
+        """Read a 32-bit value from the provided memory address."""
+        return self.readmem_block(address, 1, 32)[0]
+
+    def readmem16(self, address):
+        """Read a 16-bit value from the provided memory address."""
+        return self.readmem_block(address, 1, 16)[0]
+
+    def readmem8(self, address):
+        """Read a 8-bit value from the provided memory address."""
+        return self.readmem_block(address, 1, 8)[0]
@@ -0,0 +1,172 @@
+# adalink Register Tables
+#
+# Declarative description of the memory values a core reads to display its
+# info, and a planner which reads all of them from the programmer in a single
+# batch.  Duplicate reads are removed and nearby addresses are merged into
+# block reads, then every value is decoded on the host.
+import struct
+
+import click
+
+
+# Largest gap in bytes between two reads that still merges them into a single
+# block read.  Reading a few unused words is cheaper than another command.
+MERGE_GAP = 32
+
+# struct formats to decode a little endian value of each bit width.
+WIDTH_FORMATS = {8: '<B', 16: '<H', 32: '<I'}
+
+
+class Field(object):
+    """A line of core info decoded from one or more memory values."""
+
+    def __init__(self, label, reads, decode, programmers=None):
+        """Create a field displayed with the provided label.  Reads is a list of
+        (address, width) memory values to read, and decode is a function which
+        is called with those values (in the same order) and returns the text to
+        display, or None to hide the field.  Programmers is an optional tuple of
+        programmer classes the field is limited to.
+        """
+        self.label = label
+        self.reads = reads
+        self.decode = decode
+        self.programmers = programmers
+
+    def applies_to(self, programmer):
+        """Return true if the field should be displayed for the programmer."""
+        return self.programmers is None or isinstance(programmer, self.programmers)
+
+
+class Register(Field):
+    """A line of core info decoded from a single memory value."""
+
+    def __init__(self, label, address, width=32, mask=None, shift=0,
+                 lookup=None, fmt='0x{0:08X}', hide_unknown=False,
+                 programmers=None):
+        """Create a field for the value at address with the provided bit width.
+        The value is masked with mask and shifted right by shift, then looked
+        up in the lookup dict.  Values that aren't in the lookup are formatted
+        with fmt, or hidden if hide_unknown is true.
+        """
+        super(Register, self).__init__(label, [(address, width)], self._decode,
+                                       programmers)
+        self.mask = mask
+        self.shift = shift
+        self.lookup = lookup
+        self.fmt = fmt
+        self.hide_unknown = hide_unknown
+
+    def value(self, raw):
+        """Return the field value from the raw memory value."""
+        if self.mask is not None:
+            raw &= self.mask
+        return raw >> self.shift
+
+    def _decode(self, raw):
+        value = self.value(raw)
+        if self.lookup is not None and value in self.lookup:
+            return self.lookup[value]
+        if self.hide_unknown:
+            return None
+        return self.fmt.format(value)
+
+
+def plan_reads(reads):
+    """Return a list of (address, count, width) 32-bit block reads which cover
+    all of the provided (address, width) reads.  Duplicate reads are dropped
+    and reads within MERGE_GAP bytes of each other share a block.
+    """
+    spans = sorted(set((address & ~3, (address + width//8 + 3) & ~3)
+                       for address, width in reads))
+    blocks = []
+    for start, end in spans:
+        if blocks and start <= blocks[-1][1] + MERGE_GAP:
+            blocks[-1][1] = max(blocks[-1][1], end)
+        else:
+            blocks.append([start, end])
+    return [(start, (end - start) // 4, 32) for start, end in blocks]
+
+
+def read_values(programmer, reads):
+    """Read all of the provided (address, width) values with one batch of
+    block reads and return a dict of the values keyed by (address, width).
+    """
+    blocks = plan_reads(reads)
+    return block_values(reads, blocks, programmer.readmem_blocks(blocks))
+
+
+def block_values(reads, blocks, results):
+    """Return a dict of the provided (address, width) values keyed by (address,
+    width), taken from the arrays of values read for the planned blocks.
+    """
+    memory = [(address, values.tobytes()) for (address, count, width), values
+              in zip(blocks, results)]
+    values = {}
+    for address, width in reads:
+        for start, data in memory:
+            offset = address - start
+            if 0 <= offset and offset + width//8 <= len(data):
+                values[(address, width)] = struct.unpack_from(
+                    WIDTH_FORMATS[width], data, offset)[0]
+                break
+    return values
+
+
+def field_reads(programmer, fields):
+    """Return the list of (address, width) values read by the provided fields
+    that apply to the programmer.
+    """
+    return [r for f in fields if f.applies_to(programmer) for r in f.reads]
+
+
+def read_fields(programmer, fields, values=None):
+    """Read and decode the provided fields, returning a list of (label, text)
+    for each field that applies to the programmer and isn't hidden.  Values
+    is an optional dict of the field_reads values that were already read,
+    keyed by (address, width).
+    """
+    fields = [f for f in fields if f.applies_to(programmer)]
+    if values is None:
+        values = read_values(programmer, [r for f in fields for r in f.reads])
+    results = []
+    for f in fields:
+        text = f.decode(*[values[r] for r in f.reads])
+        if text is not None:
+            results.append((f.label, text))
+    return results
+
+
+def echo_fields(programmer, fields, values=None):
+    """Read, decode and print the provided fields, one per line with their
+    labels aligned.  Values is an optional dict of values already read, see
+    read_fields.
+    """
+    width = max(len(f.label) for f in fields)
+    for label, text in read_fields(programmer, fields, values):
+        click.echo('{0:<{1}} : {2}'.format(label, width, text))
+
+
+def seed_values(fields, rng):
+    """Return a dict of raw values keyed by (address, width) which decode to
+    plausible field values, for seeding a simulated target.  Registers with a
+    lookup get the smallest value in it and other reads get random values from
+    the provided random.Random instance.  When registers share an address the
+    first one to claim each bit decides its value.
+    """
+    values = {}
+    claimed = {}
+    for f in fields:
+        for address, width in f.reads:
+            key = (address, width)
+            full = (1 << width) - 1
+            if key not in values:
+                values[key] = rng.getrandbits(width)
+                claimed[key] = 0
+            if not isinstance(f, Register) or f.lookup is None or len(f.lookup) == 0:
+                continue
+            mask = full if f.mask is None else f.mask & full
+            mask &= ~claimed[key]
+            value = (min(f.lookup) << f.shift) & mask
+            values[key] = (values[key] & ~mask) | value
+            claimed[key] |= mask
+    return values
@@ -0,0 +1,460 @@
+# adalink Station Server
+#
+# Long running server behind the `adalink serve` command, for programming
+# stations which flash many boards.  Instead of starting a new adalink process
+# for every board, a line controller submits jobs to the server over HTTP on a
+# local TCP port or Unix socket.  Cores and programmer tools are set up once,
+# and each probe has its own queue of jobs run in order by a worker thread that
+# keeps the programmer's session (a running JLinkExe or OpenOCD) open between
+# jobs.
+#
+# The API takes and returns JSON:
+#   POST /jobs      - Submit a job, see Station.submit for its fields.  Returns
+#                     the job, which is finished if the job asked to wait.
+#   GET /jobs/<id>  - Return a job with its state and results.
+#   GET /status     - Return the depth of every probe's queue.
+import collections
+import json
+import logging
+import os
+import stat
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn, UnixStreamServer
+
+from .core import Core
+from .cores import CORES, load_core
+from .errors import AdaLinkError
+from .image import Image
+from .registers import block_values, field_reads, plan_reads, read_fields
+
+
+logger = logging.getLogger(__name__)
+
+# Number of finished jobs kept so their results can be fetched, the oldest are
+# forgotten first.
+FINISHED_JOBS = 1000
+
+# Number of loaded images kept so jobs programming the same files don't load
+# them again, the oldest are forgotten first.
+CACHED_IMAGES = 16
+
+# Options a job can set, with their default values.
+JOB_OPTIONS = {
+    'core': None,
+    'programmer': None,
+    'probe': None,
+    'wipe': False,
+    'hex': [],
+    'bin': [],
+    'erase_sectors': False,
+    'diff': False,
+    'delta': False,
+    'skip_identical': False,
+    'verify': False,
+    'info': False,
+    'writes': [],
+    'reads': [],
+    'wait': False
+}
+
+
+def _address(value):
+    # Addresses can be given as numbers or strings like '0x1000'.
+    return value if isinstance(value, int) else int(value, 0)
+
+
+class Job(object):
+    """A job submitted to the station, with the options it runs with and its
+    state and results once it's run.  A job can run after another job on
+    the same probe, and is skipped if that job doesn't succeed.
+    """
+
+    def __init__(self, id, options, after=None):
+        self.id = id
+        self.options = options
+        self.after = after
+        self.state = 'queued'
+        self.results = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        """Return the job as a dict to send as JSON."""
+        job = {
+            'id': self.id,
+            'state': self.state,
+            'core': self.options['core'],
+            'programmer': self.options['programmer'],
+            'probe': self.options['probe'],
+            'submitted': self.submitted
+        }
+        if self.started is not None:
+            job['queued_seconds'] = self.started - self.submitted
+        if self.finished is not None:
+            job['seconds'] = self.finished - self.started
+        if self.results is not None:
+            job.update(self.results)
+        if self.error is not None:
+            job['error'] = self.error
+        return job
+
+
+class ProbeWorker(object):
+    """Runs the jobs for one probe in the order they're submitted from its own
+    thread.  The programmer and its session are kept open between jobs, and
+    only rebuilt when a job uses a different core or programmer, or after a
+    job fails.
+    """
+
+    def __init__(self, station, probe):
+        self.station = station
+        self.probe = probe
+        self.queue = queue.Queue()
+        self.running = None
+        self.completed = 0
+        self.failed = 0
+        self._thread = threading.Thread(target=self._loop, name='probe-{0}'.format(probe))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, job):
+        """Add a job to the end of the probe's queue."""
+        self.queue.put(job)
+
+    def stop(self):
+        """Stop the worker after the jobs already queued, and wait for it."""
+        self.queue.put(None)
+        self._thread.join()
+
+    def status(self):
+        """Return a dict describing the probe's queue."""
+        return {
+            'probe': self.probe,
+            'queued': self.queue.qsize(),
+            'running': None if self.running is None else self.running.id,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+    def _loop(self):
+        key = None
+        programmer = None
+        session = None
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            self.running = job
+            job.state = 'running'
+            job.started = time.time()
+            core = self.station.core(job.options['core'])
+            if job.after is not None and job.after.state != 'done':
+                job.state = 'skipped'
+                job.error = 'Job {0} failed.'.format(job.after.id)
+                job.finished = job.started
+                self.running = None
+                self.station.finished(job)
+                job.done.set()
+                continue
+            try:
+                if key != (job.options['core'], job.options['programmer']):
+                    # Close the session of the last programmer before opening
+                    # the new one, they may use the same probe.
+                    if session is not None:
+                        session.__exit__(None, None, None)
+                        key = session = None
+                    programmer = core.create_programmer(job.options['programmer'])
+                    if self.probe is not None:
+                        programmer.select_probe(self.probe)
+                    session = programmer.session()
+                    session.__enter__()
+                    key = (job.options['core'], job.options['programmer'])
+                job.results = run_job(core, programmer, job.options,
+                                      self.station.image(job.options))
+                job.state = 'done'
+                self.completed += 1
+            except Exception as ex:
+                if not isinstance(ex, AdaLinkError):
+                    logger.exception('Job {0} failed'.format(job.id))
+                job.state = 'failed'
+                job.error = str(ex)
+                self.failed += 1
+                # Start over with a fresh programmer and session in case the
+                # failure left the tool in a bad state.
+                if session is not None:
+                    try:
+                        session.__exit__(None, None, None)
+                    except Exception:
+                        logger.exception('Failed to close the session of probe {0}'.format(self.probe))
+                key = session = None
+            finally:
+                job.finished = time.time()
+                self.running = None
+                self.station.finished(job)
+                job.done.set()
+        if session is not None:
+            session.__exit__(None, None, None)
+
+
+def run_job(core, programmer, options, image=None):
+    """Run a job's options on the core with the programmer and return a dict of
+    the results: the result message, the decoded info fields as a list of
+    [label, text] pairs, and the values of each memory read.  Image is the
+    image.Image of the job's hex and bin files, or None to program nothing.
+    """
+    writes = [(_address(a), _address(value), int(width))
+              for a, value, width in options['writes']]
+    blocks = [(_address(a), int(count), int(width)) for a, count, width in options['reads']]
+    info_reads = []
+    if options['info']:
+        info_reads = field_reads(programmer, core.info_fields)
+    info_blocks = plan_reads(info_reads)
+    result, (info_results, results) = core._run(
+        programmer, options['wipe'], image, options['erase_sectors'], options['diff'],
+        options['skip_identical'], options['verify'], [info_blocks, blocks], writes,
+        options['delta'])
+    results_dict = {'result': result}
+    if options['info']:
+        values = block_values(info_reads, info_blocks, info_results)
+        results_dict['info'] = [[label, text] for label, text in
+                                read_fields(programmer, core.info_fields, values)]
+    if len(blocks) > 0:
+        results_dict['reads'] = [list(values) for values in results]
+    return results_dict
+
+
+class Station(object):
+    """Queues submitted jobs for each probe and keeps the finished ones so
+    their results can be fetched.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cores = {}
+        self._workers = {}
+        self._jobs = {}
+        self._finished = []
+        self._images = collections.OrderedDict()
+        self._next_id = 1
+
+    def core(self, name):
+        """Return the instance of the named core, built the first time it's
+        used.
+        """
+        with self._lock:
+            if name not in self._cores:
+                self._cores[name] = load_core(name)()
+            return self._cores[name]
+
+    def image(self, options):
+        """Return the image.Image of the job options' hex and bin files, or
+        None if there are none.  Images are loaded once and reused until one of
+        their files changes.
+        """
+        files = [(path, None) for path in options['hex']] + \
+                [(path, _address(a)) for path, a in options['bin']]
+        if len(files) == 0:
+            return None
+        key = tuple((path, address, os.path.getmtime(path)) for path, address in files)
+        with self._lock:
+            image = self._images.get(key)
+        if image is None:
+            image = Image.from_files(options['hex'],
+                                     [(path, _address(a)) for path, a in options['bin']])
+            with self._lock:
+                self._images[key] = image
+                while len(self._images) > CACHED_IMAGES:
+                    self._images.popitem(last=False)
+        return image
+
+    def check(self, options):
+        """Raise an error if a job's options are invalid, otherwise return them
+        with the defaults filled in.  Options is a dict with the core and
+        programmer names, the serial number of the probe (or None for the only
+        one attached), and the same choices as the command line: wipe, hex (a
+        list of paths), bin (a list of [path, address]), erase_sectors, diff,
+        delta, skip_identical, verify, info, writes (a list of [address, value, width]
+        words of memory) and reads (a list of [address, count, width] blocks of
+        memory).
+        """
+        unknown = set(options) - set(JOB_OPTIONS)
+        if len(unknown) > 0:
+            raise AdaLinkError('Unknown job options: {0}'.format(', '.join(sorted(unknown))))
+        options = dict(JOB_OPTIONS, **options)
+        if options['core'] not in CORES:
+            raise AdaLinkError('Unknown core: {0}'.format(options['core']))
+        core = self.core(options['core'])
+        if options['programmer'] not in core.list_programmers():
+            raise AdaLinkError('{0} can\'t be programmed with: {1}'.format(
+                core.name, options['programmer']))
+        core.check_options(options['wipe'], len(options['hex']) + len(options['bin']) > 0,
+                           options['erase_sectors'], options['diff'], options['verify'],
+                           options['delta'])
+        if options['info'] and type(core).info != Core.info:
+            raise AdaLinkError('The info of {0} can\'t be read by the station.'.format(core.name))
+        for name in ('writes', 'reads'):
+            for entry in options[name]:
+                try:
+                    address, value, width = entry
+                    _address(address), _address(value)
+                except (TypeError, ValueError):
+                    raise AdaLinkError('Bad {0} entry: {1}'.format(name, entry))
+                if width not in (8, 16, 32):
+                    raise AdaLinkError('Bad width in {0} entry: {1}'.format(name, entry))
+        for path in options['hex'] + [path for path, address in options['bin']]:
+            if not os.path.isfile(path):
+                raise AdaLinkError('File not found: {0}'.format(path))
+        return options
+
+    def submit(self, options, after=None):
+        """Check and queue a job with the provided options (see check) and
+        return it.  If after is a job on the same probe this job is skipped
+        when it doesn't succeed.
+        """
+        options = self.check(options)
+        with self._lock:
+            job = Job(str(self._next_id), options, after)
+            self._next_id += 1
+            self._jobs[job.id] = job
+            probe = options['probe']
+            if probe not in self._workers:
+                self._workers[probe] = ProbeWorker(self, probe)
+            worker = self._workers[probe]
+        worker.submit(job)
+        return job
+
+    def job(self, id):
+        """Return the job with the provided id, or None if it's unknown."""
+        with self._lock:
+            return self._jobs.get(id)
+
+    def finished(self, job):
+        # Called by the workers when a job finishes, forgets the oldest
+        # finished jobs.
+        with self._lock:
+            self._finished.append(job.id)
+            while len(self._finished) > FINISHED_JOBS:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def status(self):
+        """Return a dict with the depth of every probe's queue."""
+        with self._lock:
+            probes = [w.status() for p, w in sorted(self._workers.items(),
+                                                     key=lambda item: str(item[0]))]
+        return {
+            'queued': sum(p['queued'] for p in probes),
+            'running': len([p for p in probes if p['running'] is not None]),
+            'probes': probes
+        }
+
+    def stop(self):
+        """Stop every worker after the jobs already queued."""
+        with self._lock:
+            workers = list(self._workers.values())
+        for worker in workers:
+            worker.stop()
+
+
+class StationHandler(BaseHTTPRequestHandler):
+    """HTTP request handler for the station API."""
+
+    def _send(self, code, body):
+        data = json.dumps(body, sort_keys=True).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        station = self.server.station
+        if self.path == '/status':
+            self._send(200, station.status())
+        elif self.path.startswith('/jobs/'):
+            job = station.job(self.path[len('/jobs/'):])
+            if job is None:
+                self._send(404, {'error': 'Unknown job.'})
+            else:
+                self._send(200, job.to_dict())
+        else:
+            self._send(404, {'error': 'Unknown path.'})
+
+    def do_POST(self):
+        if self.path != '/jobs':
+            self._send(404, {'error': 'Unknown path.'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            options = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(options, dict):
+                raise ValueError
+        except ValueError:
+            self._send(400, {'error': 'The job must be a JSON object.'})
+            return
+        try:
+            job = self.server.station.submit(options)
+        except AdaLinkError as ex:
+            self._send(400, {'error': str(ex)})
+            return
+        if job.options['wait']:
+            job.done.wait()
+            self._send(200, job.to_dict())
+        else:
+            self._send(202, job.to_dict())
+
+    def log_message(self, format, *args):
+        # Log requests instead of printing them, Unix socket clients have no
+        # address to print.
+        logger.debug(format % args)
+
+
+class StationServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixStationServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(host='127.0.0.1', port=8808, socket_path=None, ready=None):
+    """Run the station server until it's interrupted, listening on the Unix
+    socket at socket_path if provided and otherwise on the TCP host and port.
+    Ready is an optional function called with the server once it's listening.
+    """
+    if socket_path is not None:
+        # Replace a socket left behind by a server that didn't exit cleanly,
+        # but never remove anything else that happens to be at the path.
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise AdaLinkError('{0} already exists and isn\'t a socket.'.format(socket_path))
+            os.remove(socket_path)
+        server = UnixStationServer(socket_path, StationHandler)
+    else:
+        server = StationServer((host, port), StationHandler)
+    server.station = Station()
+    if ready is not None:
+        ready(server)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.station.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,171 @@
+# adalink Timing Profile
+#
+# Records how long each phase of a run takes, like starting the programmer
+# tool, connecting, erasing and writing, as wall-clock spans tagged with the
+# core, programmer and files being programmed.  Nothing is recorded unless a
+# profile is started (with the --profile option) or a thread is collecting the
+# totals of its own phases (like for the history store), and spans do nothing
+# otherwise.
+import contextlib
+import json
+import threading
+import time
+
+from . import __version__
+
+
+# Profile being recorded, or None when profiling is off.
+_active = None
+
+# Holds the dict of phase totals each thread is collecting, see collect.
+_local = threading.local()
+
+
+class Profile(object):
+    """Wall-clock spans of each phase of a run, with tags describing it."""
+
+    def __init__(self):
+        self.tags = {}
+        self.spans = []
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def tag(self, **tags):
+        """Add tags which describe the whole run."""
+        self.tags.update(tags)
+
+    @contextlib.contextmanager
+    def context(self, **tags):
+        """Context manager which adds tags to every span recorded by the
+        current thread inside it, like the probe a thread is programming.
+        """
+        previous = getattr(self._local, 'tags', {})
+        self._local.tags = dict(previous, **tags)
+        try:
+            yield
+        finally:
+            self._local.tags = previous
+
+    def record(self, phase, start, end, ok=True, **tags):
+        """Record a span of the named phase between the start and end times."""
+        tags = dict(getattr(self._local, 'tags', {}), **tags)
+        with self._lock:
+            self.spans.append({
+                'phase': phase,
+                'start': round(start - self._start, 6),
+                'duration': round(end - start, 6),
+                'ok': ok,
+                'tags': tags
+            })
+
+    @contextlib.contextmanager
+    def span(self, phase, **tags):
+        """Context manager which records a span of the named phase for the
+        code run inside it.  Spans which end with an exception aren't ok.
+        """
+        start = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(phase, start, time.time(), ok, **tags)
+
+    def totals(self):
+        """Return a dict of the total seconds spent in each phase.  Spans can
+        nest, like a tool starting while connecting, so totals can overlap.
+        """
+        totals = {}
+        for s in self.spans:
+            totals[s['phase']] = round(totals.get(s['phase'], 0) + s['duration'], 6)
+        return totals
+
+    def to_json(self):
+        """Return the profile as a JSON string."""
+        return json.dumps({
+            'version': __version__,
+            'duration': round(time.time() - self._start, 6),
+            'tags': self.tags,
+            'totals': self.totals(),
+            'spans': self.spans
+        }, indent=2, sort_keys=True)
+
+
+@contextlib.contextmanager
+def _nothing():
+    yield
+
+
+def start():
+    """Start recording a new profile and return it."""
+    global _active
+    _active = Profile()
+    return _active
+
+
+def stop():
+    """Stop recording and return the profile that was recorded."""
+    global _active
+    profile, _active = _active, None
+    return profile
+
+
+def tag(**tags):
+    """Add tags which describe the whole run to the profile being recorded."""
+    if _active is not None:
+        _active.tag(**tags)
+
+
+def context(**tags):
+    """Context manager which adds tags to every span the current thread
+    records inside it.
+    """
+    if _active is None:
+        return _nothing()
+    return _active.context(**tags)
+
+
+@contextlib.contextmanager
+def collect():
+    """Context manager which provides a dict of the total seconds spent in each
+    phase by the spans the current thread records inside it, whether or not
+    profiling is on.
+    """
+    totals = {}
+    previous = getattr(_local, 'totals', None)
+    _local.totals = totals
+    try:
+        yield totals
+    finally:
+        _local.totals = previous
+
+
+@contextlib.contextmanager
+def _span(phase, tags):
+    start = time.time()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        record(phase, start, time.time(), ok, **tags)
+
+
+def span(phase, **tags):
+    """Context manager which records a span of the named phase for the code run
+    inside it.  Does nothing if phase is None, or if profiling is off and the
+    thread isn't collecting its phases.
+    """
+    if phase is None or (_active is None and getattr(_local, 'totals', None) is None):
+        return _nothing()
+    return _span(phase, tags)
+
+
+def record(phase, start, end, ok=True, **tags):
+    """Record a span of the named phase between the start and end times."""
+    if _active is not None:
+        _active.record(phase, start, end, ok, **tags)
+    totals = getattr(_local, 'totals', None)
+    if totals is not None:
+        totals[phase] = round(totals.get(phase, 0) + end - start, 6)
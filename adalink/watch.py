@@ -0,0 +1,123 @@
+# adalink Memory Watch
+#
+# Samples memory at a fixed rate over one open programmer session, behind the
+# `adalink watch` and `adalink wait-for` commands.  Polling a status word by
+# running adalink with -r32 in a shell loop starts JLinkExe or OpenOCD and
+# connects to the target for every sample, which manages a few samples a
+# second at best.  Here the tool is started once and each sample is a single
+# batch of reads sent to the running tool.  Every watched value is read on its
+# own at its width, as reading a wider block around a peripheral register can
+# touch its neighbours (and clear status flags that are cleared by reading).
+import json
+import re
+import time
+
+from .cores import CORES, load_core
+from .errors import AdaLinkError
+
+
+def parse_int(text):
+    """Return the integer in text, which can be hex (like 0x00FF), octal or
+    decimal.
+    """
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise AdaLinkError('{0} is not a valid integer.'.format(text))
+
+
+def parse_read(text):
+    """Return the (address, width) of a value to watch from text like
+    0x20000000 or 0x20000000:16.  The width defaults to 32 bits.
+    """
+    match = re.match(r'^(\w+)(?::(8|16|32))?$', text.strip())
+    if match is None:
+        raise AdaLinkError('Bad address: {0}, use an address and optional width like 0x20000000:16.'.format(text))
+    return parse_int(match.group(1)), int(match.group(2) or 32)
+
+
+def open_programmer(core_name, programmer_name, probe=None):
+    """Create and return the named core and programmer, using the probe with the
+    provided serial number if not None.
+    """
+    if core_name not in CORES:
+        raise AdaLinkError('Unknown core: {0}'.format(core_name))
+    core = load_core(core_name)()
+    if programmer_name not in core.list_programmers():
+        raise AdaLinkError('The {0} core can\'t use the {1} programmer, choose one of: {2}'.format(
+            core_name, programmer_name, ', '.join(core.list_programmers())))
+    programmer = core.create_programmer(programmer_name)
+    if probe is not None:
+        programmer.select_probe(probe)
+    return core, programmer
+
+
+def check_connected(core, programmer):
+    """Raise an error if the core's device isn't connected to the programmer.
+    Call it inside the programmer's session, before the first sample.
+    """
+    if not programmer.is_connected():
+        raise AdaLinkError('Could not find {0}, is it connected?'.format(core.name))
+
+
+def sample(programmer, reads, interval, count=None, duration=None):
+    """Read the provided list of (address, width) values every interval
+    seconds and yield the time of each sample with a list of the values read,
+    in the same order as reads.  Stops after count samples or duration seconds
+    if either isn't None, otherwise runs until the caller stops.  Samples are
+    scheduled from the start so the rate doesn't drift, and any which are
+    missed because reading took too long are skipped.  Must be used inside the
+    programmer's session to keep its tool running between samples.
+    """
+    blocks = [(address, 1, width) for address, width in reads]
+    start = time.time()
+    taken = 0
+    tick = 0
+    while count is None or taken < count:
+        now = time.time()
+        yield now, [values[0] for values in programmer.readmem_blocks(blocks)]
+        taken += 1
+        tick = max(tick + 1, int((time.time() - start) / interval) + 1)
+        due = start + tick * interval
+        if duration is not None and due - start >= duration:
+            break
+        time.sleep(max(0, due - time.time()))
+
+
+def wait_for(programmer, address, mask, value, timeout, width=32, interval=0.01):
+    """Read the width bit value at address every interval seconds until it
+    masked with mask equals value, and return the value read and the seconds
+    waited.  Raises an error if it doesn't within timeout seconds.  Must be used
+    inside the programmer's session to keep its tool running between reads.
+    """
+    value &= mask
+    start = time.time()
+    current = None
+    for now, (current,) in sample(programmer, [(address, width)], interval, duration=timeout):
+        if current & mask == value:
+            return current, now - start
+    raise AdaLinkError('Timed out after {0}s waiting for 0x{1:08X} & 0x{2:X} to be 0x{3:X}, last read 0x{4:0{5}X}.'.format(
+        timeout, address, mask, value, current, width // 4))
+
+
+def csv_header(reads):
+    """Return the CSV header line for samples of the provided reads."""
+    return ','.join(['time'] + [label(r) for r in reads])
+
+
+def csv_line(now, reads, values):
+    """Return a CSV line of a sample, with the values in hex."""
+    return ','.join(['{0:.6f}'.format(now)] + ['0x{0:0{1}X}'.format(v, width // 4)
+                                               for (address, width), v in zip(reads, values)])
+
+
+def json_line(now, reads, values):
+    """Return a JSON line of a sample, with the values keyed by label."""
+    return json.dumps({'time': round(now, 6),
+                       'values': dict((label(r), v) for r, v in zip(reads, values))},
+                      sort_keys=True)
+
+
+def label(read):
+    """Return the label of an (address, width) read, like 0x20000000:32."""
+    return '0x{0:08X}:{1}'.format(*read)
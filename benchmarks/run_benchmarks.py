@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# adalink end to end benchmarks.
+#
+# Runs adalink commands for every core and programmer against the fake
+# JLinkExe and OpenOCD tools in the tools folder, so the overhead of each
+# operation can be measured without a probe attached.  Each operation is run a
+# number of times in a fresh adalink process and the median wall-clock time is
+# reported, along with the median time of each phase from adalink's --profile
+# output to show where the time goes.
+#
+# The fake tools can be made to behave like slower real hardware with the
+# options for startup delay, connect latency and write speed.  Run with --help
+# to see all the options, for example:
+#
+#   python benchmarks/run_benchmarks.py --cores nrf51822 --repeat 5 --json results.json
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = os.path.join(ROOT, 'tools')
+
+# Operations to measure.  Each is a function which takes the path to the test
+# hex file and returns the adalink options to run it.
+OPERATIONS = [
+    ('startup', lambda hex_file: ['--help']),
+    ('connect', lambda hex_file: []),
+    ('readmem', lambda hex_file: ['-r32', '0x10000000']),
+    ('info', lambda hex_file: ['--info']),
+    ('program', lambda hex_file: ['--program-hex', hex_file]),
+]
+
+
+def write_hex(path, size, address=0):
+    """Write an Intel HEX file with size bytes of test data at address."""
+    with open(path, 'w') as f:
+        for offset in range(0, size, 16):
+            current = address + offset
+            if offset == 0 or current & 0xFFFF == 0:
+                upper = current >> 16
+                record = bytearray([2, 0, 0, 4, upper >> 8, upper & 0xFF])
+                record.append(-sum(record) & 0xFF)
+                f.write(':' + ''.join('{0:02X}'.format(b) for b in record) + '\n')
+            data = bytearray((offset + i) & 0xFF for i in range(min(16, size - offset)))
+            record = bytearray([len(data), (current >> 8) & 0xFF, current & 0xFF, 0]) + data
+            record.append(-sum(record) & 0xFF)
+            f.write(':' + ''.join('{0:02X}'.format(b) for b in record) + '\n')
+        f.write(':00000001FF\n')
+
+
+def make_fake_path(directory):
+    """Create links to the fake tools with the real tool names and return the
+    directory to put ahead of the PATH.
+    """
+    bin_dir = os.path.join(directory, 'bin')
+    os.mkdir(bin_dir)
+    for fake, names in (('fake_jlinkexe.py', ['JLinkExe', 'JLink.exe']),
+                        ('fake_openocd.py', ['openocd', 'openocd.exe'])):
+        for name in names:
+            path = os.path.join(bin_dir, name)
+            os.symlink(os.path.join(TOOLS, fake), path)
+    return bin_dir
+
+
+def list_cores():
+    """Return a list of (core name, list of programmer names) for every core."""
+    sys.path.insert(0, ROOT)
+    from adalink.cores import all_cores
+    results = []
+    for core in all_cores():
+        instance = core()
+        results.append((instance.name, instance.list_programmers()))
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle-1] + values[middle]) / 2.0
+
+
+def run_operation(args, env, directory):
+    """Run adalink once with a profile and return (seconds, phase totals,
+    error message or None).
+    """
+    profile = os.path.join(directory, 'profile.json')
+    if os.path.exists(profile):
+        os.remove(profile)
+    command = [sys.executable, '-m', 'adalink.main', '--profile', profile] + args
+    start = time.time()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT)
+    output, err = process.communicate()
+    elapsed = time.time() - start
+    totals = {}
+    if os.path.exists(profile):
+        with open(profile) as f:
+            totals = json.load(f)['totals']
+    error = None
+    if process.returncode != 0:
+        lines = output.decode('utf-8', 'replace').strip().splitlines()
+        error = lines[-1] if lines else 'exit code {0}'.format(process.returncode)
+    return elapsed, totals, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark adalink against fake programmer tools.')
+    parser.add_argument('--cores', nargs='*', help='Cores to benchmark (default all).')
+    parser.add_argument('--programmers', nargs='*', help='Programmers to benchmark (default all).')
+    parser.add_argument('--operations', nargs='*', choices=[o[0] for o in OPERATIONS],
+                        help='Operations to benchmark (default all).')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each operation (default 3).')
+    parser.add_argument('--size', type=int, default=64*1024, help='Bytes to program (default 65536).')
+    parser.add_argument('--start-delay', default='0', help='Seconds for the fake tools to start, or MIN-MAX.')
+    parser.add_argument('--connect-delay', default='0', help='Seconds for the fake tools to connect, or MIN-MAX.')
+    parser.add_argument('--write-rate', default='0', help='Fake tool write speed in KiB/s (default unlimited).')
+    parser.add_argument('--json', help='Write the results to this JSON file.')
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='adalink-bench')
+    try:
+        hex_file = os.path.join(directory, 'test.hex')
+        write_hex(hex_file, options.size)
+        env = dict(os.environ)
+        env['PATH'] = make_fake_path(directory) + os.pathsep + env.get('PATH', '')
+        env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+        # Keep the tool discovery cache out of the user's cache folder.
+        env['ADALINK_CACHE_DIR'] = os.path.join(directory, 'cache')
+        for tool in ('JLINK', 'OPENOCD'):
+            env['FAKE_{0}_STATE'.format(tool)] = os.path.join(directory, tool.lower() + '.json')
+            env['FAKE_{0}_START_DELAY'.format(tool)] = options.start_delay
+            env['FAKE_{0}_WRITE_RATE'.format(tool)] = options.write_rate
+        env['FAKE_JLINK_CONNECT_DELAY'] = options.connect_delay
+        env['FAKE_OPENOCD_INIT_DELAY'] = options.connect_delay
+
+        results = []
+        print('{0:<12} {1:<8} {2:<8} {3:>9}  {4}'.format('Core', 'Prog', 'Op', 'Median', 'Phases'))
+        for core, programmers in list_cores():
+            if options.cores and core not in options.cores:
+                continue
+            for programmer in programmers:
+                if options.programmers and programmer not in options.programmers:
+                    continue
+                for name, make_args in OPERATIONS:
+                    if options.operations and name not in options.operations:
+                        continue
+                    args = [core, '--programmer', programmer] + make_args(hex_file)
+                    runs = [run_operation(args, env, directory) for i in range(options.repeat)]
+                    errors = [e for t, p, e in runs if e is not None]
+                    phases = {}
+                    for t, totals, e in runs:
+                        for phase, seconds in totals.items():
+                            phases.setdefault(phase, []).append(seconds)
+                    result = {
+                        'core': core,
+                        'programmer': programmer,
+                        'operation': name,
+                        'median': median([t for t, p, e in runs]),
+                        'min': min(t for t, p, e in runs),
+                        'phases': dict((p, median(s)) for p, s in phases.items()),
+                        'error': errors[0] if errors else None
+                    }
+                    results.append(result)
+                    detail = result['error'] or ' '.join(
+                        '{0}={1:.3f}'.format(p, s) for p, s in sorted(result['phases'].items()))
+                    print('{0:<12} {1:<8} {2:<8} {3:>8.3f}s  {4}'.format(
+                        core, programmer, name, result['median'], detail))
+                    sys.stdout.flush()
+        if options.json:
+            with open(options.json, 'w') as f:
+                json.dump({'options': vars(options), 'results': results}, f, indent=2,
+                          sort_keys=True)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
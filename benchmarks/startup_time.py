@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# adalink startup time benchmark.
+#
+# Measures how long adalink takes to start, which is paid by every call when a
+# script runs adalink in a loop.  Each command is run a number of times in a
+# fresh Python process and the median wall-clock time is reported, along with
+# the number of modules imported.  With --imports the slowest imports of each
+# command are listed too (needs Python 3.7 or greater for -X importtime).
+#
+#   python benchmarks/startup_time.py --repeat 20 --imports 5
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Commands to measure as (name, Python code run in a fresh process).  Code is
+# used instead of running adalink directly so the modules it imported can be
+# counted afterwards.
+COMMANDS = [
+    ('import', 'import adalink.main'),
+    ('help', 'import adalink.main; adalink.main.main(["--help"])'),
+    ('core-help', 'import adalink.main; adalink.main.main(["nrf51822", "--help"])'),
+    ('sim-read', 'import adalink.main; adalink.main.main(["nrf51822", "-p", "sim", "-r32", "0"])'),
+]
+
+# Wrapper that runs a command and prints how many modules it imported to
+# stderr, even when click exits.
+WRAPPER = '''
+import sys
+try:
+    exec({0!r})
+except SystemExit:
+    pass
+sys.stderr.write("modules=%d\\n" % len(sys.modules))
+'''
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle-1] + values[middle]) / 2.0
+
+
+def run(code, env, importtime=False):
+    """Run the code in a fresh Python process and return (seconds, modules
+    imported, stderr output).
+    """
+    args = [sys.executable]
+    if importtime:
+        args.extend(['-X', 'importtime'])
+    args.extend(['-c', WRAPPER.format(code)])
+    start = time.time()
+    process = subprocess.Popen(args, cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    output, err = process.communicate()
+    elapsed = time.time() - start
+    err = err.decode('utf-8', 'replace')
+    if process.returncode != 0:
+        raise RuntimeError('Command failed: {0}\n{1}'.format(code, err))
+    modules = None
+    for line in err.splitlines():
+        if line.startswith('modules='):
+            modules = int(line.split('=')[1])
+    return elapsed, modules, err
+
+
+def slowest_imports(err, count):
+    """Return the count slowest (cumulative microseconds, module) top level
+    and second level imports from -X importtime output.
+    """
+    imports = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented under the module that imported them,
+        # keep the modules imported directly and the ones they import.
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        if depth <= 1:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark how long adalink takes to start.')
+    parser.add_argument('--repeat', type=int, default=10, help='Runs of each command (default 10).')
+    parser.add_argument('--imports', type=int, default=0, metavar='COUNT',
+                        help='List the COUNT slowest imports of each command.')
+    parser.add_argument('--json', help='Write the results to this JSON file.')
+    options = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    baseline = median([run('pass', env)[0] for i in range(options.repeat)])
+    print('Python startup: {0:.3f}s'.format(baseline))
+    print('{0:<10} {1:>9} {2:>9} {3:>8}'.format('Command', 'Median', 'Adalink', 'Modules'))
+    results = []
+    for name, code in COMMANDS:
+        runs = [run(code, env) for i in range(options.repeat)]
+        result = {
+            'command': name,
+            'median': median([t for t, m, e in runs]),
+            'min': min(t for t, m, e in runs),
+            'modules': runs[0][1]
+        }
+        # Time spent by adalink on top of starting Python itself.
+        result['adalink'] = result['median'] - baseline
+        if options.imports > 0:
+            err = run(code, env, importtime=True)[2]
+            result['imports'] = slowest_imports(err, options.imports)
+        results.append(result)
+        print('{0:<10} {1:>8.3f}s {2:>8.3f}s {3:>8}'.format(
+            name, result['median'], result['adalink'], result['modules']))
+        for cumulative, module in result.get('imports', []):
+            print('    {0:>8.1f}ms  {1}'.format(cumulative / 1000.0, module))
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'options': vars(options), 'python': baseline,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
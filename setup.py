@@ -13,5 +13,6 @@ setup(name              = 'adalink',
       license           = 'MIT',
       url               = 'https://github.com/adafruit/Adafruit_Adalink',
       install_requires  = ['Click'],
+      extras_require    = {'yaml': ['PyYAML']},
       entry_points      = {'console_scripts': ['adalink = adalink.main:main']},
       packages          = find_packages())
@@ -0,0 +1,87 @@
+# adalink command line tests.
+#
+# Runs the adalink command for a core against the fake JLinkExe and OpenOCD
+# tools in the tools folder, and the simulated programmer, to check the common
+# commands work end to end without a probe attached.  Run with:
+#
+#   python -m unittest discover tests
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOOLS = os.path.join(ROOT, 'tools')
+
+
+class CommandLineTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Put links to the fake tools named like the real ones ahead of the
+        # PATH, with their simulated memory kept in the temporary folder.
+        cls.directory = tempfile.mkdtemp()
+        bin_dir = os.path.join(cls.directory, 'bin')
+        os.mkdir(bin_dir)
+        os.symlink(os.path.join(TOOLS, 'fake_jlinkexe.py'), os.path.join(bin_dir, 'JLinkExe'))
+        os.symlink(os.path.join(TOOLS, 'fake_openocd.py'), os.path.join(bin_dir, 'openocd'))
+        cls.env = dict(os.environ,
+                       PATH=bin_dir + os.pathsep + os.environ.get('PATH', ''),
+                       ADALINK_CACHE_DIR=cls.directory,
+                       FAKE_JLINK_STATE=os.path.join(cls.directory, 'jlink.json'),
+                       FAKE_OPENOCD_STATE=os.path.join(cls.directory, 'openocd.json'))
+        cls.hex_file = os.path.join(cls.directory, 'app.hex')
+        with open(cls.hex_file, 'w') as f:
+            f.write(':10100000000102030405060708090A0B0C0D0E0F68\n')
+            f.write(':00000001FF\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def adalink(self, *args):
+        """Run adalink with the provided arguments and return its output,
+        failing the test if it doesn't succeed.
+        """
+        process = subprocess.Popen([sys.executable, '-m', 'adalink.main'] + list(args),
+                                   cwd=ROOT, env=self.env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.communicate()[0].decode('utf-8', 'replace')
+        self.assertEqual(process.returncode, 0, output)
+        return output
+
+    def test_connect(self):
+        for programmer in ('jlink', 'stlink', 'sim'):
+            self.adalink('nrf51822', '--programmer', programmer)
+
+    def test_info(self):
+        for programmer in ('jlink', 'stlink', 'sim'):
+            output = self.adalink('nrf51822', '--programmer', programmer, '--info')
+            self.assertIn('Device ID', output)
+
+    def test_program(self):
+        for programmer in ('jlink', 'stlink'):
+            self.adalink('nrf51822', '--programmer', programmer, '--wipe',
+                         '--program-hex', self.hex_file)
+            output = self.adalink('nrf51822', '--programmer', programmer,
+                                  '--read-mem-32', '0x1000')
+            self.assertEqual(output.strip(), '0x3020100')
+
+    def test_program_verify(self):
+        output = self.adalink('nrf51822', '--programmer', 'sim', '--wipe',
+                              '--program-hex', self.hex_file, '--verify')
+        self.assertIn('Verified 16 bytes.', output)
+
+    def test_read_order(self):
+        output = self.adalink('nrf51822', '--programmer', 'sim', '-r32', '0x10000100',
+                              '-r8', '0x10000100')
+        lines = output.split()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(int(lines[0], 16) & 0xFF, int(lines[1], 16))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# Fake Segger JLinkExe for exercising adalink without a probe attached.
+#
+# Behaves like JLinkExe closely enough for adalink: it accepts the same
+# command line parameters, runs a command script when one is passed as the
+# last argument and otherwise reads commands interactively from stdin while
+# printing the 'J-Link>' prompt.  Target memory is simulated in-process and
+# unwritten memory reads back as erased flash (0xFF).
+#
+# Behavior can be tuned with environment variables:
+#   FAKE_JLINK_MEMORY   - Path to a JSON file with {"address": value} words
+#                         (strings like "0x10000100") to seed memory with.
+#   FAKE_JLINK_STATE    - Path to a file used to persist target memory between
+#                         runs, so a later read sees what an earlier run wrote.
+#                         Any {serial} in the path is replaced with the serial
+#                         number from -SelectEmuBySN to keep probes separate.
+#   FAKE_JLINK_FOUND    - Core string printed after 'Found' on connect.  By
+#                         default it is derived from the -device parameter.
+#   FAKE_JLINK_NO_TARGET - Set to 1 to simulate a probe with no target.
+#   FAKE_JLINK_CONNECT_DELAY - Seconds to wait when connecting to the target,
+#                         or a MIN-MAX range to pick a random delay from.
+#   FAKE_JLINK_FAIL_SERIALS - Comma separated probe serial numbers which act
+#                         like they have no target connected.
+#   FAKE_JLINK_START_DELAY - Seconds JLinkExe takes to start up, or a MIN-MAX
+#                         range to pick a random delay from.
+#   FAKE_JLINK_WRITE_RATE - Speed in KiB/s to simulate loading files at.
+#
+# To use it with adalink put a copy or link of this script named JLinkExe
+# ahead of the real one in the PATH.
+import os
+import sys
+import time
+
+from fake_target import (Memory, parse_hex, probe_fails, simulate_latency,
+                         simulate_write, state_path)
+
+
+# Core names reported on connect for the -device names adalink uses.
+DEVICE_CORES = {
+    'nrf51822': 'Cortex-M0 r0p0, Little endian',
+    'nrf52832': 'Cortex-M4 r0p1, Little endian',
+    'nrf52840': 'Cortex-M4 r0p1, Little endian',
+    'lpc824':   'Cortex-M0 r0p0, Little endian',
+    'lpc1343':  'Cortex-M3 r2p0, Little endian',
+    'atsamd21': 'Cortex-M0 r0p1, Little endian',
+    'stm32f2':  'Cortex-M3 r2p0, Little endian',
+}
+
+PROMPT = 'J-Link>'
+
+
+class FakeJLink(object):
+
+    def __init__(self, device, serial=None):
+        self.memory = Memory()
+        self.device = device
+        self.serial = serial
+        self.state = state_path('FAKE_JLINK_STATE', serial)
+        if self.state:
+            self.memory.load(self.state)
+        seed = os.environ.get('FAKE_JLINK_MEMORY')
+        if seed:
+            self.memory.seed(seed)
+        self.connected = False
+
+    def connect(self):
+        simulate_latency('FAKE_JLINK_CONNECT_DELAY')
+        if os.environ.get('FAKE_JLINK_NO_TARGET') == '1' or \
+           probe_fails('FAKE_JLINK_FAIL_SERIALS', self.serial):
+            self.connected = False
+            return 'Cannot connect to target.\n'
+        self.connected = True
+        found = os.environ.get('FAKE_JLINK_FOUND')
+        if found is None:
+            found = 'Cortex-M0 r0p0, Little endian'
+            for prefix, core in DEVICE_CORES.items():
+                if self.device.lower().startswith(prefix):
+                    found = core
+        return ('Device "{0}" selected.\n'
+                'Found SW-DP with ID 0x0BB11477\n'
+                'Found {1}.\n'.format(self.device.upper(), found))
+
+    def ensure_connected(self):
+        if not self.connected:
+            return self.connect()
+        return ''
+
+    def execute(self, line):
+        """Run a single command and return (output, quit)."""
+        parts = line.replace(',', ' ').split()
+        if not parts:
+            return '', False
+        cmd = parts[0].lower()
+        args = parts[1:]
+        if cmd in ('q', 'qc', 'exit'):
+            return '', True
+        if cmd == 'connect':
+            return self.connect(), False
+        if cmd == 'sleep':
+            time.sleep(int(args[0]) / 1000.0)
+            return 'Sleep({0})\n'.format(args[0]), False
+        output = self.ensure_connected()
+        if cmd in ('r', 'reset'):
+            return output + 'Reset delay: 0 ms\nReset device via AIRCR.SYSRESETREQ.\n', False
+        if cmd in ('g', 'go', 'h', 'halt'):
+            return output, False
+        if cmd == 'erase' and args:
+            start, end = int(args[0], 16), int(args[1], 16)
+            self.memory.erase_range(start, end - start + 1)
+            return output + 'Erasing selected range...\nErasing done.\n', False
+        if cmd == 'erase':
+            self.memory.erase()
+            return output + 'Erasing device...\nErasing done.\n', False
+        if cmd in ('mem8', 'mem16', 'mem32'):
+            return output + self.mem(int(cmd[3:]) // 8, int(args[0], 16), int(args[1], 16)), False
+        if cmd in ('w1', 'w2', 'w4'):
+            self.memory.write_word(int(args[0], 16), int(args[1], 16), int(cmd[1]))
+            return output + 'Writing {0} -> {1}\n'.format(args[0], args[1]), False
+        if cmd == 'loadfile':
+            path = line.split(None, 1)[1].strip().strip('"')
+            if path.lower().endswith('.hex'):
+                records = parse_hex(path)
+            else:
+                with open(path, 'rb') as f:
+                    records = [(0, bytearray(f.read()))]
+            return output + self.download(path, records), False
+        if cmd == 'loadbin':
+            path, address = self.file_args(line)
+            with open(path, 'rb') as f:
+                return output + self.download(path, [(address, bytearray(f.read()))]), False
+        if cmd == 'verifybin':
+            path, address = self.file_args(line)
+            with open(path, 'rb') as f:
+                data = bytearray(f.read())
+            output += ('Loading binary file {0}\n'
+                       'Reading {1} bytes data from target memory @ 0x{2:08X}.\n'.format(
+                           path, len(data), address))
+            actual = self.memory.read(address, len(data))
+            for i in range(len(data)):
+                if actual[i] != data[i]:
+                    return output + 'Verify failed @ address 0x{0:08X}.\n'.format(address + i), False
+            return output + 'Verify successful.\n', False
+        if cmd == 'savebin':
+            path, address, count = self.file_args(line)
+            with open(path, 'wb') as f:
+                f.write(self.memory.read(address, count))
+            return output + ('Opening binary file for writing... [{0}]\n'
+                             'Reading {1} bytes from addr 0x{2:08X} into file...O.K.\n'.format(
+                                 path, count, address)), False
+        return output + 'Unknown command: {0}\n'.format(cmd), False
+
+    def download(self, path, records):
+        # Write the records to memory and report it like a JLinkExe flash
+        # download.
+        count = 0
+        for address, data in records:
+            self.memory.write(address, data)
+            count += len(data)
+        seconds, rate = simulate_write('FAKE_JLINK_WRITE_RATE', count)
+        start = min(address for address, data in records) if records else 0
+        return ('Downloading file [{0}]...\n'
+                'J-Link: Flash download: Bank 0 @ 0x{1:08X}: 1 range affected ({2} bytes)\n'
+                'J-Link: Flash download: Total: {3:.3f}s (Prepare: 0.000s, Compare: 0.000s, '
+                'Erase: 0.000s, Program & Verify: {3:.3f}s, Restore: 0.000s)\n'
+                'J-Link: Flash download: Program & Verify speed: {4} KiB/s\n'
+                'O.K.\n'.format(path, start, count, seconds, int(rate)))
+
+    def file_args(self, line):
+        # Parse '<cmd> "path" 0xADDR' style arguments, path may contain spaces.
+        rest = line.split(None, 1)[1].strip()
+        if rest.startswith('"'):
+            end = rest.index('"', 1)
+            path, rest = rest[1:end], rest[end+1:]
+        else:
+            path, rest = rest.split(None, 1)
+        values = [int(x, 16) for x in rest.replace(',', ' ').split()]
+        return [path] + values
+
+    def mem(self, size, address, count):
+        # Print like JLinkExe, 16 bytes of memory per line.
+        per_line = 16 // size
+        lines = []
+        for i in range(0, count, per_line):
+            start = address + i*size
+            words = ['{0:0{1}X}'.format(self.memory.read_word(start + j*size, size), size*2)
+                     for j in range(min(per_line, count - i))]
+            lines.append('{0:08X} = {1} \n'.format(start, ' '.join(words)))
+        return ''.join(lines)
+
+    def finish(self):
+        if self.state:
+            self.memory.save(self.state)
+
+
+def main(argv):
+    if '?' in argv:
+        sys.stdout.write('SEGGER J-Link Commander (fake)\nAvailable commands are: ...\n')
+        return 0
+    device = 'unspecified'
+    serial = None
+    autoconnect = False
+    script = None
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith('-'):
+            value = argv[i+1] if i + 1 < len(argv) else ''
+            if arg.lower() == '-device':
+                device = value
+            elif arg.lower() == '-autoconnect':
+                autoconnect = value == '1'
+            elif arg.lower() == '-selectemubysn':
+                serial = value
+            elif arg.lower() == '-commanderscript':
+                script = value
+            i += 2
+        else:
+            script = arg
+            i += 1
+    simulate_latency('FAKE_JLINK_START_DELAY')
+    jlink = FakeJLink(device, serial)
+    out = sys.stdout
+    out.write('SEGGER J-Link Commander (fake)\nConnecting to J-Link via USB...O.K.\n')
+    if autoconnect:
+        out.write(jlink.connect())
+    try:
+        if script is not None:
+            # Script mode echoes each command after the prompt.
+            with open(script) as f:
+                commands = f.read().splitlines()
+            for c in commands:
+                out.write('{0}{1}\n'.format(PROMPT, c))
+                output, done = jlink.execute(c)
+                out.write(output)
+                out.flush()
+                if done:
+                    break
+        else:
+            # Interactive mode prints the prompt and waits for a command.
+            while True:
+                out.write(PROMPT)
+                out.flush()
+                line = sys.stdin.readline()
+                if not line:
+                    break
+                output, done = jlink.execute(line.strip())
+                out.write(output)
+                if done:
+                    break
+    finally:
+        jlink.finish()
+    out.write('\nScript processing completed.\n')
+    out.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# Fake OpenOCD for exercising adalink without a probe attached.
+#
+# Runs the -f/-c commands it is started with like OpenOCD, printing results in
+# the same format.  If the commands don't end with exit or shutdown it keeps
+# running as a server and answers commands on its TCL RPC port with the
+# 0x1a terminated framing OpenOCD uses.  Target memory is simulated in-process
+# and unwritten memory reads back as erased flash (0xFF).
+#
+# Behavior can be tuned with environment variables:
+#   FAKE_OPENOCD_MEMORY    - Path to a JSON file with {"address": value} words
+#                            (strings like "0x10000100") to seed memory with.
+#   FAKE_OPENOCD_STATE     - Path to a file used to persist target memory
+#                            between runs.  Any {serial} in the path is
+#                            replaced with the probe serial number.
+#   FAKE_OPENOCD_NO_TARGET - Set to 1 to make init fail like OpenOCD does
+#                            when no target is found.
+#   FAKE_OPENOCD_VERSION   - Version to behave like (default 0.11.0).  Before
+#                            0.11 there is no capture command or checksum
+#                            verify.
+#   FAKE_OPENOCD_INIT_DELAY - Seconds to wait when initializing the target,
+#                            or a MIN-MAX range to pick a random delay from.
+#   FAKE_OPENOCD_FAIL_SERIALS - Comma separated probe serial numbers which act
+#                            like they have no target connected.
+#   FAKE_OPENOCD_START_DELAY - Seconds OpenOCD takes to start up, or a MIN-MAX
+#                            range to pick a random delay from.
+#   FAKE_OPENOCD_WRITE_RATE - Speed in KiB/s to simulate writing images at.
+#
+# To use it with adalink put a copy or link of this script named openocd
+# ahead of the real one in the PATH.
+import os
+import socket
+import sys
+import time
+
+from fake_target import (Memory, parse_hex, probe_fails, simulate_latency,
+                         simulate_write, state_path)
+
+
+TERMINATOR = b'\x1a'
+
+
+class CommandError(Exception):
+    pass
+
+
+def split_commands(line):
+    """Split a line of Tcl into commands on ';' and newlines outside of braces
+    and brackets.
+    """
+    commands = []
+    depth = 0
+    current = ''
+    for c in line:
+        if c in '{[':
+            depth += 1
+        elif c in '}]':
+            depth -= 1
+        if c in ';\n' and depth == 0:
+            commands.append(current.strip())
+            current = ''
+        else:
+            current += c
+    commands.append(current.strip())
+    return [c for c in commands if c]
+
+
+def split_words(command):
+    """Split a Tcl command into words, keeping braced words together."""
+    words = []
+    depth = 0
+    current = ''
+    for c in command:
+        if c == '{':
+            depth += 1
+            if depth == 1:
+                continue
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                continue
+        if c.isspace() and depth == 0:
+            if current:
+                words.append(current)
+            current = ''
+        else:
+            current += c
+    if current:
+        words.append(current)
+    return words
+
+
+class FakeOpenOCD(object):
+
+    def __init__(self):
+        self.memory = Memory()
+        self.serial = None
+        self.state = None
+        seed = os.environ.get('FAKE_OPENOCD_MEMORY')
+        if seed:
+            self.memory.seed(seed)
+        version = os.environ.get('FAKE_OPENOCD_VERSION', '0.11.0')
+        self.version = tuple(int(x) for x in version.split('.')[:2])
+        self.initialized = False
+        self.tcl_port = 6666
+        self.done = False
+
+    def init(self):
+        if self.initialized:
+            return ''
+        simulate_latency('FAKE_OPENOCD_INIT_DELAY')
+        if os.environ.get('FAKE_OPENOCD_NO_TARGET') == '1' or \
+           probe_fails('FAKE_OPENOCD_FAIL_SERIALS', self.serial):
+            raise CommandError('open failed')
+        # The probe serial is known once configuration is done, so load the
+        # memory of that probe's target now.
+        self.state = state_path('FAKE_OPENOCD_STATE', self.serial)
+        if self.state:
+            self.memory.load(self.state)
+        self.initialized = True
+        return ''
+
+    def capture(self, command):
+        """Run a command with the capture command, which OpenOCD only has from
+        0.11.
+        """
+        if self.version < (0, 11):
+            raise CommandError('invalid command name "capture"')
+        return self.execute(command)
+
+    def execute(self, command):
+        """Run a single command and return its output, raising CommandError
+        on failure.
+        """
+        words = split_words(command)
+        if not words:
+            return ''
+        cmd, args = words[0], words[1:]
+        if cmd == 'hla_serial' or (cmd == 'adapter' and args and args[0] == 'serial'):
+            self.serial = args[-1]
+            return ''
+        if cmd in ('set', 'source', 'transport', 'adapter_nsrst_delay',
+                   'adapter_nsrst_assert_width', 'gdb_port', 'telnet_port',
+                   'adapter', 'proc', 'reset_config'):
+            return ''
+        if cmd == 'tcl_port':
+            self.tcl_port = int(args[0])
+            return ''
+        if cmd in ('exit', 'shutdown'):
+            self.done = True
+            return 'shutdown command invoked\n'
+        if cmd == 'adalink_run':
+            # Like the procedure adalink defines, run the command with capture.
+            try:
+                return self.capture(args[0])
+            except CommandError as ex:
+                return 'Error: {0}'.format(ex)
+        if cmd == 'capture':
+            return self.capture(args[0])
+        if cmd == 'init':
+            return self.init()
+        if cmd == 'echo':
+            return ' '.join(args) + '\n'
+        self.init()
+        if cmd == 'sleep':
+            time.sleep(int(args[0]) / 1000.0)
+            return ''
+        if cmd in ('reset', 'halt', 'resume'):
+            return ''
+        if cmd in ('mdw', 'mdh', 'mdb'):
+            size = {'mdw': 4, 'mdh': 2, 'mdb': 1}[cmd]
+            count = int(args[1], 0) if len(args) > 1 else 1
+            return self.md(size, int(args[0], 0), count)
+        if cmd in ('mww', 'mwh', 'mwb'):
+            size = {'mww': 4, 'mwh': 2, 'mwb': 1}[cmd]
+            self.memory.write_word(int(args[0], 0), int(args[1], 0), size)
+            return ''
+        if cmd in ('nrf51', 'stm32f2x', 'at91samd'):
+            if args and args[0] in ('mass_erase', 'chip-erase'):
+                self.memory.erase()
+                return ''
+            raise CommandError('invalid command name "{0}"'.format(command))
+        if cmd == 'flash' and args and args[0] == 'erase_address':
+            address, length = int(args[1], 0), int(args[2], 0)
+            self.memory.erase_range(address, length)
+            return 'erased address 0x{0:08x} (length {1}) in 0.010000s (100.000 KiB/s)\n'.format(
+                address, length)
+        if cmd == 'flash' and args and args[0] == 'write_image':
+            args = [a for a in args[1:] if a not in ('erase', 'unlock')]
+            return self.load(*args)
+        if cmd == 'load_image':
+            return self.load(*args)
+        if cmd == 'dump_image':
+            path, address, count = args[0], int(args[1], 0), int(args[2], 0)
+            with open(path, 'wb') as f:
+                f.write(self.memory.read(address, count))
+            return 'dumped {0} bytes in 0.010000s (100.000 KiB/s)\n'.format(count)
+        if cmd == 'verify_image_checksum' and self.version < (0, 11):
+            raise CommandError('invalid command name "{0}"'.format(cmd))
+        if cmd in ('verify_image', 'verify_image_checksum'):
+            path, offset, kind = args[0], int(args[1], 0), args[2]
+            count = 0
+            for address, data in self.records(path, offset, kind):
+                if self.memory.read(address, len(data)) != data:
+                    raise CommandError('checksum mismatch - attempting binary compare')
+                count += len(data)
+            return 'verified {0} bytes in 0.010000s (100.000 KiB/s)\n'.format(count)
+        raise CommandError('invalid command name "{0}"'.format(cmd))
+
+    def records(self, path, offset, kind):
+        if kind == 'ihex':
+            return [(address + offset, data) for address, data in parse_hex(path)]
+        with open(path, 'rb') as f:
+            return [(offset, bytearray(f.read()))]
+
+    def load(self, path, offset='0', kind='bin'):
+        count = 0
+        for address, data in self.records(path, int(offset, 0), kind):
+            self.memory.write(address, data)
+            count += len(data)
+        seconds, rate = simulate_write('FAKE_OPENOCD_WRITE_RATE', count)
+        return 'wrote {0} bytes from file {1} in {2:.6f}s ({3:.3f} KiB/s)\n'.format(
+            count, path, seconds, rate)
+
+    def md(self, size, address, count):
+        # Print like OpenOCD, 32 bytes of memory per line.
+        per_line = 32 // size
+        lines = []
+        for i in range(0, count, per_line):
+            start = address + i*size
+            words = ['{0:0{1}x}'.format(self.memory.read_word(start + j*size, size), size*2)
+                     for j in range(min(per_line, count - i))]
+            lines.append('0x{0:08x}: {1} \n'.format(start, ' '.join(words)))
+        return ''.join(lines)
+
+    def finish(self):
+        if self.state:
+            self.memory.save(self.state)
+
+    def serve(self):
+        # Answer TCL RPC commands until shutdown is requested.
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(('127.0.0.1', self.tcl_port))
+        server.listen(1)
+        sys.stderr.write('Info : Listening on port {0} for tcl connections\n'.format(self.tcl_port))
+        sys.stderr.flush()
+        while not self.done:
+            conn, _ = server.accept()
+            buffer = b''
+            while not self.done:
+                data = conn.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                while TERMINATOR in buffer and not self.done:
+                    line, buffer = buffer.split(TERMINATOR, 1)
+                    try:
+                        output = ''.join(self.execute(c) for c in
+                                         split_commands(line.decode('utf-8')))
+                    except CommandError as ex:
+                        output = str(ex)
+                    conn.sendall(output.encode('utf-8') + TERMINATOR)
+                    # Save state after every command so it survives a kill.
+                    self.finish()
+            conn.close()
+        server.close()
+
+
+def main(argv):
+    if '--version' in argv or '-v' in argv:
+        version = os.environ.get('FAKE_OPENOCD_VERSION', '0.11.0')
+        sys.stderr.write('Open On-Chip Debugger {0} (fake)\n'.format(version))
+        return 0
+    simulate_latency('FAKE_OPENOCD_START_DELAY')
+    ocd = FakeOpenOCD()
+    out = sys.stdout
+    i = 0
+    try:
+        while i < len(argv) and not ocd.done:
+            arg = argv[i]
+            if arg in ('-f', '-s', '-d', '-l') and i + 1 < len(argv):
+                i += 2
+                continue
+            if arg == '-c' and i + 1 < len(argv):
+                for c in split_commands(argv[i+1]):
+                    out.write(ocd.execute(c))
+                    out.flush()
+                    if ocd.done:
+                        break
+                i += 2
+                continue
+            i += 1
+        if not ocd.done:
+            out.write(ocd.init())
+            out.flush()
+            ocd.serve()
+    except CommandError as ex:
+        out.write('Error: {0}\n'.format(ex))
+        return 1
+    finally:
+        ocd.finish()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,142 @@
+# Simulated target memory shared by the fake programmer tools.
+import json
+import os
+import random
+import time
+
+
+PAGE_SIZE = 4096
+
+
+class Memory(object):
+    """Sparse byte addressable memory stored as 4KB pages."""
+
+    def __init__(self):
+        self.pages = {}
+
+    def read(self, address, length):
+        data = bytearray()
+        while length > 0:
+            page, offset = divmod(address, PAGE_SIZE)
+            count = min(length, PAGE_SIZE - offset)
+            if page in self.pages:
+                data.extend(self.pages[page][offset:offset+count])
+            else:
+                data.extend(b'\xFF' * count)
+            address += count
+            length -= count
+        return data
+
+    def write(self, address, data):
+        data = bytearray(data)
+        while data:
+            page, offset = divmod(address, PAGE_SIZE)
+            count = min(len(data), PAGE_SIZE - offset)
+            if page not in self.pages:
+                self.pages[page] = bytearray(b'\xFF' * PAGE_SIZE)
+            self.pages[page][offset:offset+count] = data[:count]
+            address += count
+            data = data[count:]
+
+    def read_word(self, address, size):
+        data = self.read(address, size)
+        return sum(data[i] << (8*i) for i in range(size))
+
+    def write_word(self, address, value, size):
+        self.write(address, bytearray((value >> (8*i)) & 0xFF for i in range(size)))
+
+    def seed(self, path):
+        # Write {"address": value} words from a JSON file into memory.
+        with open(path) as f:
+            for address, value in json.load(f).items():
+                value = value if isinstance(value, int) else int(value, 0)
+                self.write_word(int(address, 0), value, 4)
+
+    def erase(self):
+        self.pages = {}
+
+    def erase_range(self, address, length):
+        self.write(address, b'\xFF' * length)
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            state = json.load(f)
+        for page, data in state.items():
+            self.pages[int(page)] = bytearray.fromhex(data)
+
+    def save(self, path):
+        state = {}
+        for page, data in self.pages.items():
+            state[str(page)] = ''.join('{0:02x}'.format(x) for x in data)
+        with open(path, 'w') as f:
+            json.dump(state, f)
+
+
+def parse_hex(path):
+    """Return a list of (address, data) records from an Intel HEX file."""
+    records = []
+    base = 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith(':'):
+                continue
+            raw = bytearray.fromhex(line[1:])
+            count, address, kind = raw[0], (raw[1] << 8) | raw[2], raw[3]
+            data = raw[4:4+count]
+            if kind == 0:
+                records.append((base + address, data))
+            elif kind == 2:
+                base = ((data[0] << 8) | data[1]) << 4
+            elif kind == 4:
+                base = ((data[0] << 8) | data[1]) << 16
+            elif kind == 1:
+                break
+    return records
+
+
+def simulate_latency(variable):
+    """Sleep for the latency configured in the named environment variable,
+    either a number of seconds or a 'MIN-MAX' range to pick randomly from.
+    """
+    value = os.environ.get(variable)
+    if not value:
+        return
+    if '-' in value:
+        low, high = value.split('-', 1)
+        time.sleep(random.uniform(float(low), float(high)))
+    else:
+        time.sleep(float(value))
+
+
+def simulate_write(variable, count):
+    """Sleep for as long as writing count bytes takes at the speed in KiB/s
+    from the named environment variable (no delay if it isn't set), and return
+    the (seconds, KiB/s) to report for the write.
+    """
+    rate = float(os.environ.get(variable) or 0)
+    if rate <= 0:
+        return 0.01, count / 1024.0 / 0.01
+    seconds = count / 1024.0 / rate
+    time.sleep(seconds)
+    return seconds, rate
+
+
+def probe_fails(variable, serial):
+    """Return true if the serial is in the comma separated list of failing
+    probe serials in the named environment variable.
+    """
+    failing = os.environ.get(variable, '')
+    return serial is not None and serial in [s.strip() for s in failing.split(',')]
+
+
+def state_path(variable, serial):
+    """Return the memory state file path from the named environment variable,
+    with any {serial} in it replaced by the probe serial.
+    """
+    path = os.environ.get(variable)
+    if path:
+        path = path.replace('{serial}', serial or 'default')
+    return path